@@ -0,0 +1,66 @@
+import asyncio
+from datetime import date, timedelta
+from pathlib import Path
+from logging import getLogger, basicConfig, INFO
+
+import aiosqlite
+import yaml
+
+from dao.database import Database
+from dao.dao_utils import set_slow_query_threshold, dump_sql_stats
+from dao.maintenance import archive_articles, archive_videos, ARCHIVE_BATCH_SIZE
+from dao.publication import create_table_publications, get_published_ids
+from dao.maintenance import optimize_database, enable_incremental_vacuum
+
+
+LOGGER = getLogger(__name__)
+LOGGER.setLevel('INFO')
+basicConfig(level=INFO)
+
+
+async def main():
+    config_file = Path() / 'config.yaml'
+    if not config_file.exists():
+        LOGGER.error(f'配置文件 {config_file} 不存在')
+        return
+    config: dict = yaml.safe_load(config_file.read_text(encoding='utf-8'))
+    sqlite_config = config.get('sqlite', {})
+    archive_config = config.get('archive', {})
+    set_slow_query_threshold(sqlite_config.pop('slow_query_threshold', None))
+    sqlite_config.setdefault('archive', archive_config.get('path', 'archive.db'))
+    # 第一步：开启增量vacuum，只有第一次需要VACUUM，要在别的连接打开之前做
+    async with aiosqlite.connect('data.db') as conn:
+        await enable_incremental_vacuum(conn)
+    before = (date.today() - timedelta(days=archive_config.get('older_than_days', 180))).isoformat()
+    batch_size = archive_config.get('batch_size', ARCHIVE_BATCH_SIZE)
+    async with Database('data.db', **sqlite_config) as db:
+        # 第二步：把发布时间早于before的文章和视频，以及已经发布成功过的文章和视频搬到归档库
+        published_articles: list[str] | None = None
+        published_videos: list[str] | None = None
+        if archive_config.get('published', True):
+            await db.write(create_table_publications)
+            published_articles = await db.read(get_published_ids, ('weitoutiao', 'article'))
+            published_videos = await db.read(get_published_ids, ('video',))
+        LOGGER.info(f'归档 {before} 之前发布的，以及已经发布成功过的文章和视频')
+        # 每次只搬一批，一批一个写操作，归档期间别的写操作不会一直等着
+        moved = 0
+        while n := await db.write(
+            archive_articles, uploaded_before=before, ids=published_articles,
+            batch_size=batch_size, limit=batch_size,
+        ):
+            moved += n
+        LOGGER.info(f'已归档 {moved} 篇文章')
+        moved = 0
+        while n := await db.write(
+            archive_videos, uploaded_before=before, ids=published_videos,
+            batch_size=batch_size, limit=batch_size,
+        ):
+            moved += n
+        LOGGER.info(f'已归档 {moved} 个视频')
+        # 第三步：数据分布变了，重新统计索引，释放搬走后空出来的页
+        await db.write(optimize_database, analyze=True, vacuum_pages=0x7fffffff)
+    LOGGER.info(f'数据库调用统计：\n{dump_sql_stats()}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,58 @@
+import asyncio
+import gc
+import time
+
+import aiosqlite
+
+from dao.article import Article, create_table_article, insert_articles, get_articles, iter_articles
+
+
+'''
+dao层读文章的解码速度：get_articles和iter_articles，带和不带pydantic校验
+
+python -m benchmarks.decode
+'''
+
+
+# 测试用的文章数
+N = 100000
+
+
+async def main():
+    async with aiosqlite.connect(':memory:') as conn:
+        await create_table_article(conn)
+        await insert_articles(conn, (
+            Article(
+                id=f'{i:08d}',
+                title=f'标题{i}',
+                url=f'https://www.toutiao.com/article/{i}/',
+                category='测试',
+                keyword='测试',
+            )
+            for i in range(N)
+        ))
+        await conn.execute("UPDATE articles SET `like_count` = 1, `content_length` = 100")
+        await conn.commit()
+        for validate in (True, False):
+            # 取3次里最快的一次，避免gc的影响
+            best = 0.0
+            for _ in range(3):
+                gc.collect()
+                start = time.perf_counter()
+                articles = await get_articles(conn, validate=validate)
+                best = max(best, len(articles) / (time.perf_counter() - start))
+                del articles
+            print(f'get_articles(validate={validate}): {N} 行，{best:,.0f} 行/秒')
+            best = 0.0
+            for _ in range(3):
+                gc.collect()
+                start = time.perf_counter()
+                count = 0
+                async for _ in iter_articles(conn, validate=validate, batch_size=5000):
+                    count += 1
+                best = max(best, count / (time.perf_counter() - start))
+            print(f'iter_articles(validate={validate}): {N} 行，{best:,.0f} 行/秒')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,52 @@
+import time
+from pathlib import Path
+
+from scrape.extract import (
+    parse_search_html, parse_article_html, parse_uploader_html, parse_video_html, parse_login_html,
+)
+
+
+'''
+parse_*_html的bs4和lxml后端的计时，两个后端结果一致由tests/test_extract.py保证
+
+页面用tests/fixtures里保存的页面，真实页面有大量和提取无关的节点，在body末尾补上一些
+
+python -m benchmarks.extract
+'''
+
+
+FIXTURES = Path(__file__).parent.parent / 'tests' / 'fixtures'
+# 补多少个无关的节点
+NOISE = 2000
+
+
+def _page(name: str) -> str:
+    noise = ''.join(
+        f'<div class="feed-card c{i}"><span>推荐 {i}</span><!-- 注释 --><script>var x{i} = 1;</script></div>'
+        for i in range(NOISE)
+    )
+    html = (FIXTURES / f'{name}.html').read_text(encoding='utf-8')
+    return html.replace('</body>', f'{noise}</body>')
+
+
+def main():
+    cases = [
+        ('search', parse_search_html, _page('search')),
+        ('article', lambda html, backend: parse_article_html(html, True, backend), _page('article')),
+        ('uploader', parse_uploader_html, _page('uploader')),
+        ('video', parse_video_html, _page('video')),
+        ('login', parse_login_html, _page('login')),
+        ('empty', parse_search_html, ''),
+    ]
+    for name, func, html in cases:
+        for backend in ('bs4', 'lxml'):
+            best = float('inf')
+            for _ in range(3):
+                start = time.perf_counter()
+                func(html, backend)
+                best = min(best, time.perf_counter() - start)
+            print(f'{name:<8} {backend:<4} {best * 1000:8.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import sys
+import time
+from pathlib import Path
+
+from markdownify import markdownify
+
+from scrape.markdown import html_to_markdown
+
+
+'''
+html_to_markdown和markdownify的计时，两者结果逐字相同由tests/test_markdown.py保证
+
+默认把tests/fixtures/markdown里的样例拼成一篇长文章，也可以传保存下来的文章html
+
+python -m benchmarks.markdown [保存下来的文章html ...]
+'''
+
+
+FIXTURES = Path(__file__).parent.parent / 'tests' / 'fixtures' / 'markdown'
+
+
+def main():
+    # 不支持的标签会让整篇交给markdownify，计时的时候不要
+    paths = sys.argv[1:] or [path for path in sorted(FIXTURES.glob('*.html')) if path.stem != 'fallback']
+    bodies = [Path(path).read_text(encoding='utf-8').strip() for path in paths]
+    # 长文章：把所有样例重复拼起来
+    html = (
+        '<article class="syl-article-base">'
+        + ''.join(
+            body.removeprefix('<article class="syl-article-base">').removesuffix('</article>')
+            for body in bodies
+        ) * 50
+        + '</article>'
+    )
+    for name, func in (('markdownify', markdownify), ('html_to_markdown', html_to_markdown)):
+        best = float('inf')
+        for _ in range(5):
+            start = time.perf_counter()
+            func(html)
+            best = min(best, time.perf_counter() - start)
+        print(f'{name:<16} {len(html)}字符 {best * 1000:8.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
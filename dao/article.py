@@ -1,9 +1,15 @@
 import asyncio
+from typing import AsyncIterator, Iterable
+from itertools import batched
+import time
+import zlib
+import re
 
 from aiosqlite import Connection
 from pydantic import BaseModel
 
-from dao.dao_utils import relate_sql
+from dao.dao_utils import relate_sql, track_sql, split_sql, construct_model
+from dao.dao_utils import TrackedModel, update_dirty_fields
 
 
 @relate_sql("""--sql
@@ -15,8 +21,9 @@ CREATE TABLE IF NOT EXISTS articles (
     -- content使用md格式
     `category` TEXT NOT NULL,
     `keyword` TEXT NOT NULL,
-    -- 串联文字和图片 目前没发现有其他富文本
-    `content` TEXT NOT NULL DEFAULT '',
+    -- 正文的字数，0表示未获取
+    -- 正文本身压缩后存在article_contents表里，只查元数据时不会读到正文
+    `content_length` INTEGER NOT NULL DEFAULT 0,
     -- 点赞数 -1表示未获取
     `like_count` INTEGER NOT NULL DEFAULT -1,
     -- 评论数 -1表示未获取
@@ -29,22 +36,135 @@ CREATE TABLE IF NOT EXISTS articles (
     -- 上传者的粉丝数，初始为-1，表示未获取到
     "uploader_fans_count" INTEGER DEFAULT -1
 );
+-- 按分类、关键词判断是否已经搜索过时只需要读这个索引
+CREATE INDEX IF NOT EXISTS idx_articles_category_keyword
+ON articles (`category`, `keyword`);
+CREATE INDEX IF NOT EXISTS idx_articles_keyword
+ON articles (`keyword`);
+-- 选上传候选文章时按粉丝数范围扫这个索引，正文长度、分类和是否发布过在索引里就能判断，
+-- 只有选中的文章才回表。按粉丝数查询也用这个索引，原来的单列索引就不要了
+DROP INDEX IF EXISTS idx_articles_uploader_fans_count;
+CREATE INDEX IF NOT EXISTS idx_articles_upload_candidates
+ON articles (`uploader_fans_count`, `content_length`, `category`, `id`);
+CREATE TABLE IF NOT EXISTS article_contents (
+    `id` TEXT NOT NULL PRIMARY KEY,
+    -- zlib压缩后的正文，正文使用md格式，串联文字和图片 目前没发现有其他富文本
+    `content` BLOB NOT NULL
+);
+-- 全文索引用的分词结果，标题和正文都先用jieba分好词，词与词之间用空格隔开
+-- articles的rowid在VACUUM时可能会变，所以这里单独用一个自增的token_id做全文索引的rowid
+CREATE TABLE IF NOT EXISTS article_tokens (
+    `token_id` INTEGER PRIMARY KEY,
+    `id` TEXT NOT NULL UNIQUE,
+    `title` TEXT NOT NULL DEFAULT '',
+    `content` TEXT NOT NULL DEFAULT ''
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5(
+    `title`,
+    `content`,
+    content = 'article_tokens',
+    content_rowid = 'token_id'
+);
+-- 用触发器让全文索引和article_tokens保持同步
+CREATE TRIGGER IF NOT EXISTS article_tokens_ai AFTER INSERT ON article_tokens BEGIN
+    INSERT INTO articles_fts (rowid, `title`, `content`)
+    VALUES (new.`token_id`, new.`title`, new.`content`);
+END;
+CREATE TRIGGER IF NOT EXISTS article_tokens_ad AFTER DELETE ON article_tokens BEGIN
+    INSERT INTO articles_fts (articles_fts, rowid, `title`, `content`)
+    VALUES ('delete', old.`token_id`, old.`title`, old.`content`);
+END;
+CREATE TRIGGER IF NOT EXISTS article_tokens_au AFTER UPDATE ON article_tokens BEGIN
+    INSERT INTO articles_fts (articles_fts, rowid, `title`, `content`)
+    VALUES ('delete', old.`token_id`, old.`title`, old.`content`);
+    INSERT INTO articles_fts (rowid, `title`, `content`)
+    VALUES (new.`token_id`, new.`title`, new.`content`);
+END;
+-- 点赞数等互动数据的历史，每次更新这些数据都追加一行，不会覆盖
+CREATE TABLE IF NOT EXISTS article_snapshots (
+    `article_id` TEXT NOT NULL,
+    -- 秒级时间戳，0表示有快照表之前就爬到的数据，不知道是什么时候爬的
+    `ts` INTEGER NOT NULL,
+    `like_count` INTEGER NOT NULL,
+    `comment_count` INTEGER NOT NULL,
+    `collect_count` INTEGER NOT NULL,
+    `uploader_fans_count` INTEGER NOT NULL,
+    PRIMARY KEY (`article_id`, `ts`)
+) WITHOUT ROWID;
 """)
 async def create_table_article(
     sql: str,
     conn: Connection,
 ) -> None:
-    await conn.execute(sql)
+    for statement in split_sql(sql):
+        if statement.startswith('CREATE INDEX'):
+            # 旧版本的表要先迁移，索引最后再建
+            continue
+        await conn.execute(statement)
+    await _migrate_inline_content(conn)
+    # 有快照表之前爬到的互动数据也记一个快照
+    await conn.execute('''
+    INSERT OR IGNORE INTO article_snapshots
+    SELECT `id`, 0, `like_count`, `comment_count`, `collect_count`, `uploader_fans_count`
+    FROM articles
+    WHERE `like_count` >= 0 AND NOT EXISTS (
+        SELECT 1 FROM article_snapshots WHERE `article_id` = articles.`id`
+    )
+    ''')
+    for statement in split_sql(sql):
+        if statement.startswith('CREATE INDEX'):
+            await conn.execute(statement)
     await conn.commit()
 
 
-class Article(BaseModel):
+def compress_content(content: str) -> bytes:
+    return zlib.compress(content.encode('utf-8'))
+
+
+def decompress_content(data: bytes | None) -> str:
+    if not data:
+        return ''
+    return zlib.decompress(data).decode('utf-8')
+
+
+async def _migrate_inline_content(conn: Connection) -> None:
+    '''
+    旧版本的articles表把正文直接存在`content`列里，
+    这里把正文压缩后搬到article_contents表，再删掉`content`列
+
+    删列之后数据库文件不会自动变小，需要VACUUM一次
+    '''
+    cur = await conn.execute('PRAGMA table_info(articles)')
+    columns = {row[1] for row in await cur.fetchall()}
+    if 'content' not in columns:
+        return
+    if 'content_length' not in columns:
+        await conn.execute(
+            'ALTER TABLE articles ADD COLUMN `content_length` INTEGER NOT NULL DEFAULT 0'
+        )
+    cur = await conn.execute("SELECT `id`, `content` FROM articles WHERE `content` != ''")
+    while len(rows := await cur.fetchmany(500)):
+        await conn.executemany(
+            'INSERT OR REPLACE INTO article_contents (`id`, `content`) VALUES (?, ?)',
+            [(id_, compress_content(content)) for id_, content in rows]
+        )
+        await conn.executemany(
+            'UPDATE articles SET `content_length` = ? WHERE `id` = ?',
+            [(len(content), id_) for id_, content in rows]
+        )
+    await cur.close()
+    await conn.execute('ALTER TABLE articles DROP COLUMN `content`')
+
+
+class Article(TrackedModel):
     id: str
     title: str
     url: str
     category: str
     keyword: str
+    # 默认不从数据库读取正文，需要的话查询时传with_content=True或者调用load_contents
     content: str = ''
+    content_length: int = 0
     upload_time: str | None = None
     like_count: int = -1
     comment_count: int = -1
@@ -55,12 +175,16 @@ class Article(BaseModel):
 
 @relate_sql("""
 DELETE FROM articles;
+DELETE FROM article_contents;
+DELETE FROM article_tokens;
+DELETE FROM article_snapshots;
 """)
 async def truncate_table_article(
     sql: str,
     conn: Connection
 ) -> None:
-    await conn.execute(sql)
+    for statement in split_sql(sql):
+        await conn.execute(statement)
     await conn.commit()
 
 
@@ -94,54 +218,89 @@ async def insert_article(
         article.category,
         article.keyword
     ))
+    if cur.rowcount == 1:
+        await _index_titles(conn, [article])
     await conn.commit()
-    return cur.rowcount > 1
+    return cur.rowcount == 1
 
 
 @relate_sql("""--sql
-SELECT
-    `id`,
-    `title`,
-    `url`,
-    `category`,
-    `keyword`,
-    `content`,
-    `upload_time`,
-    `like_count`,
-    `comment_count`,
-    `collect_count`,
-    `uploader`,
-    `uploader_fans_count`
-FROM articles
+INSERT OR IGNORE INTO articles (
+    `id`, `title`, `url`, `category`, `keyword`
+) VALUES (
+    ?, ?, ?, ?, ?
+)
 """)
-async def all_articles(sql: str, conn: Connection) -> list[Article]:
+async def insert_articles(
+    sql: str,
+    conn: Connection,
+    articles: Iterable[Article]
+) -> tuple[int, int]:
     '''
-    获取所有文章
+    批量往数据库存入文章，所有文章在同一个事务里插入，只commit一次
+
+    和insert_article一样，只插入 id, title, url, category, keyword这五个字段
+
     :param conn: 数据库连接
-    :return: 文章列表
+    :param articles: 文章对象
+    :return: (插入成功的数量, 因为已存在而被忽略的数量)
     '''
-    cur = await conn.execute(sql)
-    rows = await cur.fetchall()
-    articles = []
-    for row in rows:
-        article = Article(
-            id=row[0],
-            title=row[1],
-            url=row[2],
-            category=row[3],
-            keyword=row[4],
-            content=row[5],
-            upload_time=row[6],
-            like_count=row[7],
-            comment_count=row[8],
-            collect_count=row[9],
-            uploader=row[10],
-            uploader_fans_count=row[11]
+    articles = list(articles)
+    if not len(articles):
+        return 0, 0
+    # 重新爬的搜索结果大多已经存过了，先查出已存在的id，只插入、分词真正新的文章
+    existing = await _existing_ids(conn, [article.id for article in articles])
+    new: dict[str, Article] = {}
+    for article in articles:
+        # 同一批里重复的id只有第一篇会被插入
+        if article.id not in existing and article.id not in new:
+            new[article.id] = article
+    inserted = 0
+    if len(new):
+        cur = await conn.executemany(sql, [(
+            article.id,
+            article.title,
+            article.url,
+            article.category,
+            article.keyword
+        ) for article in new.values()])
+        inserted = max(cur.rowcount, 0)
+        await _index_titles(conn, new.values())
+    await conn.commit()
+    return inserted, len(articles) - inserted
+
+
+async def _existing_ids(conn: Connection, ids: list[str]) -> set[str]:
+    '''
+    :return: ids里已经在articles表里的id
+    '''
+    existing: set[str] = set()
+    for batch in batched(ids, 500):
+        cur = await conn.execute(
+            f'SELECT `id` FROM articles WHERE `id` IN ({", ".join("?" * len(batch))})',
+            batch,
         )
-        articles.append(article)
-    return articles
+        existing.update(row[0] for row in await cur.fetchall())
+    return existing
+
+
+# 爬取详情后可以更新的字段，content单独存在article_contents表里
+_UPDATABLE_COLUMNS = (
+    'title',
+    'url',
+    'category',
+    'keyword',
+    'content_length',
+    'upload_time',
+    'like_count',
+    'comment_count',
+    'collect_count',
+    'uploader',
+    'uploader_fans_count',
+)
 
 
+@track_sql
 async def update_article(
     conn: Connection,
     article: Article
@@ -149,92 +308,704 @@ async def update_article(
     '''
     更新一篇文章的相关信息
 
+    只写入从数据库读出来（或创建）之后被改过的字段，没有改过的字段不会写
+
     :param conn: 数据库连接
     :param article: 文章对象
-    :return: 更新成功返回True，否则返回False
-    '''
-    sql = """--sql
-    UPDATE articles SET
-        `content` = COALESCE(?, content),
-        `like_count` = COALESCE(?, like_count),
-        `comment_count` = COALESCE(?, comment_count),
-        `collect_count` = COALESCE(?, collect_count),
-        `uploader` = COALESCE(?, uploader),
-        `uploader_fans_count` = COALESCE(?, uploader_fans_count)
-    WHERE `id` = ?
-    """
-    cur = await conn.execute(sql, (
-        article.content,
-        article.like_count,
-        article.comment_count,
-        article.collect_count,
-        article.uploader,
-        article.uploader_fans_count,
-        article.id
-    ))
+    :return: 更新成功返回True，否则返回False（包括没有需要更新的字段）
+    '''
+    updated = await _update_articles(conn, [article])
+    await conn.commit()
+    return updated > 0
+
+
+@track_sql
+async def update_articles(
+    conn: Connection,
+    articles: Iterable[Article]
+) -> int:
+    '''
+    批量更新文章，所有文章在同一个事务里更新，只commit一次
+
+    和update_article一样，每篇文章只写入被改过的字段
+
+    :param conn: 数据库连接
+    :param articles: 文章对象
+    :return: 更新的文章数
+    '''
+    updated = await _update_articles(conn, articles)
     await conn.commit()
-    return cur.rowcount > 0
+    return updated
+
+
+async def _update_articles(conn: Connection, articles: Iterable[Article]) -> int:
+    articles = list(articles)
+    contents = []
+    for article in articles:
+        if 'content' in article.dirty_fields:
+            contents.append((article.id, compress_content(article.content)))
+            # content_length跟着content一起写入articles表
+            article.content_length = len(article.content)
+    if len(contents):
+        await conn.executemany(
+            'INSERT OR REPLACE INTO article_contents (`id`, `content`) VALUES (?, ?)',
+            contents
+        )
+    await _index_articles(conn, [
+        article for article in articles
+        if 'content' in article.dirty_fields
+    ])
+    # 只改了标题的话正文可能没读出来，只更新标题的分词
+    await conn.executemany(
+        'UPDATE article_tokens SET `title` = ? WHERE `id` = ?',
+        [
+            (_segment(article.title), article.id) for article in articles
+            if 'title' in article.dirty_fields and 'content' not in article.dirty_fields
+        ]
+    )
+    # update_dirty_fields会把模型标记为干净，要先记下哪些文章的互动数据改了
+    snapshot_ids = [
+        article.id for article in articles
+        if not article.dirty_fields.isdisjoint(_SNAPSHOT_COLUMNS)
+    ]
+    updated = await update_dirty_fields(conn, 'articles', articles, _UPDATABLE_COLUMNS)
+    await _snapshot_articles(conn, snapshot_ids)
+    return updated
+
+
+# 会随时间变化的互动数据，其中任意一个被更新都会追加一个快照
+_SNAPSHOT_COLUMNS = ('like_count', 'comment_count', 'collect_count', 'uploader_fans_count')
+
+
+class ArticleSnapshot(BaseModel):
+    article_id: str
+    ts: int
+    like_count: int
+    comment_count: int
+    collect_count: int
+    uploader_fans_count: int
+
+
+async def _snapshot_articles(conn: Connection, ids: Iterable[str]) -> None:
+    '''
+    给文章当前的互动数据追加一个快照，同一秒内多次更新只保留最后一次
+
+    要在UPDATE之后调用，快照从articles表里读，而不是用内存里的模型，
+    模型里没改过的字段可能只是默认值-1
+    互动数据还有-1（未获取）的文章说明详情还没爬全，不记录
+    '''
+    ts = int(time.time())
+    for batch in batched(ids, 500):
+        await conn.execute(f'''
+        INSERT OR REPLACE INTO article_snapshots
+        SELECT `id`, ?, `like_count`, `comment_count`, `collect_count`, `uploader_fans_count`
+        FROM articles
+        WHERE `id` IN ({', '.join('?' * len(batch))})
+        AND `like_count` >= 0 AND `comment_count` >= 0 AND `collect_count` >= 0
+        AND `uploader_fans_count` >= 0
+        ''', (ts, *batch))
+
+
+@relate_sql("""--sql
+SELECT * FROM article_snapshots WHERE `article_id` = ? ORDER BY `ts`
+""")
+async def get_snapshots(sql: str, conn: Connection, article_id: str) -> list[ArticleSnapshot]:
+    '''
+    获取一篇文章互动数据的历史
+
+    :param conn: 数据库连接
+    :param article_id: 文章id
+    :return: 快照列表，按时间从早到晚排列
+    '''
+    cur = await conn.execute(sql, (article_id,))
+    rows = await cur.fetchall()
+    return [ArticleSnapshot(
+        article_id=row[0],
+        ts=row[1],
+        like_count=row[2],
+        comment_count=row[3],
+        collect_count=row[4],
+        uploader_fans_count=row[5],
+    ) for row in rows]
+
+
+@relate_sql("""--sql
+WITH recent AS (
+    SELECT
+        `article_id`,
+        `ts`,
+        `like_count` + `comment_count` + `collect_count` AS engagement,
+        -- 上一个快照
+        LEAD(`ts`) OVER w AS prev_ts,
+        LEAD(`like_count` + `comment_count` + `collect_count`) OVER w AS prev_engagement,
+        ROW_NUMBER() OVER w AS rn
+    FROM article_snapshots
+    WINDOW w AS (PARTITION BY `article_id` ORDER BY `ts` DESC)
+)
+SELECT
+    recent.`article_id`,
+    -- 多久没更新了，单位为天
+    (:now - recent.`ts`) / 86400.0 * (1 + COALESCE(
+        -- 最近两个快照之间每天增加的互动数
+        MAX(recent.engagement - recent.prev_engagement, 0) * 86400.0 / MAX(recent.`ts` - recent.prev_ts, 1),
+        -- 只有一个快照的话，用发布以来平均每天的互动数估计
+        recent.engagement / MAX(:now / 86400.0 + 2440587.5 - julianday(articles.`upload_time`), 1),
+        0
+    )) AS score
+FROM recent
+JOIN articles ON articles.`id` = recent.`article_id`
+WHERE recent.rn = 1 AND recent.`ts` <= :now - :min_interval
+ORDER BY score DESC
+LIMIT :limit
+""")
+async def get_stale_articles(
+    sql: str,
+    conn: Connection,
+    limit: int,
+    *,
+    min_interval: float = 24 * 60 * 60,
+    now: float | None = None,
+) -> list[tuple[str, float]]:
+    '''
+    挑出最值得重新爬取互动数据的文章
+
+    分数 = 多久没更新（天） × (1 + 最近每天增加的互动数)，
+    很久没更新、数据又涨得快的文章排在前面，数据不怎么动的文章不会浪费页面
+
+    :param conn: 数据库连接
+    :param limit: 最多挑多少篇
+    :param min_interval: 距离上次快照不到这么多秒的文章不挑，单位为秒
+    :param now: 当前时间戳，默认为time.time()
+    :return: [(文章id, 分数)]，按分数从高到低排列
+    '''
+    if now is None:
+        now = time.time()
+    cur = await conn.execute(sql, {'now': now, 'min_interval': min_interval, 'limit': limit})
+    rows = await cur.fetchall()
+    return [(row[0], row[1]) for row in rows]
+
+
+# 正文里的图片和链接对检索没用
+_MD_LINK_PATTERN = re.compile(r'!?\[([^\]]*)\]\([^)]*\)')
+
+
+def _segment(text: str) -> str:
+    '''
+    用jieba搜索引擎模式分词，词与词之间用空格隔开，给fts5的unicode61分词器用
+    '''
+    import jieba
+    text = _MD_LINK_PATTERN.sub(r'\1', text)
+    return ' '.join(
+        word for word in jieba.cut_for_search(text)
+        if re.search(r'\w', word)
+    )
+
+
+async def _index_titles(conn: Connection, articles: Iterable[Article]) -> None:
+    '''
+    新插入的文章还没有正文，先把标题加进全文索引，已经在索引里的不动
+    '''
+    await conn.executemany(
+        'INSERT INTO article_tokens (`id`, `title`) VALUES (?, ?) ON CONFLICT (`id`) DO NOTHING',
+        [(article.id, _segment(article.title)) for article in articles]
+    )
+
+
+async def _index_articles(conn: Connection, articles: Iterable[Article]) -> None:
+    '''
+    把文章的标题和正文加进全文索引，已经在索引里的会被覆盖
+    '''
+    await conn.executemany(
+        '''
+        INSERT INTO article_tokens (`id`, `title`, `content`) VALUES (?, ?, ?)
+        ON CONFLICT (`id`) DO UPDATE SET
+            `title` = excluded.`title`,
+            `content` = excluded.`content`
+        ''',
+        [
+            (article.id, _segment(article.title), _segment(article.content))
+            for article in articles
+        ]
+    )
+
+
+@relate_sql("""--sql
+SELECT `content` FROM article_contents WHERE `id` = ?
+""")
+async def get_article_content(sql: str, conn: Connection, article_id: str) -> str:
+    '''
+    获取一篇文章的正文
+
+    :param conn: 数据库连接
+    :param article_id: 文章id
+    :return: 正文，未获取过正文则返回空字符串
+    '''
+    cur = await conn.execute(sql, (article_id,))
+    row = await cur.fetchone()
+    return decompress_content(row[0]) if row else ''
+
+
+@track_sql
+async def load_contents(conn: Connection, articles: Iterable[Article]) -> list[Article]:
+    '''
+    给查询时没有带正文的文章补上正文，每500篇查询一次
+
+    补上的正文不算作改过的字段，之后update_article不会重写正文
+
+    :param conn: 数据库连接
+    :param articles: 文章对象
+    :return: 传入的文章
+    '''
+    articles = list(articles)
+    need = {
+        article.id: article for article in articles
+        if article.content_length > 0 and not len(article.content)
+    }
+    for ids in batched(need, 500):
+        cur = await conn.execute(
+            f'SELECT `id`, `content` FROM article_contents WHERE `id` IN ({", ".join("?" * len(ids))})',
+            ids
+        )
+        for id_, data in await cur.fetchall():
+            need[id_].load_fields(content=decompress_content(data))
+    return articles
+
+
+# 按表中的顺序排列，get_articles的columns参数只能从这里面选
+ARTICLE_COLUMNS = (
+    'id',
+    'title',
+    'url',
+    'category',
+    'keyword',
+    'content_length',
+    'upload_time',
+    'like_count',
+    'comment_count',
+    'collect_count',
+    'uploader',
+    'uploader_fans_count',
+)
+# Article的必填字段，不管columns怎么传都会查询
+_REQUIRED_COLUMNS = ('id', 'title', 'url', 'category', 'keyword')
+
+
+def _article_query(
+    select: str,
+    *,
+    with_content: bool = False,
+    category: str | None = None,
+    keyword: str | None = None,
+    has_content: bool | None = None,
+    min_content_length: int | None = None,
+    min_fans: int | None = None,
+    max_fans: int | None = None,
+    exclude_categories: Iterable[str] | None = None,
+    ids: Iterable[str] | None = None,
+    unpublished: str | None = None,
+    after_id: str | None = None,
+    order_by: str | None = None,
+    limit: int | None = None,
+    archived: bool = False,
+) -> tuple[str, list]:
+    '''
+    拼接articles表的查询语句，所有的值都用参数绑定，不会拼进sql里
+
+    :param select: SELECT后面的部分，articles表的列要写成articles.`列名`
+    :param with_content: 是否LEFT JOIN正文表，正文为article_contents.`content`
+    :param archived: 查询归档库（archive.articles）而不是主库，归档库的表也用articles这个别名
+    :return: (sql语句, 绑定参数)
+    '''
+    conds: list[str] = []
+    params: list = []
+    if category is not None:
+        conds.append('articles.`category` = ?')
+        params.append(category)
+    if keyword is not None:
+        conds.append('articles.`keyword` = ?')
+        params.append(keyword)
+    if has_content is not None:
+        conds.append('articles.`content_length` > 0' if has_content else 'articles.`content_length` = 0')
+    if min_content_length is not None:
+        conds.append('articles.`content_length` > ?')
+        params.append(min_content_length)
+    if min_fans is not None:
+        conds.append('articles.`uploader_fans_count` >= ?')
+        params.append(min_fans)
+    if max_fans is not None:
+        conds.append('articles.`uploader_fans_count` < ?')
+        params.append(max_fans)
+    if exclude_categories is not None:
+        exclude_categories = list(exclude_categories)
+        conds.append(f'articles.`category` NOT IN ({", ".join("?" * len(exclude_categories))})')
+        params.extend(exclude_categories)
+    if ids is not None:
+        ids = list(ids)
+        conds.append(f'articles.`id` IN ({", ".join("?" * len(ids))})')
+        params.extend(ids)
+    if unpublished is not None:
+        # 用idx_publications_kind_status判断，不会读publications表
+        conds.append('''NOT EXISTS (
+            SELECT 1 FROM main.publications
+            WHERE publications.`kind` = ? AND publications.`status` = 'done'
+            AND publications.`article_id` = articles.`id`
+        )''')
+        params.append(unpublished)
+    if after_id is not None:
+        conds.append('articles.`id` > ?')
+        params.append(after_id)
+    schema = 'archive' if archived else 'main'
+    sql = f'SELECT {select} FROM {schema}.articles AS articles'
+    if with_content:
+        sql += (
+            f' LEFT JOIN {schema}.article_contents AS article_contents'
+            ' ON article_contents.`id` = articles.`id`'
+        )
+    if len(conds):
+        sql += ' WHERE ' + ' AND '.join(conds)
+    if order_by is not None:
+        column = order_by.removeprefix('-')
+        if column not in ARTICLE_COLUMNS:
+            raise ValueError(f'cannot order by unknown column {column!r}')
+        sql += f' ORDER BY articles.`{column}` {"DESC" if order_by.startswith("-") else "ASC"}'
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    return sql, params
+
 
+def _select_sql(columns: tuple[str, ...], with_content: bool) -> str:
+    select = ', '.join(f'articles.`{column}`' for column in columns)
+    if with_content:
+        select += ', article_contents.`content`'
+    return select
 
+
+def _row2article(
+    columns: tuple[str, ...],
+    row: tuple,
+    validate: bool,
+    with_content: bool,
+) -> Article:
+    fields = dict(zip(columns, row))
+    if with_content:
+        fields['content'] = decompress_content(row[-1])
+    if validate:
+        return Article(**fields)
+    return construct_model(Article, fields)
+
+
+def _select_columns(columns: Iterable[str] | None) -> tuple[str, ...]:
+    if columns is None:
+        return ARTICLE_COLUMNS
+    columns = set(columns)
+    unknown = columns - set(ARTICLE_COLUMNS)
+    if len(unknown):
+        raise ValueError(f'unknown columns: {sorted(unknown)}')
+    return tuple(
+        column for column in ARTICLE_COLUMNS
+        if column in columns or column in _REQUIRED_COLUMNS
+    )
+
+
+@track_sql
 async def get_articles(
     conn: Connection,
-    category: str = '',
-    keyword: str = '',
+    category: str | None = None,
+    keyword: str | None = None,
+    *,
+    has_content: bool | None = None,
+    min_content_length: int | None = None,
+    min_fans: int | None = None,
+    max_fans: int | None = None,
+    exclude_categories: Iterable[str] | None = None,
+    ids: Iterable[str] | None = None,
+    unpublished: str | None = None,
+    columns: Iterable[str] | None = None,
+    with_content: bool = False,
+    order_by: str | None = None,
+    limit: int | None = None,
+    validate: bool = True,
+    archived: bool = False,
 ) -> list[Article]:
     '''
-    获取指定分类或关键词的文章
-    TODO: 其实可以和all_articles合并成一个
-    暂时先把这个屎山留着
-
-    注意：category和keyword不能同时为空
+    按条件获取文章，所有条件都是可选的，什么都不传就是获取所有文章
 
     :param conn: 数据库连接
     :param category: 分类
     :param keyword: 关键词
+    :param has_content: True只要已获取正文的文章，False只要未获取正文的文章
+    :param min_fans: 上传者粉丝数下限（包含）
+    :param min_content_length: 正文字数下限（不包含）
+    :param max_fans: 上传者粉丝数上限（不包含）
+    :param exclude_categories: 不要这些分类的文章
+    :param ids: 只要这些id的文章
+    :param unpublished: 只要还没有以这种方式（见dao.publication）发布成功过的文章
+    :param columns: 要查询的字段，默认全部查询。id title url category keyword总是会查询，
+        没查询的字段为Article的默认值
+    :param with_content: 是否同时读取正文，默认不读，只查元数据时不会碰到正文
+    :param order_by: 排序字段，前面加'-'表示降序，如'-like_count'
+    :param limit: 最多返回多少篇
+    :param validate: 是否用pydantic校验每一行。读自己数据库里的数据时可以传False跳过校验，快很多
+    :param archived: 查询归档库里的文章，连接需要已经ATTACH了归档库，见dao.maintenance
     :return: 文章列表
     '''
-    if not len(category) and not len(keyword):
-        raise ValueError('category and keyword cannot both be empty')
-    cond = []
-    if len(category):
-        cond.append(f'`category` = "{category}"')
-    if len(keyword):
-        cond.append(f'`keyword` = "{keyword}"')
-    conds = 'AND '.join(cond)
-    sql = f"""--sql
-    SELECT
-        `id`,
-        `title`,
-        `url`,
-        `category`,
-        `keyword`,
-        `content`,
-        `upload_time`,
-        `like_count`,
-        `comment_count`,
-        `collect_count`,
-        `uploader`,
-        `uploader_fans_count`
-        FROM articles
-    WHERE {conds}
-    """
-    cur = await conn.execute(sql)
+    selected = _select_columns(columns)
+    sql, params = _article_query(
+        _select_sql(selected, with_content),
+        with_content=with_content,
+        category=category,
+        keyword=keyword,
+        has_content=has_content,
+        min_content_length=min_content_length,
+        min_fans=min_fans,
+        max_fans=max_fans,
+        exclude_categories=exclude_categories,
+        ids=ids,
+        unpublished=unpublished,
+        order_by=order_by,
+        limit=limit,
+        archived=archived,
+    )
+    cur = await conn.execute(sql, params)
     rows = await cur.fetchall()
-    articles = []
-    for row in rows:
-        article = Article(
-            id=row[0],
-            title=row[1],
-            url=row[2],
-            category=row[3],
-            keyword=row[4],
-            content=row[5],
-            upload_time=row[6],
-            like_count=row[7],
-            comment_count=row[8],
-            collect_count=row[9],
-            uploader=row[10],
-            uploader_fans_count=row[11]
+    return [_row2article(selected, row, validate, with_content) for row in rows]
+
+
+@track_sql
+async def count_articles(
+    conn: Connection,
+    category: str | None = None,
+    keyword: str | None = None,
+    *,
+    has_content: bool | None = None,
+    min_content_length: int | None = None,
+    min_fans: int | None = None,
+    max_fans: int | None = None,
+    exclude_categories: Iterable[str] | None = None,
+    ids: Iterable[str] | None = None,
+    unpublished: str | None = None,
+    archived: bool = False,
+) -> int:
+    '''
+    按条件统计文章数量，条件的含义和get_articles一样
+
+    按category和keyword统计时只会读索引，不会读表
+
+    :param conn: 数据库连接
+    :return: 文章数量
+    '''
+    sql, params = _article_query(
+        'COUNT(*)',
+        category=category,
+        keyword=keyword,
+        has_content=has_content,
+        min_content_length=min_content_length,
+        min_fans=min_fans,
+        max_fans=max_fans,
+        exclude_categories=exclude_categories,
+        ids=ids,
+        unpublished=unpublished,
+        archived=archived,
+    )
+    cur = await conn.execute(sql, params)
+    row = await cur.fetchone()
+    return row[0] if row else 0
+
+
+async def iter_articles(
+    conn: Connection,
+    category: str | None = None,
+    keyword: str | None = None,
+    *,
+    has_content: bool | None = None,
+    min_content_length: int | None = None,
+    min_fans: int | None = None,
+    max_fans: int | None = None,
+    exclude_categories: Iterable[str] | None = None,
+    ids: Iterable[str] | None = None,
+    unpublished: str | None = None,
+    columns: Iterable[str] | None = None,
+    with_content: bool = False,
+    after_id: str | None = None,
+    limit: int | None = None,
+    batch_size: int = 500,
+    validate: bool = True,
+    archived: bool = False,
+) -> AsyncIterator[Article]:
+    '''
+    按id顺序逐批读取文章，条件的含义和get_articles一样
+
+    每一批都是一次独立的查询（WHERE id > 上一批最后的id），
+    不会一次把整张表读进内存，也不会长时间占着一个读事务
+
+    :param conn: 数据库连接
+    :param after_id: 只读取id大于它的文章，用于断点续读
+    :param limit: 最多读取多少篇，None表示不限
+    :param batch_size: 每批读取多少篇
+    :param validate: 是否用pydantic校验每一行，同get_articles
+    :param archived: 读取归档库里的文章，同get_articles
+    :return: 文章的异步迭代器
+    '''
+    if batch_size < 1:
+        raise ValueError('batch_size must be at least 1')
+    selected = _select_columns(columns)
+    # 每一批都要用这两个条件，生成器只能遍历一次，先转成列表
+    if exclude_categories is not None:
+        exclude_categories = list(exclude_categories)
+    if ids is not None:
+        ids = list(ids)
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        sql, params = _article_query(
+            _select_sql(selected, with_content),
+            with_content=with_content,
+            category=category,
+            keyword=keyword,
+            has_content=has_content,
+            min_content_length=min_content_length,
+            min_fans=min_fans,
+            max_fans=max_fans,
+            exclude_categories=exclude_categories,
+            ids=ids,
+            unpublished=unpublished,
+            after_id=after_id,
+            order_by='id',
+            limit=size,
+            archived=archived,
         )
-        articles.append(article)
-    return articles
+        cur = await conn.execute(sql, params)
+        rows = await cur.fetchall()
+        await cur.close()
+        for row in rows:
+            yield _row2article(selected, row, validate, with_content)
+        if len(rows) < size:
+            return
+        after_id = rows[-1][0]
+        if remaining is not None:
+            remaining -= len(rows)
+
+
+# 上传候选文章需要的字段，正文等选好之后再用load_contents读
+UPLOAD_CANDIDATE_COLUMNS = ('id', 'title', 'url', 'category', 'keyword', 'content_length', 'uploader_fans_count')
+
+
+@track_sql
+async def get_upload_candidates(
+    conn: Connection,
+    kind: str,
+    *,
+    min_content_length: int = 200,
+    max_fans: int = 100000,
+    exclude_categories: Iterable[str] = ('游戏',),
+    limit: int | None = None,
+) -> list[Article]:
+    '''
+    选出可以拿去发布的文章，所有条件都在sql里过滤，不读正文
+
+    按粉丝数范围扫idx_articles_upload_candidates，正文长度和分类在索引里过滤，
+    已经发布过的文章用idx_publications_kind_status排除，只有选中的文章才回表
+
+    :param conn: 数据库连接
+    :param kind: 发布方式，已经以这种方式发布成功过的文章不选，见dao.publication
+    :param min_content_length: 正文字数要大于它
+    :param max_fans: 上传者粉丝数要小于它，未获取到粉丝数（-1）的文章也算
+    :param exclude_categories: 不要这些分类的文章
+    :param limit: 最多选多少篇
+    :return: 文章列表，只有UPLOAD_CANDIDATE_COLUMNS这几个字段，没有正文
+    '''
+    return await get_articles(
+        conn,
+        min_content_length=min_content_length,
+        max_fans=max_fans,
+        exclude_categories=exclude_categories,
+        unpublished=kind,
+        columns=UPLOAD_CANDIDATE_COLUMNS,
+        limit=limit,
+        validate=False,
+    )
+
+
+def _fts_query(query: str) -> str:
+    '''
+    把用户输入的查询分词后拼成fts5的MATCH表达式
+
+    每个词都用双引号括起来当作字符串，避免用户输入里的AND、*、引号等被当成fts5语法，
+    词与词之间是OR，由bm25决定排序
+    '''
+    import jieba
+    words = {
+        word.strip() for word in jieba.cut(query)
+        if len(word.strip()) and re.search(r'\w', word)
+    }
+    return ' OR '.join('"{}"'.format(word.replace('"', '""')) for word in sorted(words))
+
+
+@track_sql
+async def search_articles_local(
+    conn: Connection,
+    query: str,
+    limit: int = 20,
+    *,
+    title_weight: float = 10.0,
+    with_content: bool = False,
+    validate: bool = True,
+) -> list[Article]:
+    '''
+    在本地已经爬到的文章里全文检索，按bm25相关度从高到低排序
+
+    :param conn: 数据库连接
+    :param query: 查询内容，会先用jieba分词
+    :param limit: 最多返回多少篇
+    :param title_weight: 标题命中相对于正文命中的权重
+    :param with_content: 是否同时读取正文
+    :param validate: 是否用pydantic校验每一行，同get_articles
+    :return: 文章列表
+    '''
+    match = _fts_query(query)
+    if not len(match):
+        return []
+    select = _select_sql(ARTICLE_COLUMNS, with_content)
+    sql = f'''
+    SELECT {select}
+    FROM articles_fts
+    JOIN article_tokens ON article_tokens.`token_id` = articles_fts.rowid
+    JOIN articles ON articles.`id` = article_tokens.`id`
+    {'LEFT JOIN article_contents ON article_contents.`id` = articles.`id`' if with_content else ''}
+    WHERE articles_fts MATCH ?
+    ORDER BY bm25(articles_fts, ?, 1.0)
+    LIMIT ?
+    '''
+    cur = await conn.execute(sql, (match, title_weight, limit))
+    rows = await cur.fetchall()
+    return [_row2article(ARTICLE_COLUMNS, row, validate, with_content) for row in rows]
+
+
+@track_sql
+async def rebuild_article_index(conn: Connection, batch_size: int = 200) -> int:
+    '''
+    重建全文索引，用于给有全文索引之前就爬下来的文章补索引
+
+    :param conn: 数据库连接
+    :param batch_size: 每批处理多少篇，每批commit一次
+    :return: 加入索引的文章数
+    '''
+    count = 0
+    async for batch in _batched_articles(conn, batch_size):
+        await load_contents(conn, batch)
+        await _index_articles(conn, batch)
+        await conn.commit()
+        count += len(batch)
+    return count
+
+
+async def _batched_articles(conn: Connection, batch_size: int) -> AsyncIterator[list[Article]]:
+    batch: list[Article] = []
+    async for article in iter_articles(conn, batch_size=batch_size, validate=False):
+        batch.append(article)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if len(batch):
+        yield batch
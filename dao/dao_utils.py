@@ -1,5 +1,110 @@
-from typing import Awaitable, Callable, Concatenate
-from functools import wraps
+from typing import Any, Awaitable, Callable, Collection, Concatenate, Iterable
+from functools import wraps, cache
+from copy import copy
+from collections import deque, defaultdict
+from pathlib import PurePath
+from dataclasses import dataclass, field
+from logging import getLogger
+import sqlite3
+import time
+
+from pydantic import BaseModel, PrivateAttr
+from aiosqlite import Connection
+
+
+LOGGER = getLogger(__name__)
+
+# 每条语句最多保留多少次最近的耗时，用来算p95
+LATENCY_SAMPLES = 1000
+
+
+@dataclass
+class SqlStat:
+    '''
+    一个dao层函数的调用统计
+    '''
+    name: str
+    sql: str
+    calls: int = 0
+    errors: int = 0
+    total_time: float = 0.0
+    # 查询返回的行数或写操作影响的行数之和
+    rows: int = 0
+    latencies: deque[float] = field(default_factory=lambda: deque(maxlen=LATENCY_SAMPLES))
+
+    @property
+    def avg_time(self) -> float:
+        return self.total_time / self.calls if self.calls else 0.0
+
+    @property
+    def p95_time(self) -> float:
+        if not len(self.latencies):
+            return 0.0
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+
+# 所有dao层函数的统计，key为`模块名.函数名`
+SQL_REGISTRY: dict[str, SqlStat] = {}
+# 超过这个耗时（秒）的调用会打warning日志，None表示不记录慢查询
+SLOW_QUERY_THRESHOLD: float | None = None
+
+
+def set_slow_query_threshold(seconds: float | None) -> None:
+    '''
+    设置慢查询日志的阈值
+
+    :param seconds: 阈值，单位为秒，None表示关闭慢查询日志
+    '''
+    global SLOW_QUERY_THRESHOLD
+    SLOW_QUERY_THRESHOLD = seconds
+
+
+def _count_rows(result: Any) -> int:
+    '''
+    从dao层函数的返回值推断行数：
+    bool和int就是影响的行数，列表是返回的行数，(插入数, 忽略数)这种元组取第一个
+    '''
+    if isinstance(result, (bool, int)):
+        return int(result)
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple) and len(result) and isinstance(result[0], int):
+        return result[0]
+    if result is None:
+        return 0
+    return 1
+
+
+def _register(func: Callable, sql: str) -> SqlStat:
+    name = f'{func.__module__}.{func.__qualname__}'
+    stat = SqlStat(name=name, sql=sql)
+    SQL_REGISTRY[name] = stat
+    return stat
+
+
+def _timed[**P, R](
+    func: Callable[P, Awaitable[R]],
+    stat: SqlStat,
+) -> Callable[P, Awaitable[R]]:
+    @wraps(func)
+    async def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+        start = time.perf_counter()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception:
+            stat.errors += 1
+            raise
+        finally:
+            cost = time.perf_counter() - start
+            stat.calls += 1
+            stat.total_time += cost
+            stat.latencies.append(cost)
+            if SLOW_QUERY_THRESHOLD is not None and cost >= SLOW_QUERY_THRESHOLD:
+                LOGGER.warning(f'慢查询：{stat.name} 耗时 {cost*1000:.1f}ms')
+        stat.rows += _count_rows(result)
+        return result
+    return wrapper
 
 
 def relate_sql[**P, R](sql: str) -> Callable[
@@ -11,7 +116,8 @@ def relate_sql[**P, R](sql: str) -> Callable[
 
     这样读代码的时候更易读，虽然会影响运行效率，但是个人觉得可读性更重要，毕竟你都已经用python了
 
-    该函数返回的装饰器会把sql语句注入到原本函数的参数中
+    该函数返回的装饰器会把sql语句注入到原本函数的参数中，
+    同时把函数登记到SQL_REGISTRY，记录每次调用的耗时和行数
 
     为了可读性，建议把需要动态注入的参数填到`/`的右边，这样可以让函数签名更清晰
 
@@ -32,13 +138,212 @@ def relate_sql[**P, R](sql: str) -> Callable[
         setattr(func, '__sql__', sql)
         @wraps(func)
         async def wrapper(*args, **kwargs):
-            sql = getattr(func, '__sql__', '')
-            args = (sql, *args)
-            return await func(*args, **kwargs)
-        return wrapper
+            return await func(sql, *args, **kwargs)
+        return _timed(wrapper, _register(func, sql))
     return deco
 
 
+def track_sql[**P, R](func: Callable[P, Awaitable[R]]) -> Callable[P, Awaitable[R]]:
+    """
+    给动态拼接sql的dao层函数用的装饰器
+
+    和relate_sql一样登记到SQL_REGISTRY并记录耗时和行数，只是不注入sql
+
+    :param func: dao层函数
+    :return: 包装后的函数
+    """
+    return _timed(func, _register(func, '<dynamic>'))
+
+
+def dump_sql_stats() -> str:
+    """
+    把SQL_REGISTRY里被调用过的函数整理成表格，按总耗时从高到低排列
+
+    一般在脚本结束时打到日志里，看看时间都花在哪些dao函数上了
+
+    :return: 表格字符串
+    """
+    stats = sorted(
+        (stat for stat in SQL_REGISTRY.values() if stat.calls),
+        key=lambda stat: stat.total_time,
+        reverse=True,
+    )
+    lines = [
+        f'{"name":<48} {"calls":>8} {"errors":>6} {"total(s)":>10} '
+        f'{"avg(ms)":>9} {"p95(ms)":>9} {"rows":>10}'
+    ]
+    for stat in stats:
+        lines.append(
+            f'{stat.name:<48} {stat.calls:>8} {stat.errors:>6} {stat.total_time:>10.3f} '
+            f'{stat.avg_time*1000:>9.2f} {stat.p95_time*1000:>9.2f} {stat.rows:>10}'
+        )
+    return '\n'.join(lines)
+
+
+def split_sql(script: str) -> list[str]:
+    """
+    把包含多条语句的sql脚本拆成一条一条的语句
+
+    `Connection.executescript`会先隐式commit，没法放进事务里，
+    所以建表、建索引这种多条语句的脚本用这个函数拆开后逐条execute
+
+    :param script: sql脚本
+    :return: sql语句列表
+    """
+    statements = []
+    buffer = ''
+    for line in script.splitlines(keepends=True):
+        buffer += line
+        if sqlite3.complete_statement(buffer):
+            statements.append(buffer.strip())
+            buffer = ''
+    if len(buffer.strip()) and not buffer.strip().startswith('--'):
+        statements.append(buffer.strip())
+    return statements
+
+
+# 不可变的默认值可以在多个模型之间共用，不需要复制
+_IMMUTABLE_TYPES = (str, int, float, bool, bytes, tuple, frozenset, PurePath, type(None))
+
+
+@cache
+def _model_defaults(cls: type[BaseModel]) -> tuple[
+    dict[str, Any],
+    tuple[tuple[str, Callable[[], Any]], ...],
+    tuple[tuple[str, Callable[[], Any]], ...],
+]:
+    '''
+    :return: (按字段顺序排列的不可变默认值模板, 需要每次新建的字段默认值, 私有属性默认值)
+    '''
+    template: dict[str, Any] = {}
+    factories = []
+    for name, field in cls.model_fields.items():
+        if field.default_factory is not None:
+            factories.append((name, field.default_factory))
+            template[name] = None
+        elif isinstance(field.default, _IMMUTABLE_TYPES):
+            template[name] = field.default
+        else:
+            factories.append((name, lambda default=field.default: copy(default)))
+            template[name] = None
+    private = tuple(
+        (name, lambda attr=attr: attr.get_default(call_default_factory=True))
+        for name, attr in cls.__private_attributes__.items()
+    )
+    return template, tuple(factories), private
+
+
+def construct_model[M: BaseModel](cls: type[M], fields: dict[str, Any]) -> M:
+    """
+    不做任何校验，直接用字段字典创建pydantic模型
+
+    只用于读取自己数据库里的数据，这些数据写进去之前已经校验过了。
+    pydantic自带的`model_construct`要在python里逐个字段处理默认值和别名，
+    实测比直接校验还慢，这里直接把字典塞进`__dict__`
+
+    缺少的字段用默认值补齐
+
+    :param cls: pydantic模型类
+    :param fields: 字段字典，字段齐全时会被直接当作模型的`__dict__`使用
+    :return: 模型对象
+    """
+    template, factories, private_defaults = _model_defaults(cls)
+    fields_set = set(fields)
+    if len(fields) < len(template):
+        # 在模板上补齐，这样字段顺序和模型里一样，repr和model_dump的顺序不变
+        missing = [(name, factory) for name, factory in factories if name not in fields]
+        merged = template.copy()
+        merged.update(fields)
+        for name, factory in missing:
+            merged[name] = factory()
+        fields = merged
+    obj = cls.__new__(cls)
+    object.__setattr__(obj, '__dict__', fields)
+    object.__setattr__(obj, '__pydantic_fields_set__', fields_set)
+    object.__setattr__(obj, '__pydantic_extra__', None)
+    if len(private_defaults):
+        private = {name: default() for name, default in private_defaults}
+    else:
+        private = None
+    object.__setattr__(obj, '__pydantic_private__', private)
+    return obj
+
+
+class TrackedModel(BaseModel):
+    """
+    会记录哪些字段被改过的模型
+
+    通过构造函数或者从数据库读出来的模型是“干净”的，之后每次给字段赋值都会记下字段名，
+    dao层的update函数只写这些改过的字段，写完之后再调用mark_clean
+    """
+    _dirty: set[str] = PrivateAttr(default_factory=set)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        super().__setattr__(name, value)
+        if name in type(self).model_fields:
+            self._dirty.add(name)
+
+    @property
+    def dirty_fields(self) -> set[str]:
+        '''
+        自从创建或上次mark_clean之后被赋值过的字段
+        '''
+        return set(self._dirty)
+
+    def mark_clean(self) -> None:
+        self._dirty.clear()
+
+    def load_fields(self, **fields: Any) -> None:
+        '''
+        给字段赋值但不记为改过，用于从数据库补读字段
+        '''
+        for name, value in fields.items():
+            BaseModel.__setattr__(self, name, value)
+
+
+async def update_dirty_fields(
+    conn: Connection,
+    table: str,
+    models: Iterable[TrackedModel],
+    columns: Collection[str],
+    key: str = 'id',
+) -> int:
+    """
+    只把模型里改过的字段写回数据库，不commit
+
+    改过的字段相同的模型放在一组，一组只执行一次executemany，
+    写完之后把模型标记为干净
+
+    :param conn: 数据库连接
+    :param table: 表名
+    :param models: 模型
+    :param columns: 允许更新的字段，其他改过的字段会被忽略
+    :param key: 主键字段名
+    :return: 更新的行数
+    """
+    groups: defaultdict[tuple[str, ...], list[TrackedModel]] = defaultdict(list)
+    for model in models:
+        dirty = tuple(sorted(model.dirty_fields.intersection(columns)))
+        if len(dirty):
+            groups[dirty].append(model)
+    updated = 0
+    for dirty, group in groups.items():
+        assignments = ', '.join(f'`{column}` = ?' for column in dirty)
+        sql = f'UPDATE {table} SET {assignments} WHERE `{key}` = ?'
+        params = []
+        for model in group:
+            values = [getattr(model, column) for column in (*dirty, key)]
+            params.append([
+                str(value) if isinstance(value, PurePath) else value
+                for value in values
+            ])
+        cur = await conn.executemany(sql, params)
+        updated += max(cur.rowcount, 0)
+        for model in group:
+            model.mark_clean()
+    return updated
+
+
 @relate_sql("SELECT * FROM user WHERE id = ?")
 async def get_user(sql: str, /, a: str) -> None:
     print(sql)
@@ -0,0 +1,326 @@
+import asyncio
+from asyncio import Queue, Future
+from typing import Any, AsyncIterator, Awaitable, Callable, Concatenate, cast
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from logging import getLogger
+
+import aiosqlite
+from aiosqlite import Connection
+
+from dao.maintenance import attach_archive, optimize_database
+
+
+LOGGER = getLogger(__name__)
+
+# mmap_size的默认值，单位为字节
+MMAP_SIZE = 256 * 1024 * 1024
+# cache_size的默认值，负数表示单位为KiB，这里是64MiB
+CACHE_SIZE = -64 * 1024
+
+
+@dataclass
+class _WriteJob:
+    func: Callable[..., Awaitable[Any]]
+    args: tuple
+    kwargs: dict
+    future: Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+
+    def set_result(self, result: Any) -> None:
+        # 调用方可能已经被取消了
+        if not self.future.done():
+            self.future.set_result(result)
+
+    def set_exception(self, e: BaseException) -> None:
+        if not self.future.done():
+            self.future.set_exception(e)
+
+
+class _BatchConnection:
+    '''
+    交给写协程里的dao函数使用的连接
+
+    dao层的写函数基本都会自己调用一次`conn.commit()`，
+    在写协程里这些commit全部变成空操作，由写协程统一在一批写操作结束后commit一次
+    `conn.rollback()`会把同一批里其他dao函数的写入也回滚掉，所以不允许调用，
+    dao函数要撤销自己的写入直接抛出异常即可，写协程会回滚到它的savepoint
+
+    其他属性和方法原样转发给真正的连接
+    '''
+    def __init__(self, conn: Connection) -> None:
+        self._conn = conn
+
+    async def commit(self) -> None:
+        return None
+
+    async def rollback(self) -> None:
+        raise RuntimeError('rollback is not allowed inside Database.write, raise an exception instead')
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+
+class Database:
+    '''
+    sqlite连接管理器
+
+    - 所有连接都开启WAL，并设置synchronous=NORMAL
+    - 只有一个写连接，由一个单独的写协程持有。所有写操作排队交给它，
+      它每次把队列里积压的写操作放在同一个事务里执行，只commit一次（group commit）
+    - 若干个只读连接组成连接池，读操作从池里借一个连接，用完放回
+    - 关闭时（以及每隔maintenance_interval秒）通过写协程执行一次optimize_database
+
+    WAL模式下读写互不阻塞，所以爬虫、上传脚本等可以同时访问同一个数据库文件
+
+    NOTE: 不支持':memory:'，因为只读连接看不到写连接的内存数据库
+
+    Example:
+    ```python
+    async with Database('data.db') as db:
+        await db.write(create_table_article)
+        await db.write(insert_articles, articles)
+        articles = await db.read(get_articles, category='旅游')
+    ```
+    '''
+    def __init__(
+        self,
+        path: str = 'data.db',
+        *,
+        readers: int = 3,
+        mmap_size: int = MMAP_SIZE,
+        cache_size: int = CACHE_SIZE,
+        busy_timeout: int = 5000,
+        batch_size: int = 256,
+        archive: str | None = None,
+        maintenance_interval: float | None = None,
+    ) -> None:
+        '''
+        :param path: 数据库文件路径
+        :param readers: 只读连接的数量
+        :param mmap_size: PRAGMA mmap_size，单位为字节，0表示不使用mmap
+        :param cache_size: PRAGMA cache_size，正数表示页数，负数表示KiB
+        :param busy_timeout: PRAGMA busy_timeout，单位为毫秒
+        :param batch_size: 写协程一次事务里最多执行多少个写操作
+        :param archive: 归档库文件路径，给了的话所有连接都会ATTACH它，见dao.maintenance
+        :param maintenance_interval: 每隔多少秒执行一次optimize_database，None表示只在关闭时执行
+        '''
+        if readers < 1:
+            raise ValueError('readers must be at least 1')
+        if batch_size < 1:
+            raise ValueError('batch_size must be at least 1')
+        self.path = path
+        self.readers = readers
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.busy_timeout = busy_timeout
+        self.batch_size = batch_size
+        self.archive = archive
+        self.maintenance_interval = maintenance_interval
+        self._writer: Connection | None = None
+        self._writer_task: asyncio.Task | None = None
+        self._maintenance_task: asyncio.Task | None = None
+        self._write_queue: Queue[_WriteJob | None] = Queue()
+        self._reader_queue: Queue[Connection] = Queue()
+        self._reader_conns: list[Connection] = []
+
+    async def _apply_pragmas(self, conn: Connection) -> None:
+        await conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout)}')
+        await conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        await conn.execute(f'PRAGMA cache_size = {int(self.cache_size)}')
+        await conn.execute('PRAGMA synchronous = NORMAL')
+        if self.archive is not None:
+            await attach_archive(conn, self.archive)
+
+    async def open(self) -> 'Database':
+        '''
+        打开写连接和只读连接池，并启动写协程
+        '''
+        if self._writer is not None:
+            return self
+        self._writer = await aiosqlite.connect(self.path)
+        # journal_mode是持久化在数据库文件里的，由写连接设置一次即可
+        await self._writer.execute('PRAGMA journal_mode = WAL')
+        await self._apply_pragmas(self._writer)
+        for _ in range(self.readers):
+            conn = await aiosqlite.connect(self.path)
+            await self._apply_pragmas(conn)
+            await conn.execute('PRAGMA query_only = ON')
+            self._reader_conns.append(conn)
+            await self._reader_queue.put(conn)
+        self._writer_task = asyncio.create_task(self._write_loop())
+        if self.maintenance_interval is not None:
+            self._maintenance_task = asyncio.create_task(self._maintenance_loop())
+        return self
+
+    async def close(self) -> None:
+        '''
+        等待队列里所有写操作完成后，关闭所有连接
+        '''
+        if self._writer is None:
+            return
+        if self._maintenance_task is not None:
+            self._maintenance_task.cancel()
+            self._maintenance_task = None
+        # sqlite建议在关闭连接前执行一次PRAGMA optimize
+        try:
+            await self.write(optimize_database, vacuum_pages=0)
+        except Exception as e:
+            LOGGER.warning(f'关闭前优化数据库失败：{e}')
+        await self._write_queue.put(None)
+        if self._writer_task is not None:
+            if not self._writer_task.done():
+                await self._writer_task
+            elif not self._writer_task.cancelled() and self._writer_task.exception() is not None:
+                LOGGER.error(f'写协程已经异常退出：{self._writer_task.exception()!r}')
+        for conn in self._reader_conns:
+            await conn.close()
+        await self._writer.close()
+        self._writer = None
+        self._writer_task = None
+        self._reader_conns = []
+        self._reader_queue = Queue()
+
+    async def __aenter__(self) -> 'Database':
+        return await self.open()
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def _maintenance_loop(self) -> None:
+        assert self.maintenance_interval is not None
+        while True:
+            await asyncio.sleep(self.maintenance_interval)
+            try:
+                await self.write(optimize_database)
+            except Exception as e:
+                LOGGER.warning(f'定时优化数据库失败：{e}')
+
+    async def _write_loop(self) -> None:
+        try:
+            await self._write_batches()
+        except BaseException as e:
+            # 写协程被取消了（或者遇到KeyboardInterrupt等），队列里剩下的写操作不会再有人执行
+            while not self._write_queue.empty():
+                job = self._write_queue.get_nowait()
+                if job is not None:
+                    job.set_exception(RuntimeError(f'database writer stopped: {e!r}'))
+            raise
+
+    async def _write_batches(self) -> None:
+        assert self._writer is not None
+        conn = self._writer
+        batch_conn = cast(Connection, _BatchConnection(conn))
+        stop = False
+        while not stop:
+            job = await self._write_queue.get()
+            if job is None:
+                break
+            jobs = [job]
+            # 把已经积压的写操作一起拿出来，放到同一个事务里
+            while len(jobs) < self.batch_size and not self._write_queue.empty():
+                job = self._write_queue.get_nowait()
+                if job is None:
+                    stop = True
+                    break
+                jobs.append(job)
+            results: list[tuple[_WriteJob, Any]] = []
+            try:
+                await conn.execute('BEGIN IMMEDIATE')
+            except Exception as e:
+                for job in jobs:
+                    job.set_exception(e)
+                continue
+            for job in jobs:
+                # 每个写操作一个savepoint，一个出错不影响同一批的其他写操作
+                await conn.execute('SAVEPOINT write_job')
+                try:
+                    result = await job.func(batch_conn, *job.args, **job.kwargs)
+                except BaseException as e:
+                    # dao函数里的CancelledError等也要回滚，不然事务一直开着，写协程也没了
+                    await conn.execute('ROLLBACK TO write_job')
+                    await conn.execute('RELEASE write_job')
+                    job.set_exception(e)
+                    if self._stopping(e):
+                        # 整批都不提交了
+                        await conn.rollback()
+                        for other in jobs:
+                            other.set_exception(RuntimeError(f'database writer stopped: {e!r}'))
+                        raise
+                    continue
+                await conn.execute('RELEASE write_job')
+                results.append((job, result))
+            try:
+                await conn.commit()
+            except BaseException as e:
+                LOGGER.error(f'批量写入提交失败：{e!r}')
+                await conn.rollback()
+                for job, _ in results:
+                    job.set_exception(e)
+                if self._stopping(e):
+                    raise
+                continue
+            for job, result in results:
+                job.set_result(result)
+
+    @staticmethod
+    def _stopping(e: BaseException) -> bool:
+        '''
+        写协程是否要因为这个异常退出：写协程自己被取消了，或者是KeyboardInterrupt、SystemExit这类异常
+        '''
+        if isinstance(e, Exception):
+            return False
+        task = asyncio.current_task()
+        if isinstance(e, asyncio.CancelledError):
+            # dao函数自己抛出的CancelledError（比如它里面等的任务被取消了）不算
+            return task is not None and task.cancelling() > 0
+        return True
+
+    async def write[**P, R](
+        self,
+        func: Callable[Concatenate[Connection, P], Awaitable[R]],
+        *args: P.args,
+        **kwargs: P.kwargs,
+    ) -> R:
+        '''
+        把一个dao层的写函数交给写协程执行，等它所在的那一批事务commit之后才返回
+
+        :param func: dao层函数，第一个参数为数据库连接
+        :return: dao层函数的返回值
+        '''
+        if self._writer is None:
+            raise RuntimeError('database is not opened')
+        if self._writer_task is not None and self._writer_task.done():
+            raise RuntimeError('database writer stopped')
+        job = _WriteJob(func, args, kwargs)
+        await self._write_queue.put(job)
+        return await job.future
+
+    @asynccontextmanager
+    async def reader(self) -> AsyncIterator[Connection]:
+        '''
+        从只读连接池里借一个连接，用完后放回
+
+        即使with块里抛出异常，连接也会被放回连接池
+        '''
+        if self._writer is None:
+            raise RuntimeError('database is not opened')
+        conn = await self._reader_queue.get()
+        try:
+            yield conn
+        finally:
+            await self._reader_queue.put(conn)
+
+    async def read[**P, R](
+        self,
+        func: Callable[Concatenate[Connection, P], Awaitable[R]],
+        *args: P.args,
+        **kwargs: P.kwargs,
+    ) -> R:
+        '''
+        用连接池里的只读连接执行一个dao层的读函数
+
+        :param func: dao层函数，第一个参数为数据库连接
+        :return: dao层函数的返回值
+        '''
+        async with self.reader() as conn:
+            return await func(conn, *args, **kwargs)
@@ -0,0 +1,422 @@
+from typing import Any, Awaitable, Callable, Iterable, Literal
+from logging import getLogger
+import asyncio
+import json
+import os
+import time
+
+from aiosqlite import Connection
+from pydantic import BaseModel
+
+from dao.dao_utils import relate_sql, track_sql, split_sql
+from dao.database import Database
+
+
+LOGGER = getLogger(__name__)
+
+
+'''
+各个流水线阶段的任务队列
+
+每个任务都有一个租约（lease_until）：
+worker领取任务时把状态改为running，并把租约设置为当前时间加上lease_seconds，
+处理期间定时调用heartbeat_jobs续租，处理完调用complete_job或fail_job。
+如果worker中途崩溃，租约过期后任务会被重新领取，不会丢失。
+
+领取是一条UPDATE ... RETURNING，多个进程共用一个数据库文件也不会领到同一个任务，
+多进程运行时可以用shard参数按job_id分片，每个进程先领自己那一片，领完了再帮别的分片领。
+'''
+
+
+JobKind = Literal[
+    # 搜索结果页 payload: {"category": ..., "keyword": ..., "page_num": ...}
+    'search_page',
+    # 文章详情 payload: {"id": ...}
+    'article_detail',
+    # 上传者主页 payload: {"uploader": ...}
+    'uploader_profile',
+    # 下载视频 payload: {"id": ...}
+    'video_download',
+]
+JobState = Literal['pending', 'running', 'done', 'failed']
+
+
+@relate_sql("""--sql
+CREATE TABLE IF NOT EXISTS jobs (
+    `job_id` INTEGER PRIMARY KEY,
+    `kind` TEXT NOT NULL,
+    -- 同一个kind下唯一确定一个任务，重复入队会被忽略
+    `key` TEXT NOT NULL,
+    -- json格式的任务参数
+    `payload` JSON NOT NULL DEFAULT '{}',
+    -- pending: 等待领取 running: 处理中 done: 已完成 failed: 重试次数用完仍失败
+    `state` TEXT NOT NULL DEFAULT 'pending',
+    -- 越大越先被领取
+    `priority` INTEGER NOT NULL DEFAULT 0,
+    -- 被领取的次数
+    `attempts` INTEGER NOT NULL DEFAULT 0,
+    -- 租约到期的时间戳，running状态下超过这个时间还没完成就视为worker已经崩溃
+    `lease_until` REAL NOT NULL DEFAULT 0,
+    -- 最后一次领取该任务的worker
+    `worker` TEXT NOT NULL DEFAULT '',
+    -- 最后一次失败的原因
+    `error` TEXT NOT NULL DEFAULT '',
+    `created_at` REAL NOT NULL,
+    `updated_at` REAL NOT NULL,
+    UNIQUE (`kind`, `key`)
+);
+-- 领取任务时按这个索引的顺序取，不需要排序
+CREATE INDEX IF NOT EXISTS idx_jobs_claim
+ON jobs (`kind`, `state`, `priority` DESC, `job_id`);
+-- 找租约过期的任务
+CREATE INDEX IF NOT EXISTS idx_jobs_lease
+ON jobs (`state`, `lease_until`);
+""")
+async def create_table_jobs(sql: str, conn: Connection) -> None:
+    for statement in split_sql(sql):
+        await conn.execute(statement)
+    await conn.commit()
+
+
+class Job(BaseModel):
+    job_id: int = 0
+    kind: JobKind
+    key: str
+    payload: dict = {}
+    state: JobState = 'pending'
+    priority: int = 0
+    attempts: int = 0
+
+
+@relate_sql("""--sql
+INSERT OR IGNORE INTO jobs (
+    `kind`, `key`, `payload`, `priority`, `created_at`, `updated_at`
+) VALUES (
+    ?, ?, json(?), ?, ?, ?
+)
+""")
+async def enqueue_jobs(sql: str, conn: Connection, jobs: Iterable[Job]) -> tuple[int, int]:
+    '''
+    批量添加任务，已经存在的任务（不管是什么状态）会被忽略
+
+    :param conn: 数据库连接
+    :param jobs: 任务，只用到kind key payload priority这几个字段
+    :return: (新增的数量, 因为已存在而被忽略的数量)
+    '''
+    now = time.time()
+    params = [
+        (job.kind, job.key, json.dumps(job.payload, ensure_ascii=False), job.priority, now, now)
+        for job in jobs
+    ]
+    if not len(params):
+        return 0, 0
+    cur = await conn.executemany(sql, params)
+    await conn.commit()
+    inserted = max(cur.rowcount, 0)
+    return inserted, len(params) - inserted
+
+
+@relate_sql("""--sql
+UPDATE jobs SET
+    `state` = 'pending',
+    `attempts` = 0,
+    `lease_until` = 0,
+    `error` = '',
+    `updated_at` = ?
+WHERE `kind` = ? AND `key` = ? AND `state` = 'failed'
+""")
+async def requeue_jobs(sql: str, conn: Connection, kind: JobKind, keys: Iterable[str]) -> int:
+    '''
+    把重试次数用完（failed）的任务重新放回pending，领取次数清零
+
+    enqueue_jobs会忽略已经存在的任务，数据还没拿全、需要下次运行重试的任务用这个放回去
+    done的任务不会放回去，handler正常返回就表示这个任务不需要再做了（比如文章跳转到了视频，没有正文）
+
+    :param conn: 数据库连接
+    :param kind: 任务类型
+    :param keys: 任务的key，不存在、还没结束或者已经done的任务不受影响
+    :return: 放回pending的任务数
+    '''
+    now = time.time()
+    cur = await conn.executemany(sql, [(now, kind, key) for key in keys])
+    await conn.commit()
+    return max(cur.rowcount, 0)
+
+
+@relate_sql("""--sql
+UPDATE jobs SET
+    `state` = 'running',
+    `attempts` = `attempts` + 1,
+    `lease_until` = ?,
+    `worker` = ?,
+    `updated_at` = ?
+WHERE `job_id` IN (
+    SELECT `job_id` FROM jobs
+    WHERE `kind` = ? AND `state` = 'pending'
+    AND (? <= 1 OR `job_id` % ? = ?)
+    ORDER BY `priority` DESC, `job_id`
+    LIMIT ?
+)
+RETURNING `job_id`, `kind`, `key`, `payload`, `state`, `priority`, `attempts`
+""")
+async def claim_jobs(
+    sql: str,
+    conn: Connection,
+    kind: JobKind,
+    n: int = 1,
+    *,
+    lease_seconds: float = 600,
+    worker: str = '',
+    shard: tuple[int, int] | None = None,
+    max_attempts: int = 3,
+) -> list[Job]:
+    '''
+    原子地领取最多n个任务，优先级高的先领取，同优先级先入队的先领取
+
+    领取前会先把租约过期的running任务放回pending，领取次数已经用完的标记为failed，
+    每次都把worker弄崩溃的任务不会一直被重新领取
+
+    :param conn: 数据库连接
+    :param kind: 任务类型
+    :param n: 最多领取多少个
+    :param lease_seconds: 租约时长，单位为秒
+    :param worker: worker的名字，用于排查问题和按worker统计吞吐量
+    :param shard: (分片序号, 分片数)，只领取job_id % 分片数 == 分片序号的任务，None表示不分片
+    :param max_attempts: 最多领取多少次，同fail_job
+    :return: 领取到的任务，没有可领取的任务时为空列表
+    '''
+    now = time.time()
+    await _requeue_expired(conn, now, max_attempts)
+    index, shards = shard or (0, 1)
+    cur = await conn.execute(sql, (now + lease_seconds, worker, now, kind, shards, shards, index, n))
+    rows = await cur.fetchall()
+    await conn.commit()
+    jobs = [Job(
+        job_id=row[0],
+        kind=row[1],
+        key=row[2],
+        payload=json.loads(row[3]),
+        state=row[4],
+        priority=row[5],
+        attempts=row[6],
+    ) for row in rows]
+    jobs.sort(key=lambda job: (-job.priority, job.job_id))
+    return jobs
+
+
+@relate_sql("""--sql
+UPDATE jobs SET
+    `state` = CASE WHEN `attempts` < ? THEN 'pending' ELSE 'failed' END,
+    `error` = 'lease expired',
+    `lease_until` = 0,
+    `updated_at` = ?
+WHERE `state` = 'running' AND `lease_until` < ?
+""")
+async def _requeue_expired(sql: str, conn: Connection, now: float, max_attempts: int) -> int:
+    cur = await conn.execute(sql, (max_attempts, now, now))
+    return cur.rowcount
+
+
+@relate_sql("""--sql
+UPDATE jobs SET `lease_until` = ?, `updated_at` = ?
+WHERE `job_id` = ? AND `worker` = ? AND `state` = 'running'
+""")
+async def heartbeat_jobs(
+    sql: str,
+    conn: Connection,
+    job_ids: Iterable[int],
+    lease_seconds: float = 600,
+    *,
+    worker: str,
+) -> int:
+    '''
+    给处理中的任务续租，只有任务还在这个worker手上才能续，租约过期后被别人领走的不会被续上
+
+    :param conn: 数据库连接
+    :param job_ids: 任务id
+    :param lease_seconds: 从现在起续多长时间，单位为秒
+    :param worker: 领取任务的worker名字
+    :return: 续租成功的任务数
+    '''
+    now = time.time()
+    cur = await conn.executemany(sql, [
+        (now + lease_seconds, now, job_id, worker)
+        for job_id in job_ids
+    ])
+    await conn.commit()
+    return max(cur.rowcount, 0)
+
+
+@relate_sql("""--sql
+UPDATE jobs SET `state` = 'done', `error` = '', `updated_at` = ?
+WHERE `job_id` = ? AND `worker` = ? AND `state` = 'running'
+""")
+async def complete_job(sql: str, conn: Connection, job_id: int, *, worker: str) -> bool:
+    '''
+    把任务标记为已完成
+
+    只有任务还在这个worker手上（running，且最后一次是它领取的）才会标记，
+    租约过期后被别的worker重新领取的任务，原来的worker不能再改它的状态
+
+    :param conn: 数据库连接
+    :param job_id: 任务id
+    :param worker: 领取任务时的worker名字
+    :return: 成功返回True，任务不存在或者已经不在这个worker手上返回False
+    '''
+    cur = await conn.execute(sql, (time.time(), job_id, worker))
+    await conn.commit()
+    return cur.rowcount == 1
+
+
+@relate_sql("""--sql
+UPDATE jobs SET
+    `state` = CASE WHEN `attempts` < ? THEN 'pending' ELSE 'failed' END,
+    `error` = ?,
+    `lease_until` = 0,
+    `updated_at` = ?
+WHERE `job_id` = ? AND `worker` = ? AND `state` = 'running'
+""")
+async def fail_job(
+    sql: str,
+    conn: Connection,
+    job_id: int,
+    error: str = '',
+    max_attempts: int = 3,
+    *,
+    worker: str,
+) -> bool:
+    '''
+    把任务标记为失败，领取次数没超过max_attempts的话会放回pending等待重试
+
+    和complete_job一样，只有任务还在这个worker手上才会标记
+
+    :param conn: 数据库连接
+    :param job_id: 任务id
+    :param error: 失败原因
+    :param max_attempts: 最多领取多少次
+    :param worker: 领取任务时的worker名字
+    :return: 成功返回True，任务不存在或者已经不在这个worker手上返回False
+    '''
+    cur = await conn.execute(sql, (max_attempts, error, time.time(), job_id, worker))
+    await conn.commit()
+    return cur.rowcount == 1
+
+
+@track_sql
+async def count_jobs(conn: Connection, kind: JobKind) -> dict[str, int]:
+    '''
+    统计某类任务各个状态的数量
+
+    :param conn: 数据库连接
+    :param kind: 任务类型
+    :return: {状态: 数量}
+    '''
+    cur = await conn.execute(
+        'SELECT `state`, COUNT(*) FROM jobs WHERE `kind` = ? GROUP BY `state`',
+        (kind,)
+    )
+    rows = await cur.fetchall()
+    counts = {'pending': 0, 'running': 0, 'done': 0, 'failed': 0}
+    counts.update({row[0]: row[1] for row in rows})
+    return counts
+
+
+@relate_sql("""--sql
+SELECT substr(`worker`, 1, instr(`worker`, '#') - 1) AS `prefix`, `kind`, COUNT(*)
+FROM jobs
+WHERE `state` = 'done' AND `updated_at` >= ?
+GROUP BY `prefix`, `kind`
+""")
+async def count_jobs_by_worker(sql: str, conn: Connection, since: float = 0) -> dict[str, dict[str, int]]:
+    '''
+    按worker名字的前缀（run_jobs的worker参数）统计完成的任务数
+
+    :param conn: 数据库连接
+    :param since: 只统计这个时间戳之后完成的任务
+    :return: {worker前缀: {任务类型: 数量}}
+    '''
+    cur = await conn.execute(sql, (since,))
+    rows = await cur.fetchall()
+    counts: dict[str, dict[str, int]] = {}
+    for prefix, kind, n in rows:
+        counts.setdefault(prefix, {})[kind] = n
+    return counts
+
+
+async def _keep_lease(db: Database, job: Job, lease_seconds: float, worker: str) -> None:
+    while True:
+        await asyncio.sleep(lease_seconds / 3)
+        # 续租失败一次不要紧，租约是续租间隔的3倍长，下次续上就行，这个协程不能因为异常退出
+        try:
+            renewed = await db.write(heartbeat_jobs, [job.job_id], lease_seconds, worker=worker)
+        except Exception as e:
+            LOGGER.warning(f'任务 {job.kind} {job.key} 续租失败：{e!r}')
+            continue
+        if not renewed:
+            LOGGER.warning(f'任务 {job.kind} {job.key} 的租约已过期，已经被重新领取，不再续租')
+            return
+
+
+async def run_jobs(
+    db: Database,
+    kind: JobKind,
+    handler: Callable[[Job], Awaitable[Any]],
+    *,
+    concurrency: int = 1,
+    lease_seconds: float = 600,
+    max_attempts: int = 3,
+    worker: str = '',
+    shard: tuple[int, int] | None = None,
+) -> int:
+    '''
+    启动concurrency个worker不断领取并处理某一类任务，直到没有可以领取的任务为止
+
+    分片运行时先领取自己分片的任务，自己分片领完了再领取别的分片剩下的任务，
+    先做完的进程不会闲着等别的进程
+
+    处理期间会定时续租，handler正常返回则任务完成，抛出异常则任务失败并按max_attempts重试
+
+    :param db: 数据库
+    :param kind: 任务类型
+    :param handler: 处理单个任务的协程函数
+    :param concurrency: worker数量
+    :param lease_seconds: 租约时长，单位为秒
+    :param max_attempts: 最多领取多少次
+    :param worker: worker名字的前缀，后面会加上#序号@进程号，保证不同进程的worker名字不同
+    :param shard: (分片序号, 分片数)，None表示不分片
+    :return: 成功完成的任务数
+    '''
+    async def work(idx: int) -> int:
+        done = 0
+        own_shard = shard
+        name = f'{worker}#{idx}@{os.getpid()}'
+        while True:
+            jobs = await db.write(
+                claim_jobs, kind, 1,
+                lease_seconds=lease_seconds,
+                worker=name,
+                shard=own_shard,
+                max_attempts=max_attempts,
+            )
+            if not len(jobs) and own_shard is not None:
+                own_shard = None
+                continue
+            if not len(jobs):
+                return done
+            job = jobs[0]
+            keep_lease = asyncio.create_task(_keep_lease(db, job, lease_seconds, name))
+            try:
+                await handler(job)
+            except Exception as e:
+                LOGGER.warning(f'任务 {kind} {job.key} 第 {job.attempts} 次处理失败：{e!r}')
+                if not await db.write(fail_job, job.job_id, repr(e), max_attempts, worker=name):
+                    LOGGER.warning(f'任务 {kind} {job.key} 的租约已过期，已经被重新领取')
+            else:
+                if await db.write(complete_job, job.job_id, worker=name):
+                    done += 1
+                else:
+                    LOGGER.warning(f'任务 {kind} {job.key} 的租约已过期，已经被重新领取')
+            finally:
+                keep_lease.cancel()
+    results = await asyncio.gather(*[work(i) for i in range(concurrency)])
+    return sum(results)
@@ -0,0 +1,273 @@
+from typing import Iterable
+from itertools import batched
+from logging import getLogger
+import zlib
+
+from aiosqlite import Connection
+
+from dao.dao_utils import track_sql
+
+
+LOGGER = getLogger(__name__)
+
+
+'''
+冷数据归档和数据库日常维护
+
+归档库是另一个sqlite文件，用`ATTACH DATABASE ... AS archive`挂到连接上，
+表结构和主库一样（建表语句直接从主库的sqlite_master里复制），
+很久以前的文章、视频从主库搬到归档库后，主库只剩下还在用的数据，能整个放进page cache
+
+dao层的查询函数传archived=True就会去查归档库，比如：
+```python
+async with Database('data.db', archive='archive.db') as db:
+    articles = await db.read(get_articles, category='旅游', archived=True)
+```
+
+归档库的正文用最高压缩等级重新压缩，归档库没有全文索引
+'''
+
+
+# ATTACH时用的库名
+ARCHIVE_SCHEMA = 'archive'
+# 归档时每批搬多少行，每批commit一次
+ARCHIVE_BATCH_SIZE = 500
+# 每次增量vacuum最多释放多少页
+VACUUM_PAGES = 2000
+
+# 归档时要建的表，全文索引不归档
+_ARTICLE_TABLES = ('articles', 'article_contents', 'article_snapshots')
+_VIDEO_TABLES = ('videos',)
+
+
+async def attach_archive(conn: Connection, path: str = 'archive.db') -> None:
+    '''
+    把归档库挂到连接上，已经挂上的话什么都不做
+
+    ATTACH不能在事务里执行，要在连接刚打开时调用
+
+    :param conn: 数据库连接
+    :param path: 归档库文件路径，不存在会自动创建
+    '''
+    cur = await conn.execute('PRAGMA database_list')
+    if any(row[1] == ARCHIVE_SCHEMA for row in await cur.fetchall()):
+        return
+    await conn.execute(f'ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}', (path,))
+
+
+async def _create_archive_tables(conn: Connection, tables: Iterable[str]) -> None:
+    '''
+    按主库的建表语句在归档库里建表，主库后来加了列的话归档库也补上
+    '''
+    for table in tables:
+        cur = await conn.execute(
+            "SELECT `sql` FROM main.sqlite_master WHERE `type` = 'table' AND `name` = ?",
+            (table,)
+        )
+        row = await cur.fetchone()
+        if row is None:
+            raise ValueError(f'table {table!r} does not exist in the main database')
+        # sqlite_master里保存的建表语句开头总是"CREATE TABLE 表名"
+        create_sql: str = row[0]
+        body = create_sql[create_sql.index('('):]
+        await conn.execute(f'CREATE TABLE IF NOT EXISTS {ARCHIVE_SCHEMA}.{table} {body}')
+        archive_columns = await _table_columns(conn, ARCHIVE_SCHEMA, table)
+        cur = await conn.execute(f'PRAGMA main.table_info({table})')
+        for column in await cur.fetchall():
+            name, type_, _, default = column[1], column[2], column[3], column[4]
+            if name in archive_columns:
+                continue
+            LOGGER.info(f'归档库的 {table} 表补上 {name} 列')
+            # 不带NOT NULL约束，旧的归档行在这一列是默认值
+            default_sql = f' DEFAULT {default}' if default is not None else ''
+            await conn.execute(
+                f'ALTER TABLE {ARCHIVE_SCHEMA}.{table} ADD COLUMN `{name}` {type_}{default_sql}'
+            )
+
+
+async def _table_columns(conn: Connection, schema: str, table: str) -> list[str]:
+    cur = await conn.execute(f'PRAGMA {schema}.table_info({table})')
+    return [row[1] for row in await cur.fetchall()]
+
+
+async def _move_rows(
+    conn: Connection,
+    table: str,
+    key: str,
+    ids: tuple[str, ...],
+) -> int:
+    '''
+    把主库里key在ids里的行复制到归档库（已经存在的覆盖），再从主库删掉
+    '''
+    columns = ', '.join(f'`{column}`' for column in await _table_columns(conn, 'main', table))
+    placeholders = ', '.join('?' * len(ids))
+    await conn.execute(
+        f'INSERT OR REPLACE INTO {ARCHIVE_SCHEMA}.{table} ({columns}) '
+        f'SELECT {columns} FROM main.{table} WHERE `{key}` IN ({placeholders})',
+        ids
+    )
+    cur = await conn.execute(f'DELETE FROM main.{table} WHERE `{key}` IN ({placeholders})', ids)
+    return cur.rowcount
+
+
+async def _move_contents(conn: Connection, ids: tuple[str, ...]) -> None:
+    '''
+    正文用最高压缩等级重新压缩后搬到归档库
+    '''
+    placeholders = ', '.join('?' * len(ids))
+    cur = await conn.execute(
+        f'SELECT `id`, `content` FROM main.article_contents WHERE `id` IN ({placeholders})',
+        ids
+    )
+    rows = await cur.fetchall()
+    await conn.executemany(
+        f'INSERT OR REPLACE INTO {ARCHIVE_SCHEMA}.article_contents (`id`, `content`) VALUES (?, ?)',
+        [(id_, zlib.compress(zlib.decompress(data), 9)) for id_, data in rows]
+    )
+    await conn.execute(f'DELETE FROM main.article_contents WHERE `id` IN ({placeholders})', ids)
+
+
+async def _select_ids(
+    conn: Connection,
+    table: str,
+    uploaded_before: str | None,
+    ids: Iterable[str] | None,
+    limit: int | None = None,
+) -> list[str]:
+    conds: list[str] = []
+    params: list = []
+    if uploaded_before is not None:
+        conds.append('`upload_time` < ?')
+        params.append(uploaded_before)
+    if ids is not None:
+        # 临时表比很长的IN列表快，也不受绑定参数个数的限制
+        await conn.execute('CREATE TEMP TABLE IF NOT EXISTS archive_ids (`id` TEXT PRIMARY KEY)')
+        await conn.execute('DELETE FROM temp.archive_ids')
+        await conn.executemany(
+            'INSERT OR IGNORE INTO temp.archive_ids (`id`) VALUES (?)',
+            [(id_,) for id_ in ids]
+        )
+        conds.append('`id` IN (SELECT `id` FROM temp.archive_ids)')
+    if not len(conds):
+        raise ValueError('at least one of uploaded_before and ids must be given')
+    sql = f'SELECT `id` FROM main.{table} WHERE {" OR ".join(conds)} ORDER BY `id`'
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    cur = await conn.execute(sql, params)
+    return [row[0] for row in await cur.fetchall()]
+
+
+@track_sql
+async def archive_articles(
+    conn: Connection,
+    *,
+    uploaded_before: str | None = None,
+    ids: Iterable[str] | None = None,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+    limit: int | None = None,
+) -> int:
+    '''
+    把旧文章（或者指定的文章，比如已经用过的）从主库搬到归档库
+
+    文章本身、正文和互动数据的快照一起搬走，主库的全文索引里也会删掉这些文章
+    符合任意一个条件的文章都会被搬走
+
+    :param conn: 已经ATTACH了归档库的连接，见attach_archive
+    :param uploaded_before: 发布时间早于它的文章，格式为'YYYY-MM-DD'，没有发布时间的文章不算
+    :param ids: 这些id的文章
+    :param batch_size: 每批搬多少篇，每批commit一次
+    :param limit: 这次最多搬多少篇。通过Database.write调用时，一次调用会一直占着写协程，
+        可以每次只搬一批，循环调用到返回0为止，中间别的写操作能插进来
+    :return: 搬走的文章数
+    '''
+    await _create_archive_tables(conn, _ARTICLE_TABLES)
+    moved = 0
+    for batch in batched(await _select_ids(conn, 'articles', uploaded_before, ids, limit), batch_size):
+        placeholders = ', '.join('?' * len(batch))
+        # 删掉article_tokens的行时触发器会同步删掉全文索引
+        await conn.execute(f'DELETE FROM main.article_tokens WHERE `id` IN ({placeholders})', batch)
+        await _move_contents(conn, batch)
+        await _move_rows(conn, 'article_snapshots', 'article_id', batch)
+        moved += await _move_rows(conn, 'articles', 'id', batch)
+        await conn.commit()
+    LOGGER.debug(f'已归档 {moved} 篇文章')
+    return moved
+
+
+@track_sql
+async def archive_videos(
+    conn: Connection,
+    *,
+    uploaded_before: str | None = None,
+    ids: Iterable[str] | None = None,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+    limit: int | None = None,
+) -> int:
+    '''
+    把旧视频（或者指定的视频）的记录从主库搬到归档库，本地的视频文件不动
+
+    :param conn: 已经ATTACH了归档库的连接，见attach_archive
+    :param uploaded_before: 发布时间早于它的视频，格式为'YYYY-MM-DD'
+    :param ids: 这些id的视频
+    :param batch_size: 每批搬多少个，每批commit一次
+    :param limit: 这次最多搬多少个，同archive_articles
+    :return: 搬走的视频数
+    '''
+    await _create_archive_tables(conn, _VIDEO_TABLES)
+    moved = 0
+    for batch in batched(await _select_ids(conn, 'videos', uploaded_before, ids, limit), batch_size):
+        moved += await _move_rows(conn, 'videos', 'id', batch)
+        await conn.commit()
+    LOGGER.debug(f'已归档 {moved} 个视频')
+    return moved
+
+
+@track_sql
+async def optimize_database(
+    conn: Connection,
+    *,
+    analyze: bool = False,
+    vacuum_pages: int = VACUUM_PAGES,
+) -> None:
+    '''
+    日常维护，可以在事务里执行，Database会定时调用
+
+    - analyze为True时重新统计所有索引（ANALYZE），数据分布变化很大之后用
+    - PRAGMA optimize，只重新统计查询计划可能因此变化的表，很快
+    - 开启了auto_vacuum = INCREMENTAL的话，把空闲页还给文件系统，见enable_incremental_vacuum
+
+    :param conn: 数据库连接
+    :param analyze: 是否执行完整的ANALYZE
+    :param vacuum_pages: 最多释放多少个空闲页，0表示不释放
+    '''
+    if analyze:
+        await conn.execute('ANALYZE')
+    await conn.execute('PRAGMA optimize')
+    cur = await conn.execute('PRAGMA auto_vacuum')
+    row = await cur.fetchone()
+    # 2表示INCREMENTAL
+    if vacuum_pages > 0 and row is not None and row[0] == 2:
+        cur = await conn.execute(f'PRAGMA incremental_vacuum({int(vacuum_pages)})')
+        await cur.fetchall()
+    await conn.commit()
+
+
+async def enable_incremental_vacuum(conn: Connection) -> bool:
+    '''
+    把主库改成auto_vacuum = INCREMENTAL，之后optimize_database才能释放空闲页
+
+    已经存在的库要完整VACUUM一次才会生效，会重写整个文件，
+    VACUUM不能在事务里执行，不能交给Database.write，要用单独的连接，并且没有其他连接在写
+
+    :param conn: 数据库连接
+    :return: 这次是否执行了VACUUM
+    '''
+    cur = await conn.execute('PRAGMA auto_vacuum')
+    row = await cur.fetchone()
+    if row is not None and row[0] == 2:
+        return False
+    LOGGER.info('开启增量vacuum，需要完整VACUUM一次，可能要等一会')
+    await conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    await conn.execute('VACUUM')
+    return True
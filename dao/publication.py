@@ -0,0 +1,203 @@
+from typing import Iterable, Literal
+from hashlib import sha256
+import json
+import time
+
+from aiosqlite import Connection
+from pydantic import BaseModel
+
+from dao.dao_utils import relate_sql, split_sql
+
+
+'''
+发布记录
+
+每个（文章, 账号, 发布方式）一行，记录有没有发出去、试了几次、发出去的洗稿内容的hash
+上传脚本选文章时用NOT EXISTS排除已经发布成功的文章，重新运行不会重复洗稿、重复发布
+'''
+
+
+# weitoutiao: 微头条 article: 图文 video: 视频
+PublicationKind = Literal['weitoutiao', 'article', 'video']
+# running: 正在发布（或者上次运行中途退出了） done: 发布成功 failed: 发布失败
+PublicationStatus = Literal['running', 'done', 'failed']
+
+
+@relate_sql("""--sql
+CREATE TABLE IF NOT EXISTS publications (
+    -- 视频的话是视频id
+    `article_id` TEXT NOT NULL,
+    `phone` VARCHAR(11) NOT NULL,
+    `kind` TEXT NOT NULL,
+    `status` TEXT NOT NULL DEFAULT 'running',
+    `attempts` INTEGER NOT NULL DEFAULT 0,
+    -- 发布出去的内容（洗稿后的正文）的sha256，没发布成功为''
+    `content_hash` TEXT NOT NULL DEFAULT '',
+    -- 最后一次失败的原因
+    `error` TEXT NOT NULL DEFAULT '',
+    `created_at` REAL NOT NULL,
+    `updated_at` REAL NOT NULL,
+    PRIMARY KEY (`article_id`, `phone`, `kind`)
+) WITHOUT ROWID;
+-- 选文章时判断某篇文章有没有以某种方式发布过，只需要读这个索引
+CREATE INDEX IF NOT EXISTS idx_publications_kind_status
+ON publications (`kind`, `status`, `article_id`);
+""")
+async def create_table_publications(sql: str, conn: Connection) -> None:
+    for statement in split_sql(sql):
+        await conn.execute(statement)
+    await conn.commit()
+
+
+class Publication(BaseModel):
+    article_id: str
+    phone: str
+    kind: PublicationKind
+    status: PublicationStatus = 'running'
+    attempts: int = 0
+    content_hash: str = ''
+    error: str = ''
+
+
+def content_hash(content: str) -> str:
+    return sha256(content.encode('utf-8')).hexdigest()
+
+
+@relate_sql("""--sql
+INSERT INTO publications (
+    `article_id`, `phone`, `kind`, `status`, `attempts`, `created_at`, `updated_at`
+) VALUES (
+    ?, ?, ?, 'running', 1, ?, ?
+)
+ON CONFLICT (`article_id`, `phone`, `kind`) DO UPDATE SET
+    `status` = 'running',
+    `attempts` = `attempts` + 1,
+    `updated_at` = excluded.`updated_at`
+RETURNING `article_id`, `phone`, `kind`, `status`, `attempts`, `content_hash`, `error`
+""")
+async def start_publication(
+    sql: str,
+    conn: Connection,
+    article_id: str,
+    phone: str,
+    kind: PublicationKind,
+) -> Publication:
+    '''
+    开始发布前调用，记下这次尝试
+
+    :param conn: 数据库连接
+    :param article_id: 文章id
+    :param phone: 发布用的账号
+    :param kind: 发布方式
+    :return: 发布记录，attempts包括这一次
+    '''
+    now = time.time()
+    cur = await conn.execute(sql, (article_id, phone, kind, now, now))
+    row = await cur.fetchone()
+    await cur.close()
+    await conn.commit()
+    assert row is not None
+    return Publication(
+        article_id=row[0],
+        phone=row[1],
+        kind=row[2],
+        status=row[3],
+        attempts=row[4],
+        content_hash=row[5],
+        error=row[6],
+    )
+
+
+@relate_sql("""--sql
+UPDATE publications SET
+    `status` = 'done',
+    `content_hash` = ?,
+    `error` = '',
+    `updated_at` = ?
+WHERE `article_id` = ? AND `phone` = ? AND `kind` = ?
+""")
+async def finish_publication(
+    sql: str,
+    conn: Connection,
+    article_id: str,
+    phone: str,
+    kind: PublicationKind,
+    content: str,
+) -> bool:
+    '''
+    发布成功后调用
+
+    :param conn: 数据库连接
+    :param article_id: 文章id
+    :param phone: 发布用的账号
+    :param kind: 发布方式
+    :param content: 发布出去的内容，只保存它的hash
+    :return: 成功返回True，没有对应的发布记录返回False
+    '''
+    cur = await conn.execute(sql, (content_hash(content), time.time(), article_id, phone, kind))
+    await conn.commit()
+    return cur.rowcount == 1
+
+
+@relate_sql("""--sql
+UPDATE publications SET
+    `status` = 'failed',
+    `error` = ?,
+    `updated_at` = ?
+WHERE `article_id` = ? AND `phone` = ? AND `kind` = ?
+""")
+async def fail_publication(
+    sql: str,
+    conn: Connection,
+    article_id: str,
+    phone: str,
+    kind: PublicationKind,
+    error: str = '',
+) -> bool:
+    '''
+    发布失败后调用，下次运行还会再选到这篇文章
+
+    :param conn: 数据库连接
+    :param article_id: 文章id
+    :param phone: 发布用的账号
+    :param kind: 发布方式
+    :param error: 失败原因
+    :return: 成功返回True，没有对应的发布记录返回False
+    '''
+    cur = await conn.execute(sql, (error, time.time(), article_id, phone, kind))
+    await conn.commit()
+    return cur.rowcount == 1
+
+
+@relate_sql("""--sql
+SELECT `status`, COUNT(*) FROM publications WHERE `kind` = ? GROUP BY `status`
+""")
+async def count_publications(sql: str, conn: Connection, kind: PublicationKind) -> dict[str, int]:
+    '''
+    统计某种发布方式各个状态的数量
+
+    :param conn: 数据库连接
+    :param kind: 发布方式
+    :return: {状态: 数量}
+    '''
+    cur = await conn.execute(sql, (kind,))
+    rows = await cur.fetchall()
+    counts = {'running': 0, 'done': 0, 'failed': 0}
+    counts.update({row[0]: row[1] for row in rows})
+    return counts
+
+
+@relate_sql("""--sql
+SELECT DISTINCT `article_id` FROM publications
+WHERE `status` = 'done' AND `kind` IN (SELECT `value` FROM json_each(?))
+""")
+async def get_published_ids(sql: str, conn: Connection, kinds: Iterable[PublicationKind]) -> list[str]:
+    '''
+    获取已经以某几种方式发布成功过的文章（或视频）的id，不管是哪个账号发布的
+
+    :param conn: 数据库连接
+    :param kinds: 发布方式
+    :return: 文章id列表
+    '''
+    cur = await conn.execute(sql, (json.dumps(list(kinds)),))
+    return [row[0] for row in await cur.fetchall()]
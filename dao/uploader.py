@@ -0,0 +1,79 @@
+from logging import getLogger
+import time
+
+from aiosqlite import Connection
+from pydantic import BaseModel
+
+from dao.dao_utils import relate_sql
+
+
+LOGGER = getLogger(__name__)
+
+# 上传者粉丝数缓存的默认有效期，单位为秒
+UPLOADER_TTL = 7 * 24 * 60 * 60
+
+
+@relate_sql("""--sql
+CREATE TABLE IF NOT EXISTS uploaders (
+    -- 上传者主页链接里的最后一段
+    `token` TEXT PRIMARY KEY,
+    `fans_count` INTEGER NOT NULL,
+    -- 获取粉丝数时的时间戳
+    `fetched_at` REAL NOT NULL
+) WITHOUT ROWID
+""")
+async def create_table_uploaders(sql: str, conn: Connection) -> None:
+    await conn.execute(sql)
+    await conn.commit()
+
+
+class Uploader(BaseModel):
+    token: str
+    fans_count: int
+    fetched_at: float
+
+
+@relate_sql("""--sql
+SELECT `token`, `fans_count`, `fetched_at` FROM uploaders
+WHERE `token` = ? AND `fetched_at` >= ?
+""")
+async def get_uploader(
+    sql: str,
+    conn: Connection,
+    token: str,
+    ttl: float = UPLOADER_TTL,
+) -> Uploader | None:
+    '''
+    获取缓存的上传者信息
+
+    :param conn: 数据库连接
+    :param token: 上传者主页链接里的最后一段
+    :param ttl: 缓存有效期，单位为秒，超过这个时间的缓存视为不存在
+    :return: 上传者信息，没有缓存或者缓存已过期时返回None
+    '''
+    cur = await conn.execute(sql, (token, time.time() - ttl))
+    row = await cur.fetchone()
+    if row is None:
+        return None
+    return Uploader(token=row[0], fans_count=row[1], fetched_at=row[2])
+
+
+@relate_sql("""--sql
+INSERT INTO uploaders (`token`, `fans_count`, `fetched_at`) VALUES (?, ?, ?)
+ON CONFLICT (`token`) DO UPDATE SET
+    `fans_count` = excluded.`fans_count`,
+    `fetched_at` = excluded.`fetched_at`
+""")
+async def save_uploader(sql: str, conn: Connection, token: str, fans_count: int) -> Uploader:
+    '''
+    保存上传者的粉丝数，已存在则覆盖
+
+    :param conn: 数据库连接
+    :param token: 上传者主页链接里的最后一段
+    :param fans_count: 粉丝数
+    :return: 保存后的上传者信息
+    '''
+    uploader = Uploader(token=token, fans_count=fans_count, fetched_at=time.time())
+    await conn.execute(sql, (uploader.token, uploader.fans_count, uploader.fetched_at))
+    await conn.commit()
+    return uploader
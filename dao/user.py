@@ -1,10 +1,11 @@
 from typing import Annotated as Annt
+from typing import AsyncIterator
 import json
 
 from pydantic import BaseModel, Field
 from aiosqlite import Connection
 
-from dao.dao_utils import relate_sql
+from dao.dao_utils import relate_sql, construct_model
 from playwright._impl._api_structures import Cookie
 
 
@@ -34,6 +35,18 @@ class User(BaseModel):
     cookies: list[Cookie] = []
 
 
+def _row2user(row: tuple, validate: bool) -> User:
+    fields = {
+        'phone': row[0],
+        'password': row[1],
+        'cookies': json.loads(row[2]),
+    }
+    if validate:
+        return User(**fields)
+    # 不再逐个cookie校验Cookie这个TypedDict
+    return construct_model(User, fields)
+
+
 @relate_sql("""--sql
 INSERT OR IGNORE INTO
 users (`phone`, `password`, `cookies`)
@@ -73,16 +86,54 @@ async def user_pwd(sql: str, conn: Connection, phone: str | int) -> str | None:
 @relate_sql("""--sql
 SELECT `phone`, `password`, `cookies` FROM users;
 """)
-async def all_users(sql, conn: Connection) -> list[User]:
+async def all_users(sql, conn: Connection, validate: bool = True) -> list[User]:
     cur = await conn.execute(sql)
     rows = await cur.fetchall()
-    return [User(
-        phone=row[0],
-        password=row[1],
-        cookies=json.loads(row[2])
-    ) for row in rows]
+    return [_row2user(row, validate) for row in rows]
 
 
+async def iter_users(
+    conn: Connection,
+    *,
+    after_phone: str | None = None,
+    limit: int | None = None,
+    batch_size: int = 100,
+    validate: bool = True,
+) -> AsyncIterator[User]:
+    '''
+    按手机号顺序逐批读取用户，每一批都是一次独立的查询，不会一次把整张表读进内存
+
+    :param after_phone: 只读取手机号大于它的用户，用于断点续读
+    :param limit: 最多读取多少个，None表示不限
+    :param batch_size: 每批读取多少个
+    :param validate: 是否校验手机号和cookies，读自己数据库里的数据时可以传False跳过校验
+    :return: 用户的异步迭代器
+    '''
+    if batch_size < 1:
+        raise ValueError('batch_size must be at least 1')
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        if after_phone is None:
+            cur = await conn.execute(
+                'SELECT `phone`, `password`, `cookies` FROM users ORDER BY `phone` LIMIT ?',
+                (size,)
+            )
+        else:
+            cur = await conn.execute(
+                'SELECT `phone`, `password`, `cookies` FROM users WHERE `phone` > ? ORDER BY `phone` LIMIT ?',
+                (after_phone, size)
+            )
+        rows = await cur.fetchall()
+        await cur.close()
+        for row in rows:
+            yield _row2user(row, validate)
+        if len(rows) < size:
+            return
+        after_phone = rows[-1][0]
+        if remaining is not None:
+            remaining -= len(rows)
+
 
 @relate_sql("""--sql
 SELECT `phone`, `password`, `cookies` FROM users WHERE `phone` = ?;
@@ -1,11 +1,12 @@
 from typing import Annotated as Annt
 from typing import overload
+from typing import AsyncIterator, Iterable
 from pathlib import Path
 
 from aiosqlite import Connection
-from pydantic import BaseModel
 
-from dao.dao_utils import relate_sql
+from dao.dao_utils import relate_sql, track_sql, construct_model
+from dao.dao_utils import TrackedModel, update_dirty_fields
 
 
 '''
@@ -81,7 +82,7 @@ async def create_table_videos(sql: str, conn: Connection) -> None:
     await conn.commit()
 
 
-class Video(BaseModel):
+class Video(TrackedModel):
     id: str
     title: str
     url: str
@@ -92,6 +93,7 @@ class Video(BaseModel):
     download_url: str = ''
     audio_url: str = ''
     uploader: str = ''
+    uploader_fans_count: int = -1
     like_count: int = -1
     comment_count: int = -1
     collect_count: int = -1
@@ -129,6 +131,147 @@ async def insert_video(
     return cur.rowcount == 1
 
 
+@relate_sql("""--sql
+INSERT OR IGNORE INTO videos (
+    `id`, `title`, `url`, `category`, `keyword`
+) VALUES (
+   ?, ?, ?, ?, ?
+);
+""")
+async def insert_videos(
+    sql: str,
+    conn: Connection,
+    videos: Iterable[Video],
+) -> tuple[int, int]:
+    '''
+    批量插入视频，已经存在的就忽略，所有视频在同一个事务里插入，只commit一次
+
+    :param conn: sqlite3连接
+    :param videos: 视频对象
+    :return: (插入成功的数量, 因为已存在而被忽略的数量)
+    '''
+    params = [
+        (video.id, video.title, video.url, video.category, video.keyword)
+        for video in videos
+    ]
+    if not len(params):
+        return 0, 0
+    cur = await conn.executemany(sql, params)
+    await conn.commit()
+    inserted = max(cur.rowcount, 0)
+    return inserted, len(params) - inserted
+
+
+async def iter_videos(
+    conn: Connection,
+    category: str | None = None,
+    keyword: str | None = None,
+    *,
+    after_id: str | None = None,
+    limit: int | None = None,
+    batch_size: int = 500,
+    validate: bool = True,
+    archived: bool = False,
+) -> AsyncIterator[Video]:
+    '''
+    按id顺序逐批读取视频，每一批都是一次独立的查询，不会一次把整张表读进内存
+
+    :param conn: sqlite3连接
+    :param category: 分类，None表示不限
+    :param keyword: 关键词，None表示不限
+    :param after_id: 只读取id大于它的视频，用于断点续读
+    :param limit: 最多读取多少个，None表示不限
+    :param batch_size: 每批读取多少个
+    :param validate: 是否用pydantic校验每一行，读自己数据库里的数据时可以传False跳过校验
+    :param archived: 读取归档库里的视频，连接需要已经ATTACH了归档库，见dao.maintenance
+    :return: 视频的异步迭代器
+    '''
+    if batch_size < 1:
+        raise ValueError('batch_size must be at least 1')
+    columns = tuple(Video.model_fields)
+    schema = 'archive' if archived else 'main'
+    base_conds: list[str] = []
+    base_params: list = []
+    if category is not None:
+        base_conds.append('`category` = ?')
+        base_params.append(category)
+    if keyword is not None:
+        base_conds.append('`keyword` = ?')
+        base_params.append(keyword)
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        conds = list(base_conds)
+        params = list(base_params)
+        if after_id is not None:
+            conds.append('`id` > ?')
+            params.append(after_id)
+        sql = f'SELECT {", ".join(f"`{column}`" for column in columns)} FROM {schema}.videos'
+        if len(conds):
+            sql += ' WHERE ' + ' AND '.join(conds)
+        sql += ' ORDER BY `id` LIMIT ?'
+        params.append(size)
+        cur = await conn.execute(sql, params)
+        rows = await cur.fetchall()
+        await cur.close()
+        for row in rows:
+            fields = dict(zip(columns, row))
+            # upload_time在表里默认是NULL
+            fields['upload_time'] = fields['upload_time'] or ''
+            if validate:
+                yield Video(**fields)
+            else:
+                fields['path'] = Path(fields['path'])
+                yield construct_model(Video, fields)
+        if len(rows) < size:
+            return
+        after_id = rows[-1][0]
+        if remaining is not None:
+            remaining -= len(rows)
+
+
+# 除了id以外都可以更新
+_UPDATABLE_COLUMNS = tuple(
+    name for name in Video.model_fields
+    if name != 'id'
+)
+
+
+@track_sql
+async def update_video(
+    conn: Connection,
+    video: Video,
+) -> bool:
+    '''
+    更新一个视频，只写入从数据库读出来（或创建）之后被改过的字段
+
+    :param conn: sqlite3连接
+    :param video: 视频对象
+    :return: 更新成功返回True，否则返回False（包括没有需要更新的字段）
+    '''
+    updated = await update_dirty_fields(conn, 'videos', [video], _UPDATABLE_COLUMNS)
+    await conn.commit()
+    return updated > 0
+
+
+@track_sql
+async def update_videos(
+    conn: Connection,
+    videos: Iterable[Video],
+) -> int:
+    '''
+    批量更新视频，所有视频在同一个事务里更新，只commit一次
+
+    :param conn: sqlite3连接
+    :param videos: 视频对象
+    :return: 更新的视频数
+    '''
+    updated = await update_dirty_fields(conn, 'videos', videos, _UPDATABLE_COLUMNS)
+    await conn.commit()
+    return updated
+
+
+@track_sql
 async def update_video_params(
     conn: Connection,
     video_id: str,
@@ -144,16 +287,35 @@ async def update_video_params(
     collect_count: int = -1,
     views_count: int = -1,
 ) -> int:
-    # 第一步：
-    # 如果download_url不为空，且确实不一样了
-    # 就更新download_url
-    # 可能会更新audio_url
-    # 不更新path，做一个单独的下载视频的函数比较好
-
-    # 第二步：
-    # 更新uploader_fans_count uploader
+    '''
+    更新视频爬取到的参数，保持默认值（空字符串或-1）的参数表示没爬到，不会写入
 
-    # 第三步：
-    # 最后更新likes_count comments_count favours_count views_count
+    不更新path和md5，这两个由下载视频的函数负责
 
-    return 0
+    :param conn: sqlite3连接
+    :param video_id: 视频id
+    :return: 更新的行数
+    '''
+    params = {
+        'download_url': download_url,
+        'audio_url': audio_url,
+        'uploader': uploader,
+        'uploader_fans_count': uploader_fans_count,
+        'like_count': like_count,
+        'comment_count': comment_count,
+        'collect_count': collect_count,
+        'view_count': views_count,
+    }
+    params = {
+        column: value for column, value in params.items()
+        if value not in ('', -1)
+    }
+    if not len(params):
+        return 0
+    assignments = ', '.join(f'`{column}` = ?' for column in params)
+    cur = await conn.execute(
+        f'UPDATE videos SET {assignments} WHERE `id` = ?',
+        (*params.values(), video_id)
+    )
+    await conn.commit()
+    return cur.rowcount
@@ -1,20 +1,26 @@
 import asyncio
-from asyncio import Queue
+import os
 from pathlib import Path
-from random import shuffle
-from typing import Awaitable
-from itertools import chain
 
 from playwright.async_api import async_playwright
 from playwright.async_api import Page, Browser, BrowserContext
 from playwright_stealth import Stealth
-from aiosqlite import connect
 from logging import getLogger, basicConfig, INFO
 import yaml
 
-from scrape.article import search_articles, fetch_article_info
-from dao.article import Article
-from dao.article import all_articles, create_table_article, get_articles
+from scrape.article import search_articles, fetch_article_info, refresh_stale_articles
+from scrape.extract import set_extract_mode, set_parse_backend, ParsePool
+from scrape.route import ResourceBlocker
+from scrape.capture import set_search_mode
+from scrape.fetcher import HttpFetcher
+from scrape.pool import PagePool, MAX_NAVIGATIONS
+from dao.database import Database
+from dao.dao_utils import set_slow_query_threshold, dump_sql_stats
+from dao.article import create_table_article, get_articles, count_articles
+from dao.uploader import UPLOADER_TTL
+from dao.uploader import create_table_uploaders
+from dao.job import Job
+from dao.job import create_table_jobs, enqueue_jobs, requeue_jobs, run_jobs, count_jobs
 
 
 HEADLESS = False
@@ -32,53 +38,217 @@ HEADERS = {
 }
 
 
-async def main():
+# 分片运行时，自己的任务做完了但别的进程还在搜索，每隔多少秒看一次有没有新的详情任务
+SHARD_POLL_INTERVAL = 10
+
+
+def load_config() -> tuple[dict[str, list[str]], dict] | None:
+    '''
+    读取分类关键字和配置文件，并按配置设置提取方式等全局选项
+
+    :return: (分类关键字, 配置)，文件不存在时返回None
+    '''
     catg_keywords_file = Path() / 'catg_keywords.yaml'
     config_file = Path() / 'config.yaml'
     if not catg_keywords_file.exists():
         LOGGER.error(f'分类关键字文件 {catg_keywords_file} 不存在')
-        return
+        return None
     if not config_file.exists():
         LOGGER.error(f'配置文件 {config_file} 不存在')
-        return
+        return None
     catg_keywords: dict[str, list[str]] = yaml.safe_load(catg_keywords_file.read_text(encoding='utf-8'))
     config: dict = yaml.safe_load(config_file.read_text(encoding='utf-8'))
     playwright_config = config.get('playwright', {})
+    sqlite_config = config.get('sqlite', {})
+    set_extract_mode(playwright_config.get('extract_mode', 'evaluate'))
+    set_parse_backend(playwright_config.get('parse_backend', 'lxml'))
+    set_search_mode(
+        playwright_config.get('search_mode', 'response'),
+        playwright_config.get('search_response_pattern'),
+    )
+    set_slow_query_threshold(sqlite_config.pop('slow_query_threshold', None))
+    return catg_keywords, config
+
+
+async def create_tables(db: Database) -> None:
+    await db.write(create_table_article)
+    await db.write(create_table_uploaders)
+    await db.write(create_table_jobs)
+
+
+async def enqueue_search_jobs(db: Database, catg_keywords: dict[str, list[str]], max_pages_idx: int) -> int:
+    '''
+    给每个分类的每个关键词添加搜索任务
+
+    搜索任务优先级更高，因为它给后面的详情任务提供数据
+    已经完成的任务不会被重复添加，所以中断后重新运行只会做剩下的任务
+    有任务表之前爬的关键词没有任务记录，沿用以前的规则：已经有文章就跳过
+
+    :param db: 数据库
+    :param catg_keywords: {分类: [关键词]}
+    :param max_pages_idx: 每个关键词搜索多少页
+    :return: 新增的任务数
+    '''
+    legacy = not sum((await db.read(count_jobs, 'search_page')).values())
+    search_jobs: list[Job] = []
+    for category, keywords in catg_keywords.items():
+        for keyword in keywords:
+            if legacy and await db.read(count_articles, category, keyword):
+                LOGGER.info(f'已存在 {category} 分类 {keyword} 文章，跳过')
+                continue
+            search_jobs.extend([Job(
+                kind='search_page',
+                key=f'{category}/{keyword}/{page_num}',
+                payload={'category': category, 'keyword': keyword, 'page_num': page_num},
+                priority=10,
+            ) for page_num in range(max_pages_idx)])
+    inserted, _ = await db.write(enqueue_jobs, search_jobs)
+    LOGGER.info(f'新增 {inserted} 个搜索任务')
+    return inserted
+
+
+async def enqueue_detail_jobs(db: Database) -> int:
+    '''
+    给之前搜到但还没获取到正文的文章补上详情任务
+
+    以前运行时重试次数用完（一直遇到反爬、数据不完整没写进数据库）的详情任务也放回pending，
+    每次运行都会重试这些文章；done的任务不放回，没有正文但done的是跳转到视频的文章，重试也没用
+
+    :param db: 数据库
+    :return: 新增和放回pending的任务数
+    '''
+    articles = await db.read(get_articles, has_content=False, columns=('id',), validate=False)
+    inserted, _ = await db.write(enqueue_jobs, [
+        Job(kind='article_detail', key=article.id, payload={'id': article.id})
+        for article in articles
+    ])
+    requeued = await db.write(requeue_jobs, 'article_detail', [article.id for article in articles])
+    LOGGER.info(f'补上 {inserted} 个详情任务，重新放回 {requeued} 个失败的详情任务')
+    return inserted + requeued
+
+
+async def crawl(
+    catg_keywords: dict[str, list[str]],
+    config: dict,
+    *,
+    shard: tuple[int, int] | None = None,
+) -> None:
+    '''
+    启动一个浏览器，搜索、获取详情、更新旧文章
+
+    :param catg_keywords: {分类: [关键词]}
+    :param config: 配置
+    :param shard: (分片序号, 分片数)，多进程运行时每个进程只先领取自己分片的任务，
+        搜索任务和补的详情任务由主进程添加，旧文章只由0号分片更新，None表示单进程运行
+    '''
+    playwright_config = config.get('playwright', {})
+    sqlite_config = config.get('sqlite', {})
+    worker = f'shard{shard[0]}' if shard is not None else ''
+    parse_workers = playwright_config.get('parse_workers')
+    if shard is not None and not parse_workers:
+        # 每个分片都有自己的解析进程池，加起来不超过cpu核数
+        parse_workers = max(1, (os.cpu_count() or 1) // shard[1])
     async with (
         async_playwright() as p,
-        connect('data.db') as conn,
+        Database('data.db', **sqlite_config) as db,
+        ParsePool(parse_workers),
+        HttpFetcher(HEADERS, limit=playwright_config.get('http_limit', 8)) as http,
     ):
-        await create_table_article(conn)
+        await create_tables(db)
         browser: Browser = await p.chromium.launch(headless=HEADLESS)
         context = await browser.new_context()
         context.set_default_timeout(playwright_config['timeout'])
         await context.set_extra_http_headers(HEADERS)
-        page_queue: Queue[Page] = Queue()
-        for _ in range(playwright_config['max_pages_count']):
+        # 图片、字体、统计脚本等提取数据用不到的请求直接拦截掉
+        blocker = ResourceBlocker(**playwright_config.get('block', {}))
+        await blocker.apply(context)
+        # 直接请求文章页时带上浏览器的cookie
+        http.attach(context)
+        http_first = playwright_config.get('http_first', True)
+
+        async def new_page() -> Page:
             page = await context.new_page()
             stealth = Stealth()
             await stealth.apply_stealth_async(page)
-            await page_queue.put(page)
-        for category, keywords in catg_keywords.items():
-            search_tasks: list[Awaitable[list[Article]]] = []
-            for i, keyword in enumerate(keywords):
-                exists = len(await get_articles(conn, category, keyword))
-                LOGGER.info(f'开始获取 {category} 分类第 {i+1}/{len(keywords)} 个关键字 {keyword} 文章')
-                if exists:
-                    LOGGER.info(f'已存在 {category} 分类 {keyword} 文章，跳过')
-                    continue
-                search_tasks.extend([search_articles(
-                    page_queue,
-                    conn, category, keyword, i
-                ) for i in range(playwright_config['max_pages_idx'])])
-                await asyncio.gather(*search_tasks, return_exceptions=True)
-            articles = await get_articles(conn, category)
-            fetch_tasks = [
-                fetch_article_info(page_queue, conn, article)
-                for article in articles
-            ]
-            shuffle(fetch_tasks)
-            await asyncio.gather(*fetch_tasks, return_exceptions=True)
+            return page
+
+        max_pages_count = playwright_config['max_pages_count']
+        max_heap_mb = playwright_config.get('max_page_heap_mb')
+        # 出异常、被取消时也要关掉所有页面和页面池的后台任务
+        async with PagePool(
+            new_page, max_pages_count,
+            max_navigations=playwright_config.get('max_page_navigations', MAX_NAVIGATIONS),
+            max_heap_bytes=max_heap_mb * 1024 * 1024 if max_heap_mb else None,
+        ) as page_pool:
+            uploader_ttl = playwright_config.get('uploader_ttl', UPLOADER_TTL)
+            # 第一步：搜索
+            if shard is None:
+                await enqueue_search_jobs(db, catg_keywords, playwright_config['max_pages_idx'])
+
+            async def search(job: Job) -> None:
+                articles = await search_articles(page_pool, db, **job.payload)
+                await db.write(enqueue_jobs, [
+                    Job(kind='article_detail', key=article.id, payload={'id': article.id})
+                    for article in articles
+                ])
+
+            await run_jobs(db, 'search_page', search, concurrency=max_pages_count, worker=worker, shard=shard)
+            # 第二步：获取详情
+            # 分片运行时由主进程在启动分片之前补
+            if shard is None:
+                await enqueue_detail_jobs(db)
+
+            async def detail(job: Job) -> None:
+                articles = await db.read(get_articles, ids=[job.payload['id']], validate=False)
+                if not len(articles):
+                    LOGGER.warning(f'文章 {job.payload["id"]} 不存在，跳过')
+                    return
+                _, done = await fetch_article_info(
+                    page_pool, db, articles[0], uploader_ttl,
+                    http=http if http_first else None,
+                )
+                if not done:
+                    # 让run_jobs按max_attempts重试，重试次数用完的下次运行时会重新放回pending
+                    raise RuntimeError(f'文章 {job.payload["id"]} 详情不完整，没有写入数据库')
+
+            while True:
+                # 分片运行时别的进程可能还在搜索，搜完会添加新的详情任务，
+                # 搜索失败放回pending、进程崩溃租约过期的搜索任务也要有人接着做
+                searching = 0
+                if shard is not None:
+                    counts = await db.read(count_jobs, 'search_page')
+                    searching = counts['pending'] + counts['running']
+                await run_jobs(
+                    db, 'article_detail', detail,
+                    concurrency=max_pages_count, worker=worker, shard=shard,
+                )
+                if not searching:
+                    break
+                await asyncio.sleep(SHARD_POLL_INTERVAL)
+                await run_jobs(db, 'search_page', search, concurrency=max_pages_count, worker=worker, shard=shard)
+            # 第三步：用剩下的页面预算更新旧文章的互动数据
+            # 每个进程挑出来的旧文章是同一批，只让一个分片做
+            if shard is None or shard[0] == 0:
+                await refresh_stale_articles(
+                    page_pool, db, playwright_config.get('refresh_budget', 0),
+                    min_interval=playwright_config.get('refresh_interval', 24 * 60 * 60),
+                    uploader_ttl=uploader_ttl,
+                    http=http if http_first else None,
+                )
+            LOGGER.info(f'搜索任务：{await db.read(count_jobs, "search_page")}')
+            LOGGER.info(f'详情任务：{await db.read(count_jobs, "article_detail")}')
+            LOGGER.info(blocker.summary())
+            LOGGER.info(http.summary())
+            LOGGER.info(page_pool.summary())
+    LOGGER.info(f'数据库调用统计：\n{dump_sql_stats()}')
+
+
+async def main():
+    loaded = load_config()
+    if loaded is None:
+        return
+    catg_keywords, config = loaded
+    await crawl(catg_keywords, config)
 
 
 if __name__ == '__main__':
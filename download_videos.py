@@ -1,12 +1,14 @@
 import asyncio
-from asyncio import Queue
 from pathlib import Path
+from logging import getLogger, basicConfig, INFO
 from aiohttp import ClientSession
 
 from playwright.async_api import async_playwright
 from playwright.async_api import Browser, Page
 
 from scrape.video import search_video, fetch_download_link, download_https_video
+from scrape.route import ResourceBlocker
+from scrape.pool import PagePool
 
 MAX_PAGES = 3
 AIO_HTTP_SEM = asyncio.Semaphore(3)
@@ -14,6 +16,11 @@ KEYWORD = '原神'
 PAGENUM = 0
 
 
+LOGGER = getLogger(__name__)
+LOGGER.setLevel('INFO')
+basicConfig(level=INFO)
+
+
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.110 Safari/537.36',
     'Referer': 'https://www.toutiao.com/',
@@ -24,21 +31,28 @@ HEADERS = {
 async def main():
     async with async_playwright() as p:
         browser: Browser = await p.chromium.launch(headless=False)
-        page_queue: Queue = Queue()
-        for _ in range(MAX_PAGES):
+        # 视频地址从video标签的src里取，不需要浏览器真的去加载视频、图片
+        blocker = ResourceBlocker()
+
+        async def new_page() -> Page:
             page: Page = await browser.new_page(
                 extra_http_headers=HEADERS
             )
-            await page_queue.put(page)
-        search_tasks = [
-            search_video(page_queue, KEYWORD, PAGENUM)
-        ]
-        results = await asyncio.gather(*search_tasks)
-        fetch_download_url_tasks = []
-        for result in results:
-            for url in result:
-                fetch_download_url_tasks.append(fetch_download_link(page_queue, url))
-        download_urls = await asyncio.gather(*fetch_download_url_tasks)
+            await blocker.apply(page)
+            return page
+
+        async with PagePool(new_page, MAX_PAGES) as page_pool:
+            search_tasks = [
+                search_video(page_pool, KEYWORD, PAGENUM)
+            ]
+            results = await asyncio.gather(*search_tasks)
+            fetch_download_url_tasks = []
+            for result in results:
+                for url in result:
+                    fetch_download_url_tasks.append(fetch_download_link(page_pool, url))
+            download_urls = await asyncio.gather(*fetch_download_url_tasks)
+            LOGGER.info(blocker.summary())
+            LOGGER.info(page_pool.summary())
         await browser.close()
     async with ClientSession() as session:
         https_download_tasks = [
@@ -1,17 +1,21 @@
 import asyncio
-from asyncio import Queue
 import random
+import time
 from logging import getLogger, basicConfig, INFO
 from urllib.parse import urlparse, parse_qs, unquote
 
-from playwright.async_api import Page
-from bs4 import BeautifulSoup
-from aiosqlite import Connection
-from markdownify import markdownify
-
-from utils import queue_elem
+from scrape.pool import PagePool, PRIORITY_CONTINUATION, PRIORITY_SEARCH
+from scrape.extract import extract_search_links, extract_article_detail, extract_uploader_stats
+from scrape.extract import ArticleDetail, SearchLink, extract_article_detail_html
+from scrape.fetcher import HttpFetcher
+from scrape import capture
+from scrape.capture import SearchRecord, capture_search, unwrap_jump, is_article_url
+from dao.database import Database
 from dao.article import Article
-from dao.article import insert_article, create_table_article, update_article
+from dao.article import insert_articles, create_table_article, update_article, update_articles
+from dao.article import get_articles, get_stale_articles
+from dao.uploader import UPLOADER_TTL
+from dao.uploader import get_uploader, save_uploader
 
 
 DOMAIN = 'www.toutiao.com'
@@ -20,10 +24,13 @@ LOGGER = getLogger(__name__)
 LOGGER.setLevel('INFO')
 basicConfig(level=INFO)
 
+# 正在打开主页的上传者，同一个上传者同时只打开一次主页，其他请求等待同一个结果
+_FANS_COUNT_TASKS: dict[str, asyncio.Task[int | None]] = {}
+
 
 async def search_articles(
-    page_queue: Queue[Page],
-    conn: Connection,
+    page_pool: PagePool,
+    db: Database,
     category: str,
     keyword: str,
     page_num: int
@@ -31,8 +38,8 @@ async def search_articles(
     '''
     在今日头条上搜索文章
 
-    :param page_queue: 页面队列
-    :param conn: 数据库连接
+    :param page_pool: 页面池
+    :param db: 数据库
     :param category: 分类
     :param keyword: 关键字
     :param page_num: 页码 (从0开始)
@@ -41,36 +48,72 @@ async def search_articles(
     '''
     if page_num < 0:
         return []
-    async with queue_elem(page_queue) as page:
+    url = (
+        f'https://{DOMAIN}/search'
+        '?source=search_subtab_switch'
+        f'&keyword={keyword}'
+        '&dvpf=pc'
+        '&enable_druid_v2=1'
+        '&pd=information'
+        '&action_type=search_subtab_switch'
+        f'&page_num={page_num}'
+        '&from=news'
+        '&cur_tab_title=news'
+    )
+    records: list[SearchRecord] = []
+    links: list[SearchLink] = []
+    async with page_pool.acquire(PRIORITY_SEARCH) as page:
         LOGGER.info(f'搜索 {category} 分类 {keyword} 第 {page_num+1} 页')
-        await page.goto((
-            f'https://{DOMAIN}/search'
-            '?source=search_subtab_switch'
-            f'&keyword={keyword}'
-            '&dvpf=pc'
-            '&enable_druid_v2=1'
-            '&pd=information'
-            '&action_type=search_subtab_switch'
-            f'&page_num={page_num}'
-            '&from=news'
-            '&cur_tab_title=news'
-        ), wait_until='networkidle', timeout=300000)
-        html_content = await page.content()
-        await asyncio.sleep(random.uniform(1.5, 3.5))
-        soup = BeautifulSoup(html_content, 'lxml')
-        a_tags = soup.select('a.text-underline-hover')
-        if len(a_tags) <= 2:
-            # TODO: 按理说不应该啊 我都用有头playwright了
-            LOGGER.warning(f'搜索 {category} 分类 {keyword} 第 {page_num+1} 页遇到反爬 请手动拖动滑块')
-            await page.pause()
-            html_content = await page.content()
-            soup = BeautifulSoup(html_content, 'lxml')
-            a_tags = soup.select('a.text-underline-hover')
+        if capture.SEARCH_MODE == 'response':
+            records = await capture_search(page, url)
+        if len(records):
+            await asyncio.sleep(random.uniform(1.5, 3.5))
+        else:
+            if capture.SEARCH_MODE == 'response':
+                # 页面已经打开了，等它渲染完从html提取
+                await page.wait_for_load_state('networkidle', timeout=300000)
+            else:
+                await page.goto(url, wait_until='networkidle', timeout=300000)
+            links = await extract_search_links(page)
+            await asyncio.sleep(random.uniform(1.5, 3.5))
+            if len(links) <= 2:
+                # TODO: 按理说不应该啊 我都用有头playwright了
+                LOGGER.warning(f'搜索 {category} 分类 {keyword} 第 {page_num+1} 页遇到反爬 请手动拖动滑块')
+                await page.pause()
+                links = await extract_search_links(page)
     # 把page让渡给别的协程
-    LOGGER.info(f'已获取 {category} 分类 {keyword} 第 {page_num+1} 页内容，共 {len(a_tags)} 条数据')
+    if len(records):
+        LOGGER.info(f'已截获 {category} 分类 {keyword} 第 {page_num+1} 页搜索接口数据，共 {len(records)} 条数据')
+        articles = _records2articles(records, category, keyword)
+    else:
+        LOGGER.info(f'已获取 {category} 分类 {keyword} 第 {page_num+1} 页内容，共 {len(links)} 条数据')
+        articles = _links2articles(links, category, keyword)
+
+    # 已经存在的文章，数据库里的发布时间、点赞数等是从详情页拿的，不能被搜索结果覆盖
+    existing: set[str] = set()
+    if len(articles):
+        existing = {article.id for article in await db.read(
+            get_articles, ids=[article.id for article in articles], columns=('id',), validate=False,
+        )}
+    # 一页的文章放在同一个事务里存入数据库，只commit一次
+    inserted, ignored = await db.write(insert_articles, articles)
+    # 搜索接口里带的发布时间、评论数等字段insert_articles不写，只给新插入的文章再更新一次
+    await db.write(update_articles, [
+        article for article in articles
+        if article.id not in existing and article.dirty_fields
+    ])
+    LOGGER.info(f'已全部存入数据库，新增 {inserted} 条，已存在 {ignored} 条')
+    return articles
+
+
+def _url2id(url: str) -> str:
+    return urlparse(url).path.strip('/')
+
+
+def _links2articles(links: list[SearchLink], category: str, keyword: str) -> list[Article]:
     articles = []
-    for i, a_tag in enumerate(a_tags):
-        href = str(a_tag.get('href', ''))
+    for i, link in enumerate(links):
+        href = link.href
         if not href.startswith(f'https://{DOMAIN}/'):
             if not href.startswith('/'):
                 href = f'/{href}'
@@ -88,110 +131,161 @@ async def search_articles(
             LOGGER.warning(f'文章 {i+1} 链接不完整：{url_inner}')
             continue
         url = unquote(url_inner[0])
-        id_ = urlparse(url).path.strip('/')
-        title = a_tag.get_text(strip=True)
+        if not is_article_url(url):
+            LOGGER.debug(f'跳过不是文章的链接：{url[:100]}')
+            continue
+        articles.append(Article(
+            id=_url2id(url),
+            title=link.title,
+            url=url,
+            category=category,
+            keyword=keyword,
+        ))
+    return articles
+
+
+def _records2articles(records: list[SearchRecord], category: str, keyword: str) -> list[Article]:
+    '''
+    搜索接口的结果转成文章，html里没有的字段赋值后是“改过”的状态，存库时用update_articles写入
+    '''
+    articles = []
+    for record in records:
+        url = unwrap_jump(record.url)
+        # 视频、用户主页、相关搜索等都不要
+        if url is None or not is_article_url(url):
+            LOGGER.debug(f'跳过不是文章的搜索结果：{record.url[:100]}')
+            continue
         article = Article(
-            id=id_,
-            title=title,
+            id=_url2id(url),
+            title=record.title,
             url=url,
             category=category,
             keyword=keyword,
         )
+        if not len(article.id):
+            continue
+        if record.publish_time is not None:
+            article.upload_time = time.strftime('%Y-%m-%d %H:%M', time.localtime(record.publish_time))
+        if record.comment_count is not None:
+            article.comment_count = record.comment_count
+        if record.like_count is not None:
+            article.like_count = record.like_count
         articles.append(article)
-
-    # TODO: 存入数据库
-    # 最好不要异步保存
-    # await create_table_article(conn)
-    for article in articles:
-        await insert_article(conn, article)
-    LOGGER.info(f'已全部存入数据库')
     return articles
 
 
+def _detail_complete(detail: ArticleDetail) -> bool:
+    '''
+    文章详情里是否有fetch_article_info后面每一步要用的字段：正文、发布时间、点赞评论收藏数、作者链接
+    '''
+    return (
+        detail.html is not None
+        and detail.meta is not None
+        and len(detail.meta.split('·')) >= 2
+        and detail.has_interaction
+        and detail.like is not None
+        and detail.comment is not None
+        and detail.collect is not None
+        and detail.user_href is not None
+    )
+
+
 async def fetch_article_info(
-    page_queue: Queue[Page],
-    conn: Connection,
-    article: Article
-) -> Article:
+    page_pool: PagePool,
+    db: Database,
+    article: Article,
+    uploader_ttl: float = UPLOADER_TTL,
+    refresh: bool = False,
+    http: HttpFetcher | None = None,
+) -> tuple[Article, bool]:
     '''
     获取搜索到的文章的详情，并更新数据库
 
     FIXME: 如果content是空的 就是遇到反爬了 需要修复
-    :param page_queue: 页面队列
-    :param conn: 数据库连接
+    :param page_pool: 页面池
+    :param db: 数据库
     :param article: 文章
-    :return: 填充后的文章
+    :param uploader_ttl: 上传者粉丝数缓存的有效期，单位为秒
+    :param refresh: 为True时已经获取过正文的文章也会重新打开，只更新点赞数等互动数据，不重写正文
+    :param http: 给了的话先不经过浏览器直接请求文章页，拿到的html不能用才用浏览器打开
+    :return: (填充后的文章, 是否处理完了)，写入了数据库或者不需要再处理（已经有正文、跳转到了视频）为True，
+        遇到反爬、数据不完整等没有写入数据库时为False，需要之后重试
     '''
-    if len(article.content):
+    has_content = article.content_length > 0 or len(article.content) > 0
+    if has_content and not refresh:
         LOGGER.info(f'文章 {article.id} 内容已获取，标题："{article.title[:20]}..." 跳过')
-        return article
+        return article, True
     url = article.url
     retry_times = 3
     LOGGER.info(f'获取文章 {article.id} 详情')
-    async with queue_elem(page_queue) as page:
-        await page.goto(url, wait_until='networkidle', timeout=3000000)
-        soup = None
-        article_soup = None
-        for i in range(retry_times):
-            if 'video' in page.url:
-                LOGGER.warning(f'该链接跳转到了一个视频，跳过')
-                return article
-            await page.wait_for_load_state('networkidle', timeout=3000000)
-            html_content = await page.content()
-            await asyncio.sleep(random.uniform(1.5, 3.5))
-            soup = BeautifulSoup(html_content, 'lxml')
-            # 第一步：获取文章内容并转为markdown
-            article_soup = soup.select_one('article.syl-article-base')
-            if article_soup is None:
+    detail = None
+    if http is not None:
+        fetched = await http.get_html(url)
+        if fetched is not None and 'video' in fetched[0]:
+            http.count(hit=True)
+            LOGGER.warning(f'该链接跳转到了一个视频，跳过')
+            return article, True
+        if fetched is not None:
+            detail = await extract_article_detail_html(fetched[1], with_markdown=not has_content)
+        # 直接请求拿到的页面可能只有正文，后面要用的字段都有才算能用，不然浏览器打开也许能拿全
+        usable = detail is not None and _detail_complete(detail)
+        http.count(hit=usable)
+        if not usable:
+            LOGGER.info(f'直接请求文章 {article.id} 没拿到能用的页面，用浏览器打开')
+            detail = None
+    if detail is None:
+        async with page_pool.acquire(affinity=article.id) as page:
+            await page.goto(url, wait_until='networkidle', timeout=3000000)
+            for i in range(retry_times):
+                if 'video' in page.url:
+                    LOGGER.warning(f'该链接跳转到了一个视频，跳过')
+                    return article, True
+                await page.wait_for_load_state('networkidle', timeout=3000000)
+                detail = await extract_article_detail(page, with_markdown=not has_content)
+                await asyncio.sleep(random.uniform(1.5, 3.5))
+                # 第一步：获取文章内容并转为markdown
+                if detail.html is not None:
+                    break
                 LOGGER.warning(f'文章 {article.id} 内容为空')
                 LOGGER.warning(f'尝试重新获取 {i+1} 次')
                 await page.reload()
-        if article_soup is None or soup is None:
-            return article
-    markdown_content = markdownify(str(article_soup))
-    article.content = markdown_content
+            if detail is None or detail.html is None:
+                return article, False
+    if detail.markdown is not None:
+        article.content = detail.markdown
     # 第二步：获取文章发布时间
-    article_meta_div = soup.select_one('div.article-meta')
-    if article_meta_div is None:
+    if detail.meta is None:
         LOGGER.warning(f'文章 {article.id} 元数据为空')
-        return article
-    article_meta = article_meta_div.get_text(strip=True).split('·')
+        return article, False
+    article_meta = detail.meta.split('·')
     if len(article_meta) < 2:
         LOGGER.warning(f'文章 {article.id} 元数据不完整')
-        return article
+        return article, False
     article.upload_time = article_meta[0].strip()
     # 第三步：获取详情（就左上角那个）
-    details = soup.select_one('div.detail-side-interaction')  # 这个是点赞数、评论数、分享数等
-    if details is None:
+    if not detail.has_interaction:  # 这个是点赞数、评论数、分享数等
         LOGGER.warning(f'文章 {article.id} 详情数据不完整')
-        return article
+        return article, False
     # 第四步：获取点赞数
-    like_span = details.select_one('div.detail-like span')
-    if like_span is None:
+    if detail.like is None:
         LOGGER.warning(f'文章 {article.id} 点赞数数据不完整')
-        return article
-    like_text = like_span.get_text(strip=True)
-    article.like_count = int(like_text) if like_text.isdigit() else 0
+        return article, False
+    article.like_count = int(detail.like) if detail.like.isdigit() else 0
     # 第五步：获取评论数
-    comment_span = details.select_one('div.detail-interaction-comment span')
-    if comment_span is None:
+    if detail.comment is None:
         LOGGER.warning(f'文章 {article.id} 评论数数据不完整')
-        return article
-    comment_text = comment_span.get_text(strip=True)
-    article.comment_count = int(comment_text) if comment_text.isdigit() else 0
+        return article, False
+    article.comment_count = int(detail.comment) if detail.comment.isdigit() else 0
     # 第六步：获取收藏数
-    collect_span = details.select_one('div.detail-interaction-collect span')
-    if collect_span is None:
+    if detail.collect is None:
         LOGGER.warning(f'文章 {article.id} 收藏数数据不完整')
-        return article
-    collect_text = collect_span.get_text(strip=True)
-    article.collect_count = int(collect_text) if collect_text.isdigit() else 0
+        return article, False
+    article.collect_count = int(detail.collect) if detail.collect.isdigit() else 0
     # 第七步：获取上传者信息
-    user_a = soup.select_one('a.user-name')
-    if user_a is None:
+    if detail.user_href is None:
         LOGGER.warning(f'文章 {article.id} 作者信息数据不完整')
-        return article
-    user_homepage = str(user_a.get('href', ''))
+        return article, False
+    user_homepage = detail.user_href
     if not user_homepage.startswith(f'https://{DOMAIN}/'):
         if not user_homepage.startswith('/'):
             user_homepage = f'/{user_homepage}'
@@ -200,42 +294,133 @@ async def fetch_article_info(
     split_path = [p for p in split_path if len(p)]
     if not len(split_path):
         LOGGER.warning(f'文章 {article.id} 作者主页数据不完整')
+        return article, False
     uploader = split_path[-1]
     article.uploader = uploader
-    LOGGER.info(f'已获取文章 {article.id} 详情，标题："{article.title[:20]}..." 即将打开作者主页')
-    # 第八步：打开上传者主页获取上传者粉丝数
-    async with queue_elem(page_queue) as page:
-        await page.goto(user_homepage, wait_until='networkidle', timeout=3000000)
-        html_content = await page.content()
-        await asyncio.sleep(random.uniform(1.5, 3.5))
-    user_soup = BeautifulSoup(html_content, 'lxml')
-    spans_num = user_soup.select('button.stat-item span.num')
-    if len(spans_num) < 2:
+    LOGGER.info(f'已获取文章 {article.id} 详情，标题："{article.title[:20]}..." 即将获取作者粉丝数')
+    # 第八步：获取上传者粉丝数，缓存里没有才打开上传者主页
+    # 作者主页是这篇文章的后续工作，优先拿页面
+    fans = await get_fans_count(page_pool, db, uploader, user_homepage, uploader_ttl, affinity=article.id)
+    if fans is None:
         LOGGER.warning(f'文章 {article.id} 作者粉丝数数据不完整')
-    span_num = spans_num[1]
-    if span_num is None:
-        LOGGER.warning(f'文章 {article.id} 作者粉丝数数据不完整')
-        return article
-    num = float(
-        span_num.get_text(strip=True)
-        .replace(',', '')
-        .replace('万', '')
-    )
-    span_unit = span_num.select_one('span.unit')
-    if span_unit is None:
-        unit = 1
-    else:
-        # 目前好像只有以万来算的，其他单位暂时不管
-        unit = {
-            '万': 10000,
-        }.get(span_unit.get_text(strip=True), 1)
-    fans = int(num * unit)
+        return article, False
     article.uploader_fans_count = fans
     # 第九步：更新数据库
-    await update_article(conn, article)
+    await db.write(update_article, article)
     LOGGER.info(f'文章 {article.id} 数据库详情已更新')
-    return article
+    return article, True
 
 
+async def refresh_stale_articles(
+    page_pool: PagePool,
+    db: Database,
+    budget: int,
+    *,
+    min_interval: float = 24 * 60 * 60,
+    uploader_ttl: float = UPLOADER_TTL,
+    http: HttpFetcher | None = None,
+) -> int:
+    '''
+    重新爬取最值得更新的文章的互动数据，每次更新都会在快照表里追加一条历史
+
+    按get_stale_articles的分数从高到低挑，最多打开budget篇文章
+    （上传者主页另算，一般会命中粉丝数缓存）
+
+    :param page_pool: 页面池
+    :param db: 数据库
+    :param budget: 最多重新打开多少篇文章
+    :param min_interval: 距离上次更新不到这么多秒的文章不重新爬取
+    :param uploader_ttl: 上传者粉丝数缓存的有效期，单位为秒
+    :param http: 见fetch_article_info
+    :return: 成功更新了互动数据的文章数，出错、遇到反爬等没写进数据库的不算
+    '''
+    if budget <= 0:
+        return 0
+    stale = await db.read(get_stale_articles, budget, min_interval=min_interval)
+    if not len(stale):
+        return 0
+    articles = {
+        article.id: article for article in
+        await db.read(get_articles, ids=[id_ for id_, _ in stale], validate=False)
+    }
+    LOGGER.info(f'重新爬取 {len(articles)} 篇文章的互动数据')
+    results = await asyncio.gather(*[
+        fetch_article_info(page_pool, db, articles[id_], uploader_ttl, refresh=True, http=http)
+        for id_, _ in stale if id_ in articles
+    ], return_exceptions=True)
+    refreshed = 0
+    for result in results:
+        if isinstance(result, BaseException):
+            LOGGER.warning(f'重新爬取文章失败：{result!r}')
+        elif result[1]:
+            refreshed += 1
+    LOGGER.info(f'已更新 {refreshed}/{len(results)} 篇文章的互动数据')
+    return refreshed
 
 
+async def get_fans_count(
+    page_pool: PagePool,
+    db: Database,
+    uploader: str,
+    user_homepage: str,
+    ttl: float = UPLOADER_TTL,
+    affinity: str | None = None,
+) -> int | None:
+    '''
+    获取上传者粉丝数
+
+    优先使用uploaders表里没过期的缓存，没有缓存才打开上传者主页，并把结果写回缓存
+    多篇文章同时请求同一个上传者时只会打开一次主页
+
+    :param page_pool: 页面池
+    :param db: 数据库
+    :param uploader: 上传者主页链接里的最后一段
+    :param user_homepage: 上传者主页链接
+    :param ttl: 缓存有效期，单位为秒
+    :param affinity: 打开主页时借页面用的affinity，一般是正在处理的文章id
+    :return: 粉丝数，获取失败返回None
+    '''
+    task = _FANS_COUNT_TASKS.get(uploader)
+    if task is None:
+        cached = await db.read(get_uploader, uploader, ttl)
+        if cached is not None:
+            LOGGER.info(f'上传者 {uploader} 粉丝数命中缓存：{cached.fans_count}')
+            return cached.fans_count
+        # 查缓存期间可能已经有别的请求开始打开主页了
+        task = _FANS_COUNT_TASKS.get(uploader)
+    if task is None:
+        task = asyncio.create_task(_refresh_fans_count(page_pool, db, uploader, user_homepage, affinity))
+        _FANS_COUNT_TASKS[uploader] = task
+        task.add_done_callback(lambda _: _FANS_COUNT_TASKS.pop(uploader, None))
+    else:
+        LOGGER.info(f'上传者 {uploader} 主页正在打开，等待结果')
+    # 一个等待者被取消不能影响其他等待者
+    return await asyncio.shield(task)
+
+
+async def _refresh_fans_count(
+    page_pool: PagePool,
+    db: Database,
+    uploader: str,
+    user_homepage: str,
+    affinity: str | None = None,
+) -> int | None:
+    LOGGER.info(f'打开上传者 {uploader} 主页')
+    async with page_pool.acquire(PRIORITY_CONTINUATION, affinity) as page:
+        await page.goto(user_homepage, wait_until='networkidle', timeout=3000000)
+        stats = await extract_uploader_stats(page)
+        await asyncio.sleep(random.uniform(1.5, 3.5))
+    if stats.fans is None:
+        return None
+    # 目前好像只有以万来算的，其他单位暂时不管
+    unit = {
+        '万': 10000,
+    }.get(stats.fans_unit or '', 1)
+    num = float(
+        stats.fans
+        .replace(',', '')
+        .replace('万', '')
+    )
+    fans = int(num * unit)
+    await db.write(save_uploader, uploader, fans)
+    return fans
@@ -0,0 +1,296 @@
+from typing import Any, Literal
+from dataclasses import dataclass
+from html import unescape
+from urllib.parse import urlparse, parse_qs, unquote
+from logging import getLogger
+import asyncio
+import re
+
+from playwright.async_api import Page, Response
+
+
+LOGGER = getLogger(__name__)
+
+
+'''
+从搜索页的网络响应里直接拿搜索结果
+
+搜索页的结果列表是前端用xhr请求搜索接口拿到json之后渲染出来的，
+与其等页面渲染完（networkidle）再从a.text-underline-hover里抠链接、手动拆/search/jump?url=跳转链接，
+不如在page.on('response')里把搜索接口的json截下来，
+json里还有html里没有的字段：发布时间戳、评论数、点赞数、播放量、视频时长等
+
+没截到搜索接口的响应（接口地址变了、被反爬拦了）时调用方退回到从html提取
+
+json里除了搜索结果还有相关搜索、广告、用户卡片等带链接和标题的对象，
+只有链接是头条文章（/article/数字 /a数字 /group/数字 /w/数字）或视频（/video/数字）的才算搜索结果
+'''
+
+
+SearchMode = Literal['response', 'html']
+# response: 截取搜索接口返回的json，截不到再从html提取 html: 等页面渲染完从html提取
+SEARCH_MODE: SearchMode = 'response'
+# 搜索接口的url（正则，匹配url的任意部分），接口地址改过好几次，可以在config.yaml里改
+SEARCH_RESPONSE_PATTERN = r'/api/search/'
+# 页面开始加载后最多等多久的搜索接口响应，单位为秒
+SEARCH_RESPONSE_TIMEOUT = 15
+
+
+def set_search_mode(mode: SearchMode, response_pattern: str | None = None) -> None:
+    global SEARCH_MODE, SEARCH_RESPONSE_PATTERN
+    if mode not in ('response', 'html'):
+        raise ValueError(f'unknown search mode: {mode!r}')
+    SEARCH_MODE = mode
+    if response_pattern is not None:
+        SEARCH_RESPONSE_PATTERN = response_pattern
+
+
+@dataclass
+class SearchRecord:
+    url: str
+    title: str
+    # 发布时间的时间戳，单位为秒
+    publish_time: int | None = None
+    comment_count: int | None = None
+    like_count: int | None = None
+    # 阅读量或播放量
+    view_count: int | None = None
+    # 视频时长，单位为秒
+    duration: int | None = None
+
+
+# 搜索接口的json里同一个含义的字段在不同版本、不同类型的结果里名字不一样，按顺序取第一个有的
+_URL_KEYS = ('article_url', 'share_url', 'display_url', 'source_url', 'url')
+_TIME_KEYS = ('publish_time', 'behot_time', 'create_time')
+_COMMENT_KEYS = ('comment_count',)
+_LIKE_KEYS = ('digg_count', 'like_count')
+_VIEW_KEYS = ('read_count', 'play_effective_count', 'video_watch_count', 'play_count')
+_DURATION_KEYS = ('video_duration', 'duration')
+
+# 头条文章的几种链接，微头条是/w/数字
+_RE_ARTICLE_PATH = re.compile(r'^/(?:article/\d+|a\d+|group/\d+|w/\d+)/?$')
+_RE_VIDEO_PATH = re.compile(r'^/video/\d+/?$')
+_TOUTIAO_HOSTS = frozenset({'www.toutiao.com', 'toutiao.com'})
+# 标题里高亮关键词的<em>标签
+_RE_TAG = re.compile(r'<[^>]+>')
+# 搜索结果最多嵌套这么多层，防止奇怪的json递归太深
+_MAX_DEPTH = 8
+
+
+def _get_int(item: dict, keys: tuple[str, ...]) -> int | None:
+    for key in keys:
+        value = item.get(key)
+        if isinstance(value, bool):
+            continue
+        if isinstance(value, int):
+            return value
+        if isinstance(value, float):
+            return int(value)
+        if isinstance(value, str) and value.isdigit():
+            return int(value)
+    return None
+
+
+def unwrap_jump(href: str) -> str | None:
+    '''
+    把/search/jump?url=...这样的跳转链接还原成文章链接，不是跳转链接的原样返回
+
+    :return: 文章链接，跳转链接里没有url参数时返回None
+    '''
+    parsed = urlparse(href)
+    if not parsed.path.endswith('/search/jump'):
+        return href
+    url_inner = parse_qs(parsed.query).get('url', [])
+    if not len(url_inner):
+        return None
+    return unquote(url_inner[0])
+
+
+def _match_url(url: str, pattern: re.Pattern[str]) -> bool:
+    parsed = urlparse(url)
+    return (
+        parsed.scheme in ('http', 'https')
+        and parsed.netloc in _TOUTIAO_HOSTS
+        and pattern.match(parsed.path) is not None
+    )
+
+
+def is_article_url(url: str) -> bool:
+    '''
+    是否是头条文章的链接（跳转链接要先用unwrap_jump还原）
+    '''
+    return _match_url(url, _RE_ARTICLE_PATH)
+
+
+def is_video_url(url: str) -> bool:
+    '''
+    是否是头条视频的链接（跳转链接要先用unwrap_jump还原）
+    '''
+    return _match_url(url, _RE_VIDEO_PATH)
+
+
+def _get_url(item: dict) -> str | None:
+    '''
+    :return: 还原了跳转链接之后的文章或视频链接，都不是的话返回None
+    '''
+    for key in _URL_KEYS:
+        value = item.get(key)
+        if not isinstance(value, str) or not len(value):
+            continue
+        # 相对路径
+        if value.startswith('/') and not value.startswith('//'):
+            value = f'https://www.toutiao.com{value}'
+        url = unwrap_jump(value)
+        if url is not None and (is_article_url(url) or is_video_url(url)):
+            return url
+    return None
+
+
+def _parse_item(item: dict) -> SearchRecord | None:
+    url = _get_url(item)
+    title = item.get('title')
+    if url is None or not isinstance(title, str) or not len(title):
+        return None
+    return SearchRecord(
+        url=url,
+        title=unescape(_RE_TAG.sub('', title)).strip(),
+        publish_time=_get_int(item, _TIME_KEYS),
+        comment_count=_get_int(item, _COMMENT_KEYS),
+        like_count=_get_int(item, _LIKE_KEYS),
+        view_count=_get_int(item, _VIEW_KEYS),
+        duration=_get_int(item, _DURATION_KEYS),
+    )
+
+
+def parse_search_json(payload: Any) -> list[SearchRecord]:
+    '''
+    从搜索接口返回的json里找出所有搜索结果
+
+    不依赖具体的层级结构：有标题和头条链接的对象都算一条搜索结果，
+    一条结果里面嵌套的对象（比如相关推荐）不再往下找
+
+    :param payload: 搜索接口返回的json
+    :return: 搜索结果，按出现顺序，同一个链接只保留第一条
+    '''
+    records: list[SearchRecord] = []
+    seen: set[str] = set()
+
+    def walk(node: Any, depth: int) -> None:
+        if depth > _MAX_DEPTH:
+            return
+        if isinstance(node, list):
+            for child in node:
+                walk(child, depth + 1)
+            return
+        if not isinstance(node, dict):
+            return
+        record = _parse_item(node)
+        if record is not None:
+            if record.url not in seen:
+                seen.add(record.url)
+                records.append(record)
+            return
+        for child in node.values():
+            walk(child, depth + 1)
+
+    walk(payload, 0)
+    return records
+
+
+class SearchCapture:
+    '''
+    在with块里监听页面的响应，收集搜索接口返回的json
+
+    Example:
+    ```python
+    async with SearchCapture(page) as capture:
+        await page.goto(url, wait_until='domcontentloaded')
+        if await capture.wait(SEARCH_RESPONSE_TIMEOUT):
+            records = await capture.records()
+    ```
+    '''
+    def __init__(self, page: Page, pattern: str | None = None) -> None:
+        '''
+        :param page: 页面
+        :param pattern: 搜索接口的url正则，默认为SEARCH_RESPONSE_PATTERN
+        '''
+        self.page = page
+        self.pattern = re.compile(pattern or SEARCH_RESPONSE_PATTERN)
+        self._tasks: list[asyncio.Task[Any]] = []
+        self._received = asyncio.Event()
+
+    async def __aenter__(self) -> 'SearchCapture':
+        self.page.on('response', self._on_response)
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        self.page.remove_listener('response', self._on_response)
+        # with块里没有调用records的话，没读完的响应也不用读了
+        for task in self._tasks:
+            task.cancel()
+
+    def _on_response(self, response: Response) -> None:
+        if response.request.resource_type not in ('xhr', 'fetch'):
+            return
+        if self.pattern.search(response.url) is None:
+            return
+        self._tasks.append(asyncio.create_task(self._read(response)))
+
+    async def _read(self, response: Response) -> Any:
+        try:
+            payload = await response.json()
+        except Exception as e:
+            LOGGER.debug(f'搜索接口的响应不是json：{response.url[:100]} {e!r}')
+            return None
+        self._received.set()
+        return payload
+
+    async def wait(self, timeout: float = SEARCH_RESPONSE_TIMEOUT) -> bool:
+        '''
+        等到截到第一个搜索接口的json为止
+
+        :param timeout: 最多等多久，单位为秒
+        :return: 是否截到了
+        '''
+        try:
+            await asyncio.wait_for(self._received.wait(), timeout)
+        except TimeoutError:
+            return False
+        return True
+
+    async def records(self) -> list[SearchRecord]:
+        '''
+        解析到目前为止截到的所有搜索接口json
+
+        :return: 搜索结果，同一个链接只保留第一条
+        '''
+        payloads = await asyncio.gather(*self._tasks, return_exceptions=True)
+        records: list[SearchRecord] = []
+        seen: set[str] = set()
+        for payload in payloads:
+            if payload is None or isinstance(payload, BaseException):
+                continue
+            for record in parse_search_json(payload):
+                if record.url not in seen:
+                    seen.add(record.url)
+                    records.append(record)
+        return records
+
+
+async def capture_search(page: Page, url: str, timeout: float = SEARCH_RESPONSE_TIMEOUT) -> list[SearchRecord]:
+    '''
+    打开搜索页，从搜索接口的响应里拿搜索结果，不等页面渲染完
+
+    返回空列表时页面停在搜索页上，调用方可以接着等页面渲染完再从html提取
+
+    :param page: 页面
+    :param url: 搜索页链接
+    :param timeout: 页面开始加载后最多等多久的搜索接口响应，单位为秒
+    :return: 搜索结果，没截到搜索接口的响应时为空列表
+    '''
+    async with SearchCapture(page) as capture:
+        await page.goto(url, wait_until='domcontentloaded', timeout=300000)
+        if not await capture.wait(timeout):
+            LOGGER.info(f'{timeout}秒内没有截到搜索接口的响应')
+            return []
+        return await capture.records()
@@ -0,0 +1,491 @@
+from typing import Callable, Literal
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from logging import getLogger
+import asyncio
+import os
+
+from playwright.async_api import Page
+from bs4 import BeautifulSoup
+from lxml import etree
+import lxml.html
+
+from scrape.markdown import html_to_markdown
+
+
+LOGGER = getLogger(__name__)
+
+
+'''
+页面数据提取
+
+每种页面一段js，用一次page.evaluate在页面里把需要的字段取出来，只把这些字段以json传回来，
+不用page.content()把整个DOM序列化后传过来，再用BeautifulSoup解析一遍
+
+每种页面还有一个parse_*_html函数，从html里提取同样的字段，
+和js的结果一一对应（js里的text()对应get_text(strip=True)），
+EXTRACT_MODE为'html'时用它们，也可以用来对照js提取的结果
+parse_*_html有bs4和lxml两个后端，结果一样（正文的html序列化方式略有不同，转成的markdown一样），
+两个后端和js的结果对照见tests/test_extract.py，计时：python -m benchmarks.extract
+
+解析html和把正文转成markdown都很吃cpu，如果用ParsePool开了进程池，
+这些工作会交给进程池做，不会卡住事件循环（和同时在跑的其他页面、数据库写协程）
+'''
+
+
+ExtractMode = Literal['evaluate', 'html']
+# evaluate: 在页面里用js提取 html: page.content()之后用parse_*_html提取
+EXTRACT_MODE: ExtractMode = 'evaluate'
+
+
+ParseBackend = Literal['bs4', 'lxml']
+# parse_*_html用的解析后端，lxml直接在lxml的树上执行预编译的xpath，比bs4的select快好几倍
+PARSE_BACKEND: ParseBackend = 'lxml'
+
+
+def set_extract_mode(mode: ExtractMode) -> None:
+    global EXTRACT_MODE
+    if mode not in ('evaluate', 'html'):
+        raise ValueError(f'unknown extract mode: {mode!r}')
+    EXTRACT_MODE = mode
+
+
+def set_parse_backend(backend: ParseBackend) -> None:
+    global PARSE_BACKEND
+    if backend not in ('bs4', 'lxml'):
+        raise ValueError(f'unknown parse backend: {backend!r}')
+    PARSE_BACKEND = backend
+
+
+@dataclass
+class SearchLink:
+    # a标签的href属性，没有处理过
+    href: str
+    title: str
+
+
+@dataclass
+class ArticleDetail:
+    # article.syl-article-base的html，None表示没找到正文（可能遇到反爬）
+    html: str | None = None
+    # div.article-meta的文字，形如“2024-01-01 12:00·作者”
+    meta: str | None = None
+    # 下面几个是数字的文字，None表示页面上没有这个元素
+    like: str | None = None
+    comment: str | None = None
+    collect: str | None = None
+    # div.detail-side-interaction是否存在，不存在的话上面三个都是None
+    has_interaction: bool = False
+    # a.user-name的href属性
+    user_href: str | None = None
+    # 正文转成的markdown，提取时传了with_markdown=False或者没找到正文则为None
+    markdown: str | None = None
+
+
+@dataclass
+class UploaderStats:
+    # 第二个button.stat-item span.num的文字（包括单位），None表示页面上没有
+    fans: str | None = None
+    # 单位，比如“万”，没有单位为None
+    fans_unit: str | None = None
+
+
+@dataclass
+class VideoDetail:
+    # #root video的src属性
+    src: str | None = None
+
+
+# 和BeautifulSoup的get_text(strip=True)一样：每个文字节点strip之后直接拼起来，不包括script、style
+_TEXT_JS = '''
+const text = (el) => {
+    if (!el) return null;
+    const parts = [];
+    const walker = document.createTreeWalker(el, NodeFilter.SHOW_TEXT);
+    while (walker.nextNode()) {
+        const parent = walker.currentNode.parentElement;
+        if (parent && ['SCRIPT', 'STYLE', 'TEMPLATE'].includes(parent.tagName)) continue;
+        const t = walker.currentNode.nodeValue.trim();
+        if (t) parts.push(t);
+    }
+    return parts.join('');
+};
+'''
+
+_SEARCH_JS = '''() => {
+%s
+return Array.from(document.querySelectorAll('a.text-underline-hover')).map(a => ({
+    href: a.getAttribute('href') ?? '',
+    title: text(a),
+}));
+}''' % _TEXT_JS
+
+_ARTICLE_JS = '''() => {
+%s
+const article = document.querySelector('article.syl-article-base');
+const details = document.querySelector('div.detail-side-interaction');
+const user = document.querySelector('a.user-name');
+return {
+    html: article ? article.outerHTML : null,
+    meta: text(document.querySelector('div.article-meta')),
+    like: details ? text(details.querySelector('div.detail-like span')) : null,
+    comment: details ? text(details.querySelector('div.detail-interaction-comment span')) : null,
+    collect: details ? text(details.querySelector('div.detail-interaction-collect span')) : null,
+    has_interaction: details !== null,
+    user_href: user ? (user.getAttribute('href') ?? '') : null,
+};
+}''' % _TEXT_JS
+
+_UPLOADER_JS = '''() => {
+%s
+const nums = document.querySelectorAll('button.stat-item span.num');
+if (nums.length < 2) return {fans: null, fans_unit: null};
+return {
+    fans: text(nums[1]),
+    fans_unit: text(nums[1].querySelector('span.unit')),
+};
+}''' % _TEXT_JS
+
+_VIDEO_JS = '''() => {
+const video = document.querySelector('#root video');
+return {src: video ? video.getAttribute('src') : null};
+}'''
+
+_LOGIN_JS = '''() => document.querySelector('div.user-icon') !== null'''
+
+
+# 下面是bs4后端，和原来直接用BeautifulSoup解析的逻辑完全一样
+
+
+def _bs4_search(html: str) -> list[SearchLink]:
+    soup = BeautifulSoup(html, 'lxml')
+    return [
+        SearchLink(href=str(a_tag.get('href', '')), title=a_tag.get_text(strip=True))
+        for a_tag in soup.select('a.text-underline-hover')
+    ]
+
+
+def _bs4_article(html: str) -> ArticleDetail:
+    soup = BeautifulSoup(html, 'lxml')
+    detail = ArticleDetail()
+    article_soup = soup.select_one('article.syl-article-base')
+    if article_soup is not None:
+        detail.html = str(article_soup)
+    meta = soup.select_one('div.article-meta')
+    if meta is not None:
+        detail.meta = meta.get_text(strip=True)
+    details = soup.select_one('div.detail-side-interaction')
+    if details is not None:
+        detail.has_interaction = True
+        for name, selector in (
+            ('like', 'div.detail-like span'),
+            ('comment', 'div.detail-interaction-comment span'),
+            ('collect', 'div.detail-interaction-collect span'),
+        ):
+            span = details.select_one(selector)
+            if span is not None:
+                setattr(detail, name, span.get_text(strip=True))
+    user_a = soup.select_one('a.user-name')
+    if user_a is not None:
+        detail.user_href = str(user_a.get('href', ''))
+    return detail
+
+
+def _bs4_uploader(html: str) -> UploaderStats:
+    soup = BeautifulSoup(html, 'lxml')
+    spans_num = soup.select('button.stat-item span.num')
+    if len(spans_num) < 2:
+        return UploaderStats()
+    span_unit = spans_num[1].select_one('span.unit')
+    return UploaderStats(
+        fans=spans_num[1].get_text(strip=True),
+        fans_unit=span_unit.get_text(strip=True) if span_unit is not None else None,
+    )
+
+
+def _bs4_video(html: str) -> VideoDetail:
+    soup = BeautifulSoup(html, 'lxml')
+    video_tag = soup.select_one('#root video')
+    if video_tag is None or not video_tag.has_attr('src'):
+        return VideoDetail()
+    src = video_tag['src']
+    return VideoDetail(src=src if isinstance(src, str) else None)
+
+
+def _bs4_login(html: str) -> bool:
+    soup = BeautifulSoup(html, 'lxml')
+    return soup.select_one('div.user-icon') is not None
+
+
+# 下面是lxml后端，css选择器都手写成了预编译的xpath
+
+
+def _cls(name: str) -> str:
+    '''
+    css里.name对应的xpath条件
+    '''
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+_X_SEARCH_LINKS = etree.XPath(f"//a[{_cls('text-underline-hover')}]")
+_X_ARTICLE = etree.XPath(f"//article[{_cls('syl-article-base')}]")
+_X_ARTICLE_META = etree.XPath(f"//div[{_cls('article-meta')}]")
+_X_INTERACTION = etree.XPath(f"//div[{_cls('detail-side-interaction')}]")
+_X_LIKE = etree.XPath(f".//div[{_cls('detail-like')}]//span")
+_X_COMMENT = etree.XPath(f".//div[{_cls('detail-interaction-comment')}]//span")
+_X_COLLECT = etree.XPath(f".//div[{_cls('detail-interaction-collect')}]//span")
+_X_USER_NAME = etree.XPath(f"//a[{_cls('user-name')}]")
+_X_FANS = etree.XPath(f"//button[{_cls('stat-item')}]//span[{_cls('num')}]")
+_X_UNIT = etree.XPath(f".//span[{_cls('unit')}]")
+_X_VIDEO = etree.XPath("//*[@id='root']//video")
+_X_USER_ICON = etree.XPath(f"//div[{_cls('user-icon')}]")
+# 和get_text(strip=True)一样，不要script、style里的文字，注释本来就不是text()
+_X_TEXT = etree.XPath(
+    'descendant-or-self::text()[not(ancestor::script or ancestor::style or ancestor::template)]'
+)
+
+
+def _lxml_tree(html: str) -> etree._Element | None:
+    if not html.strip():
+        return None
+    return lxml.html.document_fromstring(html)
+
+
+def _lxml_text(el: etree._Element) -> str:
+    return ''.join(t.strip() for t in _X_TEXT(el))
+
+
+def _first(xpath: etree.XPath, el: etree._Element) -> etree._Element | None:
+    found = xpath(el)
+    return found[0] if len(found) else None
+
+
+def _lxml_search(html: str) -> list[SearchLink]:
+    tree = _lxml_tree(html)
+    if tree is None:
+        return []
+    return [
+        SearchLink(href=a.get('href', ''), title=_lxml_text(a))
+        for a in _X_SEARCH_LINKS(tree)
+    ]
+
+
+def _lxml_article(html: str) -> ArticleDetail:
+    detail = ArticleDetail()
+    tree = _lxml_tree(html)
+    if tree is None:
+        return detail
+    article = _first(_X_ARTICLE, tree)
+    if article is not None:
+        detail.html = etree.tostring(article, encoding='unicode', method='html', with_tail=False)
+    meta = _first(_X_ARTICLE_META, tree)
+    if meta is not None:
+        detail.meta = _lxml_text(meta)
+    details = _first(_X_INTERACTION, tree)
+    if details is not None:
+        detail.has_interaction = True
+        for name, xpath in (
+            ('like', _X_LIKE),
+            ('comment', _X_COMMENT),
+            ('collect', _X_COLLECT),
+        ):
+            span = _first(xpath, details)
+            if span is not None:
+                setattr(detail, name, _lxml_text(span))
+    user_a = _first(_X_USER_NAME, tree)
+    if user_a is not None:
+        detail.user_href = user_a.get('href', '')
+    return detail
+
+
+def _lxml_uploader(html: str) -> UploaderStats:
+    tree = _lxml_tree(html)
+    if tree is None:
+        return UploaderStats()
+    spans_num = _X_FANS(tree)
+    if len(spans_num) < 2:
+        return UploaderStats()
+    span_unit = _first(_X_UNIT, spans_num[1])
+    return UploaderStats(
+        fans=_lxml_text(spans_num[1]),
+        fans_unit=_lxml_text(span_unit) if span_unit is not None else None,
+    )
+
+
+def _lxml_video(html: str) -> VideoDetail:
+    tree = _lxml_tree(html)
+    if tree is None:
+        return VideoDetail()
+    video = _first(_X_VIDEO, tree)
+    if video is None:
+        return VideoDetail()
+    return VideoDetail(src=video.get('src'))
+
+
+def _lxml_login(html: str) -> bool:
+    tree = _lxml_tree(html)
+    return tree is not None and _first(_X_USER_ICON, tree) is not None
+
+
+def parse_search_html(html: str, backend: ParseBackend | None = None) -> list[SearchLink]:
+    if (backend or PARSE_BACKEND) == 'bs4':
+        return _bs4_search(html)
+    return _lxml_search(html)
+
+
+def parse_article_html(
+    html: str,
+    with_markdown: bool = True,
+    backend: ParseBackend | None = None,
+) -> ArticleDetail:
+    if (backend or PARSE_BACKEND) == 'bs4':
+        detail = _bs4_article(html)
+    else:
+        detail = _lxml_article(html)
+    if with_markdown and detail.html is not None:
+        detail.markdown = html_to_markdown(detail.html)
+    return detail
+
+
+def parse_uploader_html(html: str, backend: ParseBackend | None = None) -> UploaderStats:
+    if (backend or PARSE_BACKEND) == 'bs4':
+        return _bs4_uploader(html)
+    return _lxml_uploader(html)
+
+
+def parse_video_html(html: str, backend: ParseBackend | None = None) -> VideoDetail:
+    if (backend or PARSE_BACKEND) == 'bs4':
+        return _bs4_video(html)
+    return _lxml_video(html)
+
+
+def parse_login_html(html: str, backend: ParseBackend | None = None) -> bool:
+    if (backend or PARSE_BACKEND) == 'bs4':
+        return _bs4_login(html)
+    return _lxml_login(html)
+
+
+class ParsePool:
+    '''
+    解析html用的进程池
+
+    with块（async with也可以）里所有的extract_*函数都会把解析html、转markdown的工作交给这个进程池，
+    with块外面（或者没有创建ParsePool时）直接在事件循环里解析
+
+    Example:
+    ```python
+    with ParsePool():
+        detail = await extract_article_detail(page)
+    ```
+    '''
+    def __init__(self, max_workers: int | None = None) -> None:
+        '''
+        :param max_workers: 进程数，默认为cpu核数
+        '''
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor: ProcessPoolExecutor | None = None
+
+    def __enter__(self) -> 'ParsePool':
+        global _PARSE_POOL
+        if _PARSE_POOL is not None:
+            raise RuntimeError('another ParsePool is already in use')
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        _PARSE_POOL = self
+        LOGGER.info(f'已启动 {self.max_workers} 个解析进程')
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        global _PARSE_POOL
+        _PARSE_POOL = None
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    async def __aenter__(self) -> 'ParsePool':
+        return self.__enter__()
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.__exit__(*exc_info)
+
+    async def run[*Ts, R](self, func: Callable[[*Ts], R], *args: *Ts) -> R:
+        '''
+        在进程池里执行func，func和参数、返回值都要能被pickle
+
+        :param func: 模块级的函数
+        :return: func的返回值
+        '''
+        if self._executor is None:
+            return func(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+
+_PARSE_POOL: ParsePool | None = None
+
+
+async def _parse[*Ts, R](func: Callable[[*Ts], R], *args: *Ts) -> R:
+    # 进程池里的子进程看不到父进程后来改的PARSE_BACKEND，所以调用方都把后端显式传进来
+    if _PARSE_POOL is None:
+        return func(*args)
+    return await _PARSE_POOL.run(func, *args)
+
+
+async def extract_search_links(page: Page) -> list[SearchLink]:
+    '''
+    提取搜索结果页（文章和视频都一样）里所有的结果链接
+    '''
+    if EXTRACT_MODE == 'html':
+        return await _parse(parse_search_html, await page.content(), PARSE_BACKEND)
+    return [SearchLink(**link) for link in await page.evaluate(_SEARCH_JS)]
+
+
+async def extract_article_detail(page: Page, with_markdown: bool = True) -> ArticleDetail:
+    '''
+    提取文章详情页的正文html、元数据、点赞数等和作者链接
+
+    :param page: 文章详情页
+    :param with_markdown: 是否同时把正文转成markdown
+    '''
+    if EXTRACT_MODE == 'html':
+        return await extract_article_detail_html(await page.content(), with_markdown)
+    detail = ArticleDetail(**await page.evaluate(_ARTICLE_JS))
+    if with_markdown and detail.html is not None:
+        detail.markdown = await _parse(html_to_markdown, detail.html)
+    return detail
+
+
+async def extract_article_detail_html(html: str, with_markdown: bool = True) -> ArticleDetail:
+    '''
+    从html里提取文章详情，用于不经过浏览器直接请求到的页面
+
+    :param html: 文章详情页的html
+    :param with_markdown: 是否同时把正文转成markdown
+    '''
+    return await _parse(parse_article_html, html, with_markdown, PARSE_BACKEND)
+
+
+async def extract_uploader_stats(page: Page) -> UploaderStats:
+    '''
+    提取上传者主页的粉丝数
+    '''
+    if EXTRACT_MODE == 'html':
+        return await _parse(parse_uploader_html, await page.content(), PARSE_BACKEND)
+    return UploaderStats(**await page.evaluate(_UPLOADER_JS))
+
+
+async def extract_video_detail(page: Page) -> VideoDetail:
+    '''
+    提取视频详情页的视频链接
+    '''
+    if EXTRACT_MODE == 'html':
+        return await _parse(parse_video_html, await page.content(), PARSE_BACKEND)
+    return VideoDetail(**await page.evaluate(_VIDEO_JS))
+
+
+async def extract_login(page: Page) -> bool:
+    '''
+    判断页面上是否已经登录
+    '''
+    if EXTRACT_MODE == 'html':
+        return await _parse(parse_login_html, await page.content(), PARSE_BACKEND)
+    return await page.evaluate(_LOGIN_JS)
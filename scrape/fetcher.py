@@ -0,0 +1,162 @@
+from http.cookies import CookieError, Morsel
+from logging import getLogger
+import time
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+from playwright.async_api import BrowserContext
+from yarl import URL
+
+
+LOGGER = getLogger(__name__)
+
+
+'''
+不经过浏览器直接请求页面
+
+文章详情页大部分是服务端渲染的，用aiohttp直接请求一次拿到的html里通常已经有正文，
+解析用和浏览器一样的提取函数，比打开一个Chromium页面等networkidle快得多，也不占页面池
+拿到的html不能用（被反爬拦了、正文是前端渲染的）时，调用方退回到浏览器
+
+session带着浏览器context的cookie和同样的请求头，每隔一段时间从context同步一次cookie
+'''
+
+
+# 整个session最多同时打开多少个连接
+HTTP_LIMIT = 8
+# 单个请求的超时时间，单位为秒
+HTTP_TIMEOUT = 15
+# 每隔多少秒从浏览器context同步一次cookie
+COOKIE_SYNC_INTERVAL = 60
+
+
+class HttpFetcher:
+    '''
+    共享一个aiohttp的连接池，带着浏览器的cookie请求页面，并统计直接请求的命中率
+
+    Example:
+    ```python
+    async with HttpFetcher(HEADERS) as http:
+        http.attach(context)
+        page = await http.get_html(url)
+        if page is not None and usable(page[1]):
+            http.count(hit=True)
+        else:
+            http.count(hit=False)
+            ...  # 用浏览器打开
+    ```
+    '''
+    def __init__(
+        self,
+        headers: dict[str, str] | None = None,
+        *,
+        limit: int = HTTP_LIMIT,
+        timeout: float = HTTP_TIMEOUT,
+    ) -> None:
+        '''
+        :param headers: 请求头，一般和浏览器context的extra_http_headers相同
+        :param limit: 最多同时打开多少个连接
+        :param timeout: 单个请求的超时时间，单位为秒
+        '''
+        self.headers = headers or {}
+        self.limit = limit
+        self.timeout = timeout
+        self._session: ClientSession | None = None
+        self._context: BrowserContext | None = None
+        self._cookies_synced_at = 0.0
+        # 拿到的html能用，不需要打开浏览器
+        self.hits = 0
+        # 拿到的html不能用或者请求失败，退回到浏览器
+        self.fallbacks = 0
+        # 其中请求失败（超时、连接错误、状态码不是200等）的次数
+        self.errors = 0
+
+    async def __aenter__(self) -> 'HttpFetcher':
+        self._session = ClientSession(
+            connector=TCPConnector(limit=self.limit),
+            timeout=ClientTimeout(total=self.timeout),
+            headers=self.headers,
+        )
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def attach(self, context: BrowserContext) -> None:
+        '''
+        之后的请求都带上这个浏览器context的cookie
+
+        :param context: 浏览器context
+        '''
+        self._context = context
+        self._cookies_synced_at = 0.0
+
+    async def _sync_cookies(self) -> None:
+        if self._context is None or self._session is None:
+            return
+        if time.monotonic() - self._cookies_synced_at < COOKIE_SYNC_INTERVAL:
+            return
+        self._cookies_synced_at = time.monotonic()
+        for cookie in await self._context.cookies():
+            domain = cookie.get('domain', '')
+            if not len(domain):
+                continue
+            morsel: Morsel[str] = Morsel()
+            try:
+                morsel.set(cookie['name'], cookie['value'], cookie['value'])
+            except CookieError:
+                # 浏览器能存名字里有http.cookies不认的字符的cookie，这种cookie只能跳过
+                LOGGER.debug(f'跳过名字不合法的cookie：{cookie["name"]!r}（{domain}）')
+                continue
+            morsel['domain'] = domain
+            morsel['path'] = cookie.get('path', '/')
+            self._session.cookie_jar.update_cookies(
+                {cookie['name']: morsel},
+                URL(f'https://{domain.lstrip(".")}/'),
+            )
+
+    async def get_html(self, url: str) -> tuple[str, str] | None:
+        '''
+        直接请求一个页面
+
+        请求失败会计入errors，但不计入hits和fallbacks，拿到的html能不能用由调用方判断后调用count
+
+        :param url: 页面链接
+        :return: (跳转后的链接, html)，请求失败、状态码不是200或者不是html时返回None
+        '''
+        if self._session is None:
+            raise RuntimeError('HttpFetcher is not opened, use "async with"')
+        await self._sync_cookies()
+        try:
+            async with self._session.get(url) as response:
+                content_type = response.headers.get('content-type', '')
+                if response.status != 200 or not content_type.startswith('text/html'):
+                    LOGGER.debug(f'直接请求 {url} 失败：{response.status} {content_type}')
+                    self.errors += 1
+                    return None
+                return str(response.url), await response.text()
+        except (ClientError, TimeoutError, UnicodeDecodeError) as e:
+            LOGGER.debug(f'直接请求 {url} 失败：{e!r}')
+            self.errors += 1
+            return None
+
+    def count(self, hit: bool) -> None:
+        '''
+        记一次直接请求的结果
+
+        :param hit: 直接请求拿到的html能用为True，退回到浏览器为False
+        '''
+        if hit:
+            self.hits += 1
+        else:
+            self.fallbacks += 1
+
+    def summary(self) -> str:
+        total = self.hits + self.fallbacks
+        if not total:
+            return '没有直接请求过页面'
+        return (
+            f'直接请求 {total} 个页面，命中 {self.hits} 个（{self.hits / total:.1%}），'
+            f'退回浏览器 {self.fallbacks} 个（{self.fallbacks / total:.1%}，其中请求失败 {self.errors} 个）'
+        )
@@ -0,0 +1,359 @@
+from typing import Callable
+from logging import getLogger
+import re
+
+from markdownify import markdownify
+from lxml import etree
+import lxml.html
+
+
+LOGGER = getLogger(__name__)
+
+
+'''
+文章正文html转markdown
+
+头条文章的正文（article.syl-article-base）只用到很少几种标签：p h1~h3 img strong blockquote ul/ol pre，
+这里直接在lxml的树上遍历一遍，按markdownify默认参数的规则转换这几种标签，
+输出和markdownify(html)逐字相同（空白的处理、转义、列表符号、标题下划线都一样），
+不用先建一棵BeautifulSoup的树，再对每个节点按标签名反射找转换函数
+
+遇到不认识的标签（表格、视频等）整篇交给markdownify，不会转出不一样的结果
+和markdownify的对照见tests/test_markdown.py（样例和markdownify的输出存在tests/fixtures/markdown里），
+计时：python -m benchmarks.markdown [保存下来的文章html ...]
+'''
+
+
+# markdownify里块级标签前后、里面开头结尾的空白会被去掉
+_BLOCK_TAGS = frozenset({
+    'p', 'blockquote', 'article', 'div', 'section', 'ol', 'ul', 'li',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+})
+# 块级标签外面的空白会被去掉，pre也是
+_OUTSIDE_TAGS = _BLOCK_TAGS | {'pre'}
+_HEADING_TAGS = frozenset({'h1', 'h2', 'h3', 'h4', 'h5', 'h6'})
+_NOFORMAT_TAGS = frozenset({'pre', 'code'})
+
+_RE_WHITESPACE = re.compile(r'[\t ]+')
+_RE_ALL_WHITESPACE = re.compile(r'[\t \r\n]+')
+_RE_NEWLINE_WHITESPACE = re.compile(r'[\t \r\n]*[\r\n][\t \r\n]*')
+_RE_LINE_WITH_CONTENT = re.compile(r'^(.*)', flags=re.MULTILINE)
+_RE_EXTRACT_NEWLINES = re.compile(r'^(\n*)((?:.*[^\n])?)(\n*)$', flags=re.DOTALL)
+_RE_PRE_LSTRIP = re.compile(r'^[ \n]*\n')
+_RE_PRE_RSTRIP = re.compile(r'[ \n]*$')
+_RE_BACKTICK_RUNS = re.compile(r'`+')
+
+# 列表的符号，按嵌套层数轮换
+_BULLETS = '*+-'
+
+
+class _Unsupported(Exception):
+    pass
+
+
+type _Node = str | etree._Element
+type _Converter = Callable[[etree._Element, str, frozenset[str]], str]
+
+
+def _children(el: etree._Element) -> list[_Node]:
+    '''
+    把lxml的text/tail展开成和BeautifulSoup一样的子节点列表：文本和元素（包括注释）交替
+    '''
+    nodes: list[_Node] = []
+    if el.text:
+        nodes.append(el.text)
+    for child in el:
+        nodes.append(child)
+        if child.tail:
+            nodes.append(child.tail)
+    return nodes
+
+
+def _is_outside(node: _Node | None) -> bool:
+    return node is not None and not isinstance(node, str) and node.tag in _OUTSIDE_TAGS
+
+
+def _convert_text(
+    text: str,
+    prev: _Node | None,
+    next_: _Node | None,
+    remove_inside: bool,
+    parent_tags: frozenset[str],
+) -> str:
+    if 'pre' not in parent_tags:
+        text = _RE_NEWLINE_WHITESPACE.sub('\n', text)
+        text = _RE_WHITESPACE.sub(' ', text)
+    if '_noformat' not in parent_tags:
+        text = text.replace('*', r'\*').replace('_', r'\_')
+    if _is_outside(prev) or (remove_inside and prev is None):
+        text = text.lstrip(' \t\r\n')
+    if _is_outside(next_) or (remove_inside and next_ is None):
+        text = text.rstrip()
+    return text
+
+
+def _join(strings: list[str]) -> str:
+    '''
+    拼接子节点转换的结果，相邻的换行合并，最多保留两个
+    '''
+    joined = ['']
+    for string in strings:
+        if string[0] != '\n' and string[-1] != '\n':
+            # 大部分是行内的文字，不用跑正则
+            joined.extend(('', string, ''))
+            continue
+        leading, content, trailing = _RE_EXTRACT_NEWLINES.match(string).groups()
+        if joined[-1] and leading:
+            prev_trailing = joined.pop()
+            leading = '\n' * min(2, max(len(prev_trailing), len(leading)))
+        joined.extend((leading, content, trailing))
+    return ''.join(joined)
+
+
+def _convert_children(nodes: list[_Node], tag: str, parent_tags: frozenset[str]) -> str:
+    remove_inside = tag in _BLOCK_TAGS
+    child_tags = parent_tags | {tag}
+    if tag in _HEADING_TAGS:
+        child_tags |= {'_inline'}
+    if tag in _NOFORMAT_TAGS:
+        child_tags |= {'_noformat'}
+    strings: list[str] = []
+    last = len(nodes) - 1
+    for i, node in enumerate(nodes):
+        prev = nodes[i - 1] if i > 0 else None
+        next_ = nodes[i + 1] if i < last else None
+        if isinstance(node, str):
+            # 只有空白的文本，在块级标签里开头结尾或者紧挨着块级标签的直接丢掉
+            if not node.strip() and (
+                (remove_inside and (prev is None or next_ is None))
+                or _is_outside(prev)
+                or _is_outside(next_)
+            ):
+                continue
+            string = _convert_text(node, prev, next_, remove_inside, child_tags)
+        elif node.tag is etree.Comment:
+            continue
+        else:
+            string = _convert_element(node, child_tags)
+        if string:
+            strings.append(string)
+    if tag == 'pre' or 'pre' in parent_tags:
+        return ''.join(strings)
+    return _join(strings)
+
+
+def _convert_element(el: etree._Element, parent_tags: frozenset[str]) -> str:
+    converter = _CONVERTERS.get(el.tag) if isinstance(el.tag, str) else None
+    if converter is None:
+        raise _Unsupported(el.tag)
+    text = _convert_children(_children(el), el.tag, parent_tags)
+    return converter(el, text, parent_tags)
+
+
+def _chomp(text: str) -> tuple[str, str, str]:
+    prefix = ' ' if text and text[0] == ' ' else ''
+    suffix = ' ' if text and text[-1] == ' ' else ''
+    return prefix, suffix, text.strip()
+
+
+def _inline(markup: str) -> _Converter:
+    def convert(el: etree._Element, text: str, parent_tags: frozenset[str]) -> str:
+        if '_noformat' in parent_tags:
+            return text
+        prefix, suffix, text = _chomp(text)
+        if not text:
+            return ''
+        return f'{prefix}{markup}{text}{markup}{suffix}'
+    return convert
+
+
+def _keep(el: etree._Element, text: str, parent_tags: frozenset[str]) -> str:
+    return text
+
+
+def _drop(el: etree._Element, text: str, parent_tags: frozenset[str]) -> str:
+    return ''
+
+
+def _convert_a(el: etree._Element, text: str, parent_tags: frozenset[str]) -> str:
+    if '_noformat' in parent_tags:
+        return text
+    prefix, suffix, text = _chomp(text)
+    if not text:
+        return ''
+    href = el.get('href')
+    title = el.get('title')
+    if text.replace(r'\_', '_') == href and not title:
+        return f'<{href}>'
+    title_part = ' "%s"' % title.replace('"', r'\"') if title else ''
+    return f'{prefix}[{text}]({href}{title_part}){suffix}' if href else text
+
+
+def _convert_blockquote(el: etree._Element, text: str, parent_tags: frozenset[str]) -> str:
+    text = text.strip(' \t\r\n')
+    if '_inline' in parent_tags:
+        return f' {text} '
+    if not text:
+        return '\n'
+    text = _RE_LINE_WITH_CONTENT.sub(lambda m: '> ' + m.group(1) if m.group(1) else '>', text)
+    return f'\n{text}\n\n'
+
+
+def _convert_br(el: etree._Element, text: str, parent_tags: frozenset[str]) -> str:
+    if '_inline' in parent_tags:
+        return text + ' ' if text else ' '
+    return '  \n' + text
+
+
+def _convert_code(el: etree._Element, text: str, parent_tags: frozenset[str]) -> str:
+    if '_noformat' in parent_tags:
+        return text
+    prefix, suffix, text = _chomp(text)
+    if not text:
+        return ''
+    max_backticks = max((len(run) for run in _RE_BACKTICK_RUNS.findall(text)), default=0)
+    delimiter = '`' * (max_backticks + 1)
+    if max_backticks > 0:
+        text = f' {text} '
+    return f'{prefix}{delimiter}{text}{delimiter}{suffix}'
+
+
+def _convert_div(el: etree._Element, text: str, parent_tags: frozenset[str]) -> str:
+    if '_inline' in parent_tags:
+        return f' {text.strip()} '
+    text = text.strip()
+    return f'\n\n{text}\n\n' if text else ''
+
+
+def _convert_figcaption(el: etree._Element, text: str, parent_tags: frozenset[str]) -> str:
+    return f'\n\n{text.strip()}\n\n'
+
+
+def _convert_heading(el: etree._Element, text: str, parent_tags: frozenset[str]) -> str:
+    if '_inline' in parent_tags:
+        return text
+    n = int(el.tag[1])
+    text = text.strip()
+    # markdownify默认h1 h2用下划线的写法
+    if n <= 2:
+        text = text.rstrip()
+        return f'\n\n{text}\n{("=" if n == 1 else "-") * len(text)}\n\n' if text else ''
+    text = _RE_ALL_WHITESPACE.sub(' ', text)
+    return f'\n\n{"#" * n} {text}\n\n'
+
+
+def _convert_hr(el: etree._Element, text: str, parent_tags: frozenset[str]) -> str:
+    return '\n\n---\n\n'
+
+
+def _convert_img(el: etree._Element, text: str, parent_tags: frozenset[str]) -> str:
+    alt = el.get('alt') or ''
+    src = el.get('src') or ''
+    title = el.get('title') or ''
+    title_part = ' "%s"' % title.replace('"', r'\"') if title else ''
+    if '_inline' in parent_tags:
+        return alt
+    return f'![{alt}]({src}{title_part})'
+
+
+def _next_content_sibling(el: etree._Element) -> _Node | None:
+    if el.tail and el.tail.strip():
+        return el.tail
+    for sibling in el.itersiblings():
+        if sibling.tag is not etree.Comment:
+            return sibling
+        if sibling.tail and sibling.tail.strip():
+            return sibling.tail
+    return None
+
+
+def _convert_list(el: etree._Element, text: str, parent_tags: frozenset[str]) -> str:
+    if 'li' in parent_tags:
+        return '\n' + text.rstrip()
+    next_ = _next_content_sibling(el)
+    before_paragraph = next_ is not None and (isinstance(next_, str) or next_.tag not in ('ul', 'ol'))
+    return '\n\n' + text + ('\n' if before_paragraph else '')
+
+
+def _convert_li(el: etree._Element, text: str, parent_tags: frozenset[str]) -> str:
+    text = text.strip()
+    if not text:
+        return '\n'
+    parent = el.getparent()
+    if parent is not None and parent.tag == 'ol':
+        start = parent.get('start')
+        start = int(start) if start and start.isnumeric() else 1
+        bullet = f'{start + sum(1 for _ in el.itersiblings("li", preceding=True))}.'
+    else:
+        depth = sum(1 for ancestor in el.iterancestors('ul'))
+        bullet = _BULLETS[(depth - 1) % len(_BULLETS)]
+    bullet += ' '
+    indent = ' ' * len(bullet)
+    text = _RE_LINE_WITH_CONTENT.sub(lambda m: indent + m.group(1) if m.group(1) else '', text)
+    return f'{bullet}{text[len(bullet):]}\n'
+
+
+def _convert_p(el: etree._Element, text: str, parent_tags: frozenset[str]) -> str:
+    text = text.strip(' \t\r\n')
+    if '_inline' in parent_tags:
+        return f' {text} '
+    return f'\n\n{text}\n\n' if text else ''
+
+
+def _convert_pre(el: etree._Element, text: str, parent_tags: frozenset[str]) -> str:
+    if not text:
+        return ''
+    text = _RE_PRE_RSTRIP.sub('', _RE_PRE_LSTRIP.sub('', text))
+    return f'\n\n```\n{text}\n```\n\n'
+
+
+_CONVERTERS: dict[str, _Converter] = {
+    'a': _convert_a,
+    'article': _convert_div,
+    'b': _inline('**'),
+    'blockquote': _convert_blockquote,
+    'br': _convert_br,
+    'code': _convert_code,
+    'div': _convert_div,
+    'em': _inline('*'),
+    'figcaption': _convert_figcaption,
+    'figure': _keep,
+    'h1': _convert_heading,
+    'h2': _convert_heading,
+    'h3': _convert_heading,
+    'h4': _convert_heading,
+    'h5': _convert_heading,
+    'h6': _convert_heading,
+    'hr': _convert_hr,
+    'i': _inline('*'),
+    'img': _convert_img,
+    'li': _convert_li,
+    'ol': _convert_list,
+    'p': _convert_p,
+    'pre': _convert_pre,
+    'script': _drop,
+    'section': _convert_div,
+    'span': _keep,
+    'strong': _inline('**'),
+    'style': _drop,
+    'ul': _convert_list,
+}
+
+
+def html_to_markdown(html: str) -> str:
+    '''
+    把正文的html转成markdown，结果和markdownify(html)相同
+
+    :param html: 正文的html，一般是article.syl-article-base整个元素
+    :return: markdown
+    '''
+    if not html.strip():
+        return markdownify(html)
+    root = lxml.html.fragment_fromstring(html, create_parent='div')
+    try:
+        # 包了一层div，把div里的节点当成整个文档的子节点
+        text = _convert_children(_children(root), '[document]', frozenset())
+    except _Unsupported as e:
+        LOGGER.debug(f'正文里有不支持的标签 {e.args[0]!r}，用markdownify转换')
+        return markdownify(html)
+    return text.strip('\n')
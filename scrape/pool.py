@@ -0,0 +1,313 @@
+from typing import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
+from asyncio import Future
+from dataclasses import dataclass
+from itertools import count
+from logging import getLogger
+import asyncio
+import time
+
+from playwright.async_api import Page
+
+
+LOGGER = getLogger(__name__)
+
+
+'''
+页面池
+
+- 不管with块里有没有抛异常，页面都会还回池里
+- 还回来的页面如果已经关闭、崩溃，或者在异常之后连about:blank都打不开了，就关掉换一个新的
+- 一个页面导航超过max_navigations次，或者页面的js堆超过max_heap_bytes，也关掉换一个新的，
+  长时间运行时渲染进程的内存不会一直涨
+- 记录等待时间（按优先级分开统计）、利用率、回收和替换的次数
+
+借页面时可以带优先级，有页面空出来时先给优先级高的等待者，同优先级先来先得，
+这样已经开始处理的条目的后续工作（比如文章的作者主页）不会排在几百个新的详情任务后面，
+中途中断时半截的行更少，第一条完整的行也更早出来
+还可以带一个affinity（比如文章id），空闲页面里优先给上次用同一个affinity的页面，
+同优先级的等待者里优先把页面给和上一个使用者affinity相同的
+'''
+
+
+# 已经开始处理的条目的后续工作，比如打开文章作者的主页
+PRIORITY_CONTINUATION = 20
+# 搜索页，给后面的流水线提供数据
+PRIORITY_SEARCH = 10
+PRIORITY_DEFAULT = 0
+
+
+# 一个页面最多导航多少次就回收
+MAX_NAVIGATIONS = 200
+# 异常之后检查页面是否还能用时，打开about:blank的超时时间，单位为毫秒
+HEALTH_CHECK_TIMEOUT = 5000
+# 新建页面失败时最多重试几次
+CREATE_RETRIES = 3
+
+_HEAP_JS = '''() => performance.memory ? performance.memory.usedJSHeapSize : 0'''
+
+
+@dataclass
+class _Waiter:
+    priority: int
+    seq: int
+    affinity: str | None
+    future: Future[Page]
+
+
+class PagePool:
+    '''
+    Example:
+    ```python
+    async def new_page() -> Page:
+        page = await context.new_page()
+        await Stealth().apply_stealth_async(page)
+        return page
+
+    async with PagePool(new_page, 3) as page_pool:
+        async with page_pool.acquire() as page:
+            await page.goto(url)
+        async with page_pool.acquire(PRIORITY_CONTINUATION, affinity=article_id) as page:
+            await page.goto(user_homepage)
+        LOGGER.info(page_pool.summary())
+    ```
+    '''
+    def __init__(
+        self,
+        factory: Callable[[], Awaitable[Page]],
+        size: int,
+        *,
+        max_navigations: int | None = MAX_NAVIGATIONS,
+        max_heap_bytes: int | None = None,
+    ) -> None:
+        '''
+        :param factory: 新建一个页面的协程函数，新建的页面要已经设置好（stealth、拦截请求等）
+        :param size: 页面数
+        :param max_navigations: 一个页面最多导航多少次就回收，None表示不按导航次数回收
+        :param max_heap_bytes: 页面的js堆（performance.memory.usedJSHeapSize）超过多少字节就回收，
+            None表示不检查，Playwright拿不到单个渲染进程的RSS，用js堆近似
+        '''
+        if size < 1:
+            raise ValueError('size must be at least 1')
+        self.factory = factory
+        self.size = size
+        self.max_navigations = max_navigations
+        self.max_heap_bytes = max_heap_bytes
+        self._idle: list[Page] = []
+        self._waiters: list[_Waiter] = []
+        self._seq = count()
+        # 每个页面上一次被借出时的affinity
+        self._affinity: dict[Page, str | None] = {}
+        self._navigations: dict[Page, int] = {}
+        self._crashed: set[Page] = set()
+        # 还在后台检查的页面，保留引用防止任务被回收
+        self._releasing: set[asyncio.Task[None]] = set()
+        self._closed = False
+        self._started_at = time.monotonic()
+        # 统计
+        self.acquires = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        # {优先级: [借出次数, 总等待时间]}
+        self.wait_by_priority: dict[int, list[float]] = {}
+        self.busy_seconds = 0.0
+        # 导航次数或者内存超限被回收的页面数
+        self.recycled = 0
+        # 关闭、崩溃或者异常后不能用被替换的页面数
+        self.replaced = 0
+
+    async def __aenter__(self) -> 'PagePool':
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def start(self) -> None:
+        pages = await asyncio.gather(*[self._new_page() for _ in range(self.size)])
+        self._idle.extend(pages)
+        self._started_at = time.monotonic()
+
+    async def close(self) -> None:
+        self._closed = True
+        for waiter in self._waiters:
+            waiter.future.cancel()
+        self._waiters.clear()
+        if len(self._releasing):
+            await asyncio.gather(*self._releasing, return_exceptions=True)
+        for page in list(self._navigations):
+            await self._close_page(page)
+
+    async def _new_page(self) -> Page:
+        for i in range(CREATE_RETRIES):
+            try:
+                page = await self.factory()
+            except Exception as e:
+                LOGGER.warning(f'新建页面失败（第 {i+1} 次）：{e!r}')
+                continue
+            self._navigations[page] = 0
+            page.on('framenavigated', lambda frame, page=page: self._on_navigated(page, frame))
+            page.on('crash', lambda _, page=page: self._crashed.add(page))
+            return page
+        raise RuntimeError(f'failed to create a page after {CREATE_RETRIES} attempts')
+
+    def _on_navigated(self, page: Page, frame) -> None:
+        if frame == page.main_frame and page in self._navigations:
+            self._navigations[page] += 1
+
+    async def _close_page(self, page: Page) -> None:
+        self._navigations.pop(page, None)
+        self._affinity.pop(page, None)
+        self._crashed.discard(page)
+        try:
+            await page.close()
+        except Exception as e:
+            LOGGER.debug(f'关闭页面失败：{e!r}')
+
+    @asynccontextmanager
+    async def acquire(
+        self,
+        priority: int = PRIORITY_DEFAULT,
+        affinity: str | None = None,
+    ) -> AsyncIterator[Page]:
+        '''
+        从池里借一个页面，with块结束时（包括抛异常）一定会还回去
+
+        :param priority: 优先级，越大越先拿到页面，见PRIORITY_*
+        :param affinity: 比如文章id，优先拿到上次用同一个affinity的页面
+        '''
+        if self._closed:
+            raise RuntimeError('PagePool is closed')
+        start = time.monotonic()
+        page = await self._get(priority, affinity)
+        self._affinity[page] = affinity
+        acquired_at = time.monotonic()
+        wait = acquired_at - start
+        self.acquires += 1
+        self.wait_seconds += wait
+        self.max_wait_seconds = max(self.max_wait_seconds, wait)
+        stats = self.wait_by_priority.setdefault(priority, [0, 0.0])
+        stats[0] += 1
+        stats[1] += wait
+        failed = False
+        try:
+            yield page
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self.busy_seconds += time.monotonic() - acquired_at
+            # 被取消时也要还回去，检查和替换放到后台，不拖着调用方
+            task = asyncio.create_task(self._release(page, failed))
+            self._releasing.add(task)
+            task.add_done_callback(self._releasing.discard)
+
+    async def _get(self, priority: int, affinity: str | None) -> Page:
+        # 有人在等的话，空出来的页面已经直接交给等待者了，这里有空闲页面说明没人在等
+        if len(self._idle):
+            for i, page in enumerate(self._idle):
+                if affinity is not None and self._affinity.get(page) == affinity:
+                    return self._idle.pop(i)
+            return self._idle.pop()
+        waiter = _Waiter(priority, next(self._seq), affinity, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        try:
+            return await waiter.future
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif waiter.future.done() and not waiter.future.cancelled():
+                # 页面刚交过来就被取消了，还回去
+                self._put(waiter.future.result())
+            raise
+
+    def _put(self, page: Page) -> None:
+        '''
+        把检查过的页面交给优先级最高的等待者，没人在等就放回空闲列表
+        '''
+        self._waiters = [waiter for waiter in self._waiters if not waiter.future.done()]
+        if not len(self._waiters):
+            self._idle.append(page)
+            return
+        last_affinity = self._affinity.get(page)
+        waiter = min(self._waiters, key=lambda w: (
+            -w.priority,
+            w.affinity is None or w.affinity != last_affinity,
+            w.seq,
+        ))
+        self._waiters.remove(waiter)
+        waiter.future.set_result(page)
+
+    async def _release(self, page: Page, failed: bool) -> None:
+        try:
+            page = await self._checked(page, failed)
+        except Exception as e:
+            # 连新页面都建不出来了，池子少一个页面
+            LOGGER.error(f'替换页面失败，页面池缩小到 {self.size - 1} 个：{e!r}')
+            self.size -= 1
+            if self.size <= 0:
+                # 再也不会有页面空出来了，不能让等待者一直等下去
+                for waiter in self._waiters:
+                    if not waiter.future.done():
+                        waiter.future.set_exception(RuntimeError('PagePool has no pages left'))
+                self._waiters.clear()
+            return
+        if self._closed:
+            await self._close_page(page)
+            return
+        self._put(page)
+
+    async def _checked(self, page: Page, failed: bool) -> Page:
+        '''
+        检查还回来的页面，不能用或者该回收了就换一个新的
+        '''
+        if page.is_closed() or page in self._crashed:
+            LOGGER.warning('页面已关闭或崩溃，换一个新的')
+            self.replaced += 1
+            await self._close_page(page)
+            return await self._new_page()
+        if failed:
+            # 比如goto超时之后页面可能还卡在那里，打开about:blank看看还能不能用
+            try:
+                await page.goto('about:blank', timeout=HEALTH_CHECK_TIMEOUT)
+            except Exception as e:
+                LOGGER.warning(f'页面出错后不能用了，换一个新的：{e!r}')
+                self.replaced += 1
+                await self._close_page(page)
+                return await self._new_page()
+        if self.max_navigations is not None and self._navigations.get(page, 0) >= self.max_navigations:
+            LOGGER.info(f'页面已导航 {self._navigations[page]} 次，回收')
+            self.recycled += 1
+            await self._close_page(page)
+            return await self._new_page()
+        if self.max_heap_bytes is not None:
+            try:
+                heap = await page.evaluate(_HEAP_JS)
+            except Exception:
+                heap = 0
+            if heap > self.max_heap_bytes:
+                LOGGER.info(f'页面js堆 {heap / 1024 / 1024:.1f}MiB 超过上限，回收')
+                self.recycled += 1
+                await self._close_page(page)
+                return await self._new_page()
+        return page
+
+    @property
+    def utilization(self) -> float:
+        '''
+        从启动到现在，页面被借出的时间占总页面时间的比例
+        '''
+        elapsed = (time.monotonic() - self._started_at) * self.size
+        return self.busy_seconds / elapsed if elapsed > 0 else 0.0
+
+    def summary(self) -> str:
+        avg_wait = self.wait_seconds / self.acquires if self.acquires else 0.0
+        by_priority = '，'.join(
+            f'优先级{priority} {int(n)}次/平均{total / n:.2f}s'
+            for priority, (n, total) in sorted(self.wait_by_priority.items(), reverse=True)
+        )
+        return (
+            f'页面池：{self.size} 个页面，借出 {self.acquires} 次，'
+            f'平均等待 {avg_wait:.2f}s（{by_priority}），最长等待 {self.max_wait_seconds:.2f}s，'
+            f'利用率 {self.utilization:.1%}，回收 {self.recycled} 个，替换 {self.replaced} 个'
+        )
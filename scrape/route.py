@@ -0,0 +1,110 @@
+from typing import Iterable
+from collections import Counter
+from logging import getLogger
+import re
+
+from playwright.async_api import BrowserContext, Page, Request, Response, Route
+
+
+LOGGER = getLogger(__name__)
+
+
+'''
+拦截提取数据用不到的请求
+
+文章页、搜索页会加载大量图片、字体、视频封面、广告和统计脚本，
+wait_until='networkidle'要等它们全部加载完才返回，
+提取数据只用到DOM（img的src属性在DOM里，不需要真的把图片下载下来），这些请求直接abort掉
+
+建页面池的时候应用到BrowserContext（或者单个Page）上：
+```python
+blocker = ResourceBlocker(**playwright_config.get('block', {}))
+await blocker.apply(context)
+...
+LOGGER.info(blocker.summary())
+```
+'''
+
+
+# 默认拦截的资源类型，见playwright的Request.resource_type
+BLOCK_RESOURCE_TYPES = ('image', 'media', 'font')
+# 默认拦截的url（正则，匹配url的任意部分），主要是统计、监控和广告
+BLOCK_URL_PATTERNS = (
+    r'mcs\.snssdk\.com',
+    r'mon\.zijieapi\.com',
+    r'log\.snssdk\.com',
+    r'pglstatp-toutiao\.com',
+    r'hm\.baidu\.com',
+    r'google-analytics\.com',
+    r'googletagmanager\.com',
+)
+
+
+class ResourceBlocker:
+    '''
+    用route拦截请求，同时统计拦截和放行的请求数
+
+    被拦截的请求根本没有发出去，不知道它有多大，
+    所以字节数只统计放行的响应（按Content-Length，分块传输的响应没有这个头，不计入）
+    '''
+    def __init__(
+        self,
+        resource_types: Iterable[str] = BLOCK_RESOURCE_TYPES,
+        url_patterns: Iterable[str] = BLOCK_URL_PATTERNS,
+    ) -> None:
+        '''
+        :param resource_types: 要拦截的资源类型，比如image media font stylesheet
+        :param url_patterns: 要拦截的url的正则，匹配url的任意部分即拦截
+        '''
+        self.resource_types = frozenset(resource_types)
+        patterns = list(url_patterns)
+        # 合成一个正则，每个请求只匹配一次
+        self.url_pattern = re.compile('|'.join(f'(?:{p})' for p in patterns)) if len(patterns) else None
+        # 按资源类型统计拦截的请求数
+        self.blocked: Counter[str] = Counter()
+        self.allowed_requests = 0
+        self.loaded_bytes = 0
+
+    @property
+    def blocked_requests(self) -> int:
+        return self.blocked.total()
+
+    async def apply(self, target: Page | BrowserContext) -> None:
+        '''
+        应用到BrowserContext（之后新建的页面都会生效）或者单个Page上
+
+        :param target: BrowserContext或Page
+        '''
+        await target.route('**/*', self._handle)
+        target.on('response', self._on_response)
+
+    def should_block(self, request: Request) -> bool:
+        # 主框架的页面本身永远放行
+        if request.is_navigation_request() and request.frame.parent_frame is None:
+            return False
+        if request.resource_type in self.resource_types:
+            return True
+        return self.url_pattern is not None and self.url_pattern.search(request.url) is not None
+
+    async def _handle(self, route: Route) -> None:
+        request = route.request
+        if self.should_block(request):
+            self.blocked[request.resource_type] += 1
+            await route.abort('blockedbyclient')
+            return
+        self.allowed_requests += 1
+        await route.fallback()
+
+    def _on_response(self, response: Response) -> None:
+        content_length = response.headers.get('content-length')
+        if content_length is not None and content_length.isdigit():
+            self.loaded_bytes += int(content_length)
+
+    def summary(self) -> str:
+        total = self.blocked_requests + self.allowed_requests
+        ratio = self.blocked_requests / total if total else 0
+        by_type = ', '.join(f'{type_}: {count}' for type_, count in self.blocked.most_common())
+        return (
+            f'拦截 {self.blocked_requests}/{total} 个请求（{ratio:.1%}）[{by_type}]，'
+            f'放行的响应共 {self.loaded_bytes / 1024 / 1024:.2f} MiB'
+        )
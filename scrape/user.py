@@ -1,4 +1,5 @@
 import asyncio
+import hashlib
 from typing import AsyncGenerator
 from asyncio import Lock, Semaphore
 from pathlib import Path
@@ -13,9 +14,11 @@ from playwright_stealth.stealth import Stealth
 from aiosqlite import Connection
 from rapidfuzz import fuzz
 
+from dao.database import Database
 from dao.user import User
 from dao.user import update_cookies, insert_user
 from dao.article import Article
+from dao.publication import start_publication, finish_publication, fail_publication
 from utils import is_login
 from llm_utils import llm_rewrite_content, llm_rewrite_title, llm_rewrite_article
 
@@ -226,7 +229,24 @@ async def validate_cookies(page: Page, user: User, conn: Connection) -> User:
     return user
 
 
-async def upload_video(page: Page, user: User, video: Path) -> bool:
+def video_id(video: Path) -> str:
+    '''
+    视频文件对应的视频id，记发布记录用
+
+    下载下来的视频文件名格式为f'{id}--{md5}.mp4'，取id部分，其他格式的文件名整个当作id
+    '''
+    return video.stem.split('--')[0]
+
+
+def _file_md5(path: Path) -> str:
+    md5 = hashlib.md5()
+    with path.open('rb') as f:
+        while len(chunk := f.read(1024 * 1024)):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+async def upload_video(page: Page, user: User, video: Path, db: Database | None = None) -> bool:
     '''
     上传视频到今日头条
 
@@ -236,11 +256,33 @@ async def upload_video(page: Page, user: User, video: Path) -> bool:
 
     TODO: 目前是使用Path对象上传，后面等我给视频做了数据表和BaseModel之后，就用Video对象当video参数类型
 
+    传了db的话会在publications表里记录这次发布，id见video_id，内容的hash按视频文件的md5算，见dao.publication
+
     :param page: playwright Page对象
     :param user: User对象
     :param video: 视频文件路径 (暂时是Path对象，后面改成Video对象)
+    :param db: 数据库
     :return: 上传成功返回True，否则返回False
     '''
+    id_ = video_id(video)
+    if db is not None:
+        await db.write(start_publication, id_, user.phone, 'video')
+    try:
+        uploaded = await _upload_video(page, user, video)
+    except Exception as e:
+        if db is not None:
+            await db.write(fail_publication, id_, user.phone, 'video', repr(e))
+        raise
+    if db is not None:
+        if uploaded:
+            md5 = await asyncio.to_thread(_file_md5, video)
+            await db.write(finish_publication, id_, user.phone, 'video', md5)
+        else:
+            await db.write(fail_publication, id_, user.phone, 'video', '未实名认证或上传失败')
+    return uploaded
+
+
+async def _upload_video(page: Page, user: User, video: Path) -> bool:
     await page.goto(
         # 注意域名不是www.toutiao.com
         'https://mp.toutiao.com/profile_v4/xigua/upload-video?from=toutiao_pc',
@@ -411,6 +453,7 @@ async def upload_微头条(
     semaphore: Semaphore,
     rewrite: bool = True,
     extra_headers: dict | None = None,
+    db: Database | None = None,
 ) -> bool:
     '''
     FIXME: 如果屏幕不够大，就会有个巨恶心的发文助手挡住发布按钮
@@ -419,70 +462,99 @@ async def upload_微头条(
 
     但是“微头条”如果翻译成"micro-blog"或者用拼音"weitoutiao"，
     都可能会让人不知所云。所以我在这里使用了中文
+
+    传了db的话会在publications表里记录这次发布，见dao.publication
     '''
-    
     async with (
         semaphore,
     ):
-        FUZZ_THRESH = 50.0
-        if rewrite:
-            origin_content = article.content
-            fuzz_ratio = 100.0
-            max_rewrite_times = 2
-            rewrite_success = False
-            for i in range(max_rewrite_times):
-                article = await llm_rewrite_article(
-                    article,
-                    rewrite_title=False,
-                )
-                fuzz_ratio = fuzz.ratio(article.content, origin_content)
-                LOGGER.info(f'用户"{user.phone}"的文章"{article.title}"洗稿后的重复度为{fuzz_ratio:.3f}%')
-                if fuzz_ratio < FUZZ_THRESH:
-                    rewrite_success = True
-                    break
-                else:
-                    LOGGER.info(f'用户"{user.phone}"的文章"{article.title}"重复度过高，正在重试')
-            if not rewrite_success:
-                LOGGER.warning(f'用户"{user.phone}"的文章"{article.title}"洗稿失败，重复度过高')
-                return False
-            LOGGER.info(f'用户"{user.phone}"洗稿成功')
-        async with user_page(
-            user,
-            browser,
-            extra_headers=extra_headers,
-        ) as page:
-            LOGGER.info(f'用户"{user.phone}"正在上传微头条文章')
-            LOGGER.info(f'原文章链接：{article.url}')
-            LOGGER.info(f'原文章标题：{article.title}')
-            
-            await page.goto(
-                f'{DOMAIN_MP}profile_v4/weitoutiao/publish?from=toutiao_pc',
-                wait_until='domcontentloaded',
-            )
-
-            content = article.content
-            content = content.replace('```', '```\n\n\n')
-            content = re.sub(r'!\[.*?\]\(.*?\)', '', content)
-            content = re.sub(r'\[.*?\]\(.*?\)', '', content)
-            editot_region = page.locator('div.ProseMirror')
-            await editot_region.wait_for(state='visible')
-            await editot_region.type(
-                content[:2000],
-                timeout=2000*30,
-            )
-            await asyncio.sleep(uniform(0.5, 2.5))
-            await page.wait_for_load_state('networkidle')
-            retry_count = 3
-            i = 0
-            for i in range(retry_count):
-                await page.click('button.publish-content')
-                await asyncio.sleep(uniform(3.5, 5.5))
-                if 'publish' not in page.url:
-                    LOGGER.info(f'用户"{user.phone}"的微头条文章"{article.title}"发布成功')
-                    break
-                else:
-                    LOGGER.warning(f'用户"{user.phone}"的微头条文章"{article.title}"发布失败，正在重试')
-            if i == retry_count - 1:
-                LOGGER.error(f'用户"{user.phone}"的微头条文章"{article.title}"发布失败，重试{retry_count}次后仍失败')
+        if db is not None:
+            await db.write(start_publication, article.id, user.phone, 'weitoutiao')
+        try:
+            content = await _publish_微头条(browser, user, article, rewrite, extra_headers)
+        except Exception as e:
+            if db is not None:
+                await db.write(fail_publication, article.id, user.phone, 'weitoutiao', repr(e))
+            raise
+        if db is not None:
+            if content is None:
+                await db.write(fail_publication, article.id, user.phone, 'weitoutiao', '洗稿或发布失败')
+            else:
+                await db.write(finish_publication, article.id, user.phone, 'weitoutiao', content)
+        if content is None:
+            return False
         await asyncio.sleep(uniform(3*60, 5*60))  # 等待3-5分钟
     return True
+
+
+async def _publish_微头条(
+    browser: Browser,
+    user: User,
+    article: Article,
+    rewrite: bool,
+    extra_headers: dict | None,
+) -> str | None:
+    '''
+    洗稿并发布一篇微头条
+
+    :return: 发布出去的正文，洗稿或发布失败返回None
+    '''
+    FUZZ_THRESH = 50.0
+    if rewrite:
+        origin_content = article.content
+        fuzz_ratio = 100.0
+        max_rewrite_times = 2
+        rewrite_success = False
+        for i in range(max_rewrite_times):
+            article = await llm_rewrite_article(
+                article,
+                rewrite_title=False,
+            )
+            fuzz_ratio = fuzz.ratio(article.content, origin_content)
+            LOGGER.info(f'用户"{user.phone}"的文章"{article.title}"洗稿后的重复度为{fuzz_ratio:.3f}%')
+            if fuzz_ratio < FUZZ_THRESH:
+                rewrite_success = True
+                break
+            else:
+                LOGGER.info(f'用户"{user.phone}"的文章"{article.title}"重复度过高，正在重试')
+        if not rewrite_success:
+            LOGGER.warning(f'用户"{user.phone}"的文章"{article.title}"洗稿失败，重复度过高')
+            return None
+        LOGGER.info(f'用户"{user.phone}"洗稿成功')
+    async with user_page(
+        user,
+        browser,
+        extra_headers=extra_headers,
+    ) as page:
+        LOGGER.info(f'用户"{user.phone}"正在上传微头条文章')
+        LOGGER.info(f'原文章链接：{article.url}')
+        LOGGER.info(f'原文章标题：{article.title}')
+
+        await page.goto(
+            f'{DOMAIN_MP}profile_v4/weitoutiao/publish?from=toutiao_pc',
+            wait_until='domcontentloaded',
+        )
+
+        content = article.content
+        content = content.replace('```', '```\n\n\n')
+        content = re.sub(r'!\[.*?\]\(.*?\)', '', content)
+        content = re.sub(r'\[.*?\]\(.*?\)', '', content)
+        content = content[:2000]
+        editot_region = page.locator('div.ProseMirror')
+        await editot_region.wait_for(state='visible')
+        await editot_region.type(
+            content,
+            timeout=2000*30,
+        )
+        await asyncio.sleep(uniform(0.5, 2.5))
+        await page.wait_for_load_state('networkidle')
+        retry_count = 3
+        for i in range(retry_count):
+            await page.click('button.publish-content')
+            await asyncio.sleep(uniform(3.5, 5.5))
+            if 'publish' not in page.url:
+                LOGGER.info(f'用户"{user.phone}"的微头条文章"{article.title}"发布成功')
+                return content
+            LOGGER.warning(f'用户"{user.phone}"的微头条文章"{article.title}"发布失败，正在重试')
+        LOGGER.error(f'用户"{user.phone}"的微头条文章"{article.title}"发布失败，重试{retry_count}次后仍失败')
+    return None
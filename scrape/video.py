@@ -1,16 +1,19 @@
 import asyncio
-from asyncio import Queue, Semaphore
-from urllib.parse import unquote
+from asyncio import Semaphore
+from urllib.parse import urlparse
 from pathlib import Path
 from logging import getLogger, basicConfig, INFO
 import time
 
-from playwright.async_api import Page
-from bs4 import BeautifulSoup, Tag
 from aiohttp import ClientSession
 import aiofiles
 
-from utils import queue_elem
+from scrape.pool import PagePool, PRIORITY_SEARCH
+from scrape.extract import extract_search_links, extract_video_detail
+from scrape.extract import SearchLink
+from scrape import capture
+from scrape.capture import SearchRecord, capture_search, unwrap_jump, is_video_url
+from dao.video import Video
 
 
 MAX_PAGES = 3
@@ -24,83 +27,137 @@ LOGGER.setLevel('INFO')
 basicConfig(level=INFO)
 
 
-def _a_tag2url(a_tag: Tag) -> str:
-    if not a_tag.has_attr('href'):
-        return ''
-    href = a_tag['href']
-    if not isinstance(href, str):
+def _href2url(href: str) -> str:
+    '''
+    把搜索结果的链接（可能是相对路径、/search/jump?url=跳转链接）还原成视频链接
+
+    :return: 视频链接，不是视频（文章、相关搜索、广告等）时返回空字符串
+    '''
+    if not len(href):
         return ''
-    href = href.split('/search/jump?url=')[-1]
-    href = unquote(href)
-    if not href.startswith('http'):
+    if href.startswith('/') and not href.startswith('//'):
+        href = f'{DOMAIN}{href}'
+    url = unwrap_jump(href)
+    if url is None or not is_video_url(url):
+        LOGGER.debug(f'跳过不是视频的搜索结果：{href[:100]}')
         return ''
-    return href
+    return url
 
 
-async def search_video(page_queue: Queue[Page], keyword: str, page_num: int) -> list[str]:
+async def search_video(page_pool: PagePool, keyword: str, page_num: int) -> list[str]:
     '''
     根据给定的keyword和page_num搜索今日头条，返回搜索结果的url列表
     FIXME: 直接访问可能会遇到反爬，这里改成从DOMAIN自动搜索，模拟人类操作
 
-    :param page_queue: 页面队列
+    :param page_pool: 页面池
     :param keyword: 搜索关键词
     :param page_num: 页码(从0开始)
     :return: 搜索结果的url列表
     '''
+    return [video.url for video in await search_video_records(page_pool, keyword, page_num)]
+
+
+async def search_video_records(
+    page_pool: PagePool,
+    keyword: str,
+    page_num: int,
+    category: str = '',
+) -> list[Video]:
+    '''
+    根据给定的keyword和page_num搜索今日头条上的视频
+
+    能截到搜索接口的响应时，视频会带上发布时间、播放量、时长、点赞数、评论数，
+    否则从页面html提取，只有id title url
+
+    :param page_pool: 页面池
+    :param keyword: 搜索关键词
+    :param page_num: 页码(从0开始)
+    :param category: 视频的分类
+    :return: 搜索到的视频
+    '''
     if page_num < 0:
         return []
     LOGGER.info(f'Searching keyword: "{keyword}", page_num: {page_num}')
     url = f'{DOMAIN}/search?dvpf=pc&keyword={keyword}&pd=video&page_num={page_num}'
-    async with queue_elem(page_queue) as page:
-        await page.goto(url, wait_until='domcontentloaded', timeout=WAIT_TIME)
-        await asyncio.sleep(3)
-        # 昨天还没遇到反爬，今天这里弹出滑块验证码了
-        # await page.pause()
-        # 怎么又没有了？？？
-        locator = page.locator('a.text-underline-hover').filter(visible=True).first
-        await locator.wait_for(timeout=WAIT_TIME)
-        html_content = await page.content()
-    LOGGER.info(f'Got all html content, parsing...')
-    soup = BeautifulSoup(html_content, 'lxml')
-    a_tags = soup.select('a.text-underline-hover')
-    urls: list[str] = [
-        _a_tag2url(a_tag)
-        for a_tag in a_tags
+    records: list[SearchRecord] = []
+    links: list[SearchLink] = []
+    async with page_pool.acquire(PRIORITY_SEARCH) as page:
+        if capture.SEARCH_MODE == 'response':
+            records = await capture_search(page, url)
+        if not len(records):
+            if capture.SEARCH_MODE == 'html':
+                await page.goto(url, wait_until='domcontentloaded', timeout=WAIT_TIME)
+            await asyncio.sleep(3)
+            # 昨天还没遇到反爬，今天这里弹出滑块验证码了
+            # await page.pause()
+            # 怎么又没有了？？？
+            locator = page.locator('a.text-underline-hover').filter(visible=True).first
+            await locator.wait_for(timeout=WAIT_TIME)
+            links = await extract_search_links(page)
+    if len(records):
+        LOGGER.info(f'Captured {len(records)} results from the search api')
+        videos = _records2videos(records, category, keyword)
+    else:
+        videos = _links2videos(links, category, keyword)
+    LOGGER.info(f'Found {len(videos)} urls')
+    return videos
+
+
+def _url2id(url: str) -> str:
+    return urlparse(url).path.strip('/')
+
+
+def _links2videos(links: list[SearchLink], category: str, keyword: str) -> list[Video]:
+    return [
+        Video(id=_url2id(video_url), title=link.title, url=video_url, category=category, keyword=keyword)
+        for link in links
+        if len(video_url := _href2url(link.href))
     ]
-    urls = [
-        url
-        for url in urls
-        if len(url)
+
+
+def _records2videos(records: list[SearchRecord], category: str, keyword: str) -> list[Video]:
+    '''
+    搜索接口的结果转成视频，搜索接口的json里混着的文章、相关搜索、广告等都不要
+    '''
+    return [
+        _record2video(record, video_url, category, keyword)
+        for record in records
+        if len(video_url := _href2url(record.url))
     ]
-    LOGGER.info(f'Found {len(urls)} urls')
-    return urls
 
 
-async def fetch_download_link(page_queue: Queue[Page], url: str) -> str:
+def _record2video(record: SearchRecord, url: str, category: str, keyword: str) -> Video:
+    video = Video(id=_url2id(url), title=record.title, url=url, category=category, keyword=keyword)
+    if record.publish_time is not None:
+        video.upload_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record.publish_time))
+    if record.view_count is not None:
+        video.view_count = record.view_count
+    if record.duration is not None:
+        video.video_length = record.duration
+    if record.like_count is not None:
+        video.like_count = record.like_count
+    if record.comment_count is not None:
+        video.comment_count = record.comment_count
+    return video
+
+
+async def fetch_download_link(page_pool: PagePool, url: str) -> str:
     '''
     从给定的视频url中获取视频下载链接
 
-    :param page_queue: 页面队列
+    :param page_pool: 页面池
     :param url: 视频url
     :return: 视频下载链接，如果没有找到则返回空字符串
     '''
     LOGGER.info(f'Fetching download link for url: {url[:100]}... ')
-    async with queue_elem(page_queue) as page:
+    async with page_pool.acquire() as page:
         await page.goto(url, wait_until='domcontentloaded', timeout=WAIT_TIME)
         await asyncio.sleep(3)
         locator = page.locator('#root')
         await locator.wait_for()
-        html_content = await page.content()
-    LOGGER.info(f'Got all html content, parsing...')
-    soup = BeautifulSoup(html_content, 'lxml')
-    video_tag = soup.select_one('#root video')
-    if video_tag is None:
-        LOGGER.warning(f'No video tag found for url: {url}')
-        return ''
-    if not video_tag.has_attr('src'):
-        return ''
-    src = video_tag['src']
-    if not isinstance(src, str):
+        src = (await extract_video_detail(page)).src
+    if src is None:
+        LOGGER.warning(f'No video src found for url: {url}')
         return ''
     if src.startswith('//'):
         return f'https:{src}'
@@ -0,0 +1,139 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from logging import getLogger, basicConfig, INFO
+
+from dao.database import Database
+from dao.job import count_jobs, count_jobs_by_worker
+from download_articles import load_config, create_tables, enqueue_search_jobs, enqueue_detail_jobs, crawl
+
+
+LOGGER = getLogger(__name__)
+LOGGER.setLevel('INFO')
+basicConfig(level=INFO)
+
+
+'''
+多进程运行download_articles
+
+一个事件循环驱动一个Chromium，解析html和Playwright的IPC都挤在一个核上，
+这里启动N个进程，每个进程有自己的浏览器、页面池和事件循环，
+进程之间不直接通信，只通过同一个data.db的任务表协调：
+- 主进程建表、添加搜索任务和补详情任务，然后启动分片进程，自己只定时统计进度
+- 每个分片进程先领取job_id % N == 分片序号的任务，领完了再领别的分片剩下的，
+  领取是原子的，同一个任务不会被两个进程领到
+- 分片进程崩溃的话它手上任务的租约过期后会被别的分片重新领取
+
+进度和吞吐量从任务表里统计，按分片（任务表的worker字段）分开，
+分片之间的吞吐量差不多、总吞吐量随分片数线性增长，说明瓶颈不在共享的数据库上
+'''
+
+
+# 默认每隔多少秒打印一次进度
+PROGRESS_INTERVAL = 30
+
+
+def run_shard(index: int, shards: int) -> None:
+    '''
+    分片进程的入口
+
+    :param index: 分片序号
+    :param shards: 分片数
+    '''
+    # 各个进程的日志混在一起，带上分片序号
+    basicConfig(level=INFO, format=f'[shard{index}] %(levelname)s:%(name)s:%(message)s', force=True)
+    loaded = load_config()
+    if loaded is None:
+        return
+    catg_keywords, config = loaded
+    asyncio.run(crawl(catg_keywords, config, shard=(index, shards)))
+
+
+class ShardProgress:
+    '''
+    从任务表统计各个分片的进度和吞吐量
+    '''
+    def __init__(self, db: Database, shards: int) -> None:
+        '''
+        :param db: 数据库
+        :param shards: 分片数
+        '''
+        self.db = db
+        self.shards = shards
+        self.started_at = time.time()
+        self._last_at = self.started_at
+        self._last_done: dict[str, int] = {}
+
+    async def report(self) -> str:
+        '''
+        :return: 一行总进度，每个分片一行：完成的任务数、平均吞吐量、最近一段时间的吞吐量
+        '''
+        now = time.time()
+        search = await self.db.read(count_jobs, 'search_page')
+        detail = await self.db.read(count_jobs, 'article_detail')
+        by_worker = await self.db.read(count_jobs_by_worker, self.started_at)
+        elapsed = max(now - self.started_at, 1e-9)
+        interval = max(now - self._last_at, 1e-9)
+        lines: list[str] = []
+        rates: list[float] = []
+        for index in range(self.shards):
+            name = f'shard{index}'
+            counts = by_worker.get(name, {})
+            done = sum(counts.values())
+            recent = done - self._last_done.get(name, 0)
+            self._last_done[name] = done
+            rates.append(done / elapsed * 60)
+            lines.append(
+                f'  {name}：搜索 {counts.get("search_page", 0)} 个，详情 {counts.get("article_detail", 0)} 个，'
+                f'平均 {done / elapsed * 60:.1f} 个/分钟，最近 {recent / interval * 60:.1f} 个/分钟'
+            )
+        self._last_at = now
+        total = sum(self._last_done.values())
+        balance = min(rates) / max(rates) if max(rates) > 0 else 0
+        head = (
+            f'进度：搜索 {search["done"]}/{sum(search.values())}（失败 {search["failed"]}），'
+            f'详情 {detail["done"]}/{sum(detail.values())}（失败 {detail["failed"]}），'
+            f'{self.shards} 个分片共完成 {total} 个任务，{total / elapsed * 60:.1f} 个/分钟，'
+            f'最慢分片/最快分片 {balance:.0%}'
+        )
+        return '\n'.join([head, *lines])
+
+
+async def main():
+    loaded = load_config()
+    if loaded is None:
+        return
+    catg_keywords, config = loaded
+    playwright_config = config.get('playwright', {})
+    sqlite_config = config.get('sqlite', {})
+    shard_config = config.get('shard', {})
+    shards = shard_config.get('shards') or os.cpu_count() or 1
+    interval = shard_config.get('progress_interval', PROGRESS_INTERVAL)
+    async with Database('data.db', **sqlite_config) as db:
+        # 建表、添加搜索任务、给以前没做完的文章补详情任务只在主进程做一次
+        await create_tables(db)
+        await enqueue_search_jobs(db, catg_keywords, playwright_config['max_pages_idx'])
+        await enqueue_detail_jobs(db)
+        # Playwright的驱动和事件循环都不能fork，用spawn启动分片进程
+        ctx = multiprocessing.get_context('spawn')
+        processes = [
+            ctx.Process(target=run_shard, args=(index, shards), name=f'shard{index}')
+            for index in range(shards)
+        ]
+        progress = ShardProgress(db, shards)
+        for process in processes:
+            process.start()
+        LOGGER.info(f'已启动 {shards} 个分片进程')
+        while any(process.is_alive() for process in processes):
+            await asyncio.sleep(interval)
+            LOGGER.info(await progress.report())
+        for process in processes:
+            process.join()
+            if process.exitcode != 0:
+                LOGGER.error(f'{process.name} 异常退出，退出码 {process.exitcode}，它没做完的任务租约过期后会被重新领取')
+        LOGGER.info(await progress.report())
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
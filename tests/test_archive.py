@@ -0,0 +1,34 @@
+import asyncio
+
+import aiosqlite
+
+from dao.article import Article, create_table_article, insert_articles, count_articles
+from dao.maintenance import attach_archive, archive_articles
+from dao.publication import create_table_publications, start_publication, finish_publication, get_published_ids
+
+
+def test_archive_published_in_batches(tmp_path):
+    async def run():
+        async with aiosqlite.connect(tmp_path / 'data.db') as conn:
+            await attach_archive(conn, str(tmp_path / 'archive.db'))
+            await create_table_article(conn)
+            await create_table_publications(conn)
+            await insert_articles(conn, [
+                Article(id=f'{i:02d}', title='标题', url='https://www.toutiao.com/', category='科技', keyword='手机')
+                for i in range(20)
+            ])
+            for i in range(5):
+                await start_publication(conn, f'{i:02d}', '13800000000', 'article')
+                await finish_publication(conn, f'{i:02d}', '13800000000', 'article', '正文')
+            # 正在发布（没成功）的不算
+            await start_publication(conn, '10', '13800000000', 'weitoutiao')
+            published = await get_published_ids(conn, ('weitoutiao', 'article'))
+            assert sorted(published) == ['00', '01', '02', '03', '04']
+            # 每次最多搬2篇，循环到返回0为止
+            moved = []
+            while n := await archive_articles(conn, ids=published, limit=2):
+                moved.append(n)
+            assert moved == [2, 2, 1]
+            assert await count_articles(conn) == 15
+            assert await count_articles(conn, archived=True) == 5
+    asyncio.run(run())
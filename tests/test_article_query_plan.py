@@ -0,0 +1,74 @@
+import asyncio
+
+import aiosqlite
+
+from dao.article import create_table_article, get_articles, count_articles, get_upload_candidates
+from dao.publication import create_table_publications
+
+
+'''
+常用查询的EXPLAIN QUERY PLAN，保证它们都走索引，不会扫全表
+
+用trace回调截下dao层函数真正执行的sql，再对它做EXPLAIN QUERY PLAN
+'''
+
+
+async def _plan(call) -> list[str]:
+    '''
+    :param call: 接收数据库连接的协程函数，只执行一条SELECT
+    :return: 查询计划每一步的描述
+    '''
+    async with aiosqlite.connect(':memory:') as conn:
+        await create_table_article(conn)
+        await create_table_publications(conn)
+        statements: list[str] = []
+        await conn.set_trace_callback(statements.append)
+        await call(conn)
+        await conn.set_trace_callback(None)
+        selects = [sql for sql in statements if sql.lstrip().upper().startswith('SELECT')]
+        assert len(selects) == 1, statements
+        cur = await conn.execute(f'EXPLAIN QUERY PLAN {selects[0]}')
+        return [row[3] for row in await cur.fetchall()]
+
+
+def plan(call) -> list[str]:
+    return asyncio.run(_plan(call))
+
+
+def assert_no_scan(steps: list[str]) -> None:
+    for step in steps:
+        assert not step.startswith('SCAN'), steps
+
+
+def test_category_keyword_exists():
+    steps = plan(lambda conn: count_articles(conn, '科技', '手机'))
+    assert_no_scan(steps)
+    assert steps == ['SEARCH articles USING COVERING INDEX idx_articles_category_keyword (category=? AND keyword=?)']
+
+
+def test_keyword_filter():
+    steps = plan(lambda conn: get_articles(conn, keyword='手机', columns=('id',)))
+    assert_no_scan(steps)
+    assert steps == ['SEARCH articles USING INDEX idx_articles_keyword (keyword=?)']
+
+
+def test_ids_filter():
+    steps = plan(lambda conn: get_articles(conn, ids=['1', '2', '3'], validate=False))
+    assert_no_scan(steps)
+    assert len(steps) == 1
+    assert steps[0].startswith('SEARCH articles USING INDEX sqlite_autoindex_articles_1 (id=?)')
+
+
+def test_ids_count_is_covering():
+    steps = plan(lambda conn: count_articles(conn, ids=['1', '2', '3']))
+    assert steps == ['SEARCH articles USING COVERING INDEX sqlite_autoindex_articles_1 (id=?)']
+
+
+def test_upload_candidates():
+    steps = plan(lambda conn: get_upload_candidates(conn, 'article', limit=10))
+    assert_no_scan(steps)
+    assert steps[0] == 'SEARCH articles USING INDEX idx_articles_upload_candidates (uploader_fans_count<?)'
+    assert (
+        'SEARCH main.publications USING COVERING INDEX idx_publications_kind_status '
+        '(kind=? AND status=? AND article_id=?)'
+    ) in steps
@@ -0,0 +1,51 @@
+import asyncio
+
+import aiosqlite
+
+from dao.article import Article, create_table_article, insert_articles, update_articles, get_snapshots
+
+
+def _article(id_: str) -> Article:
+    return Article(
+        id=id_,
+        title=f'标题{id_}',
+        url=f'https://www.toutiao.com/article/{id_}/',
+        category='科技',
+        keyword='手机',
+    )
+
+
+def test_snapshot_reads_stored_values():
+    async def run():
+        async with aiosqlite.connect(':memory:') as conn:
+            await create_table_article(conn)
+            await insert_articles(conn, [_article('1')])
+            article = _article('1')
+            article.like_count = 5
+            article.comment_count = 1
+            article.collect_count = 2
+            article.uploader_fans_count = 100
+            await update_articles(conn, [article])
+            await conn.execute('DELETE FROM article_snapshots')
+            # 只改了点赞数的模型，其他互动数据还是默认值-1，快照里要是数据库里的值
+            article = _article('1')
+            article.like_count = 7
+            await update_articles(conn, [article])
+            snapshot, = await get_snapshots(conn, '1')
+            assert (snapshot.like_count, snapshot.comment_count, snapshot.collect_count) == (7, 1, 2)
+            assert snapshot.uploader_fans_count == 100
+    asyncio.run(run())
+
+
+def test_no_snapshot_before_detail():
+    async def run():
+        async with aiosqlite.connect(':memory:') as conn:
+            await create_table_article(conn)
+            # 搜索接口只给了点赞数和评论数，收藏数和粉丝数还没爬到
+            article = _article('2')
+            article.like_count = 3
+            article.comment_count = 0
+            await insert_articles(conn, [article])
+            await update_articles(conn, [article])
+            assert await get_snapshots(conn, '2') == []
+    asyncio.run(run())
@@ -0,0 +1,107 @@
+from pathlib import Path
+
+from scrape.article import _links2articles, _records2articles
+from scrape.capture import SearchRecord, parse_search_json, is_article_url, is_video_url
+from scrape.extract import SearchLink, parse_search_html
+from scrape.video import _links2videos, _records2videos
+
+
+'''
+搜索结果的链接白名单：文章搜索只要头条文章的链接，视频搜索只要头条视频的链接
+'''
+
+
+PAYLOAD = {
+    'data': [
+        {
+            'title': '2024年<em>手机</em>选购指南',
+            'article_url': 'https://www.toutiao.com/a7301234567890123456/',
+            'publish_time': 1709861400,
+            'comment_count': 356,
+            'digg_count': '12000',
+        },
+        {
+            'title': '折叠屏<em>手机</em>一年体验',
+            'share_url': '/search/jump?url=https%3A%2F%2Fwww.toutiao.com%2Farticle%2F7309876543210987654%2F&aid=4916',
+        },
+        {'title': '老人手机怎么选', 'display_url': 'http://toutiao.com/group/7290011122233344455/'},
+        {'title': '微头条：新买的手机到了', 'url': 'https://www.toutiao.com/w/1785566778899001122/'},
+        {'title': '手机拍照技巧', 'article_url': 'https://www.toutiao.com/video/7312223334445556667/'},
+        # 下面这些都不是搜索结果
+        {'title': '科技数码说', 'source_url': 'https://www.toutiao.com/c/user/token/MS4wLjABAAAAabcdefg/'},
+        {'title': '手机推荐', 'url': '/search/?keyword=%E6%89%8B%E6%9C%BA%E6%8E%A8%E8%8D%90'},
+        {'title': '广告', 'url': 'https://ad.toutiao.com/a7301234567890123457/'},
+        {'title': '站外', 'url': 'https://example.com/toutiao.com/a7301234567890123458/'},
+        {'title': '不完整的跳转', 'url': '/search/jump?aid=4916'},
+        {'title': '不是数字', 'url': 'https://www.toutiao.com/article/abc/'},
+        {'title': '首页', 'url': 'https://www.toutiao.com'},
+    ],
+}
+
+
+def test_parse_search_json_whitelist():
+    urls = [record.url for record in parse_search_json(PAYLOAD)]
+    assert urls == [
+        'https://www.toutiao.com/a7301234567890123456/',
+        'https://www.toutiao.com/article/7309876543210987654/',
+        'http://toutiao.com/group/7290011122233344455/',
+        'https://www.toutiao.com/w/1785566778899001122/',
+        'https://www.toutiao.com/video/7312223334445556667/',
+    ]
+
+
+def test_is_article_url():
+    assert is_article_url('https://www.toutiao.com/a7301234567890123456/?channel=&source=search_tab')
+    assert is_article_url('https://www.toutiao.com/article/7309876543210987654')
+    assert not is_article_url('https://www.toutiao.com/video/7312223334445556667/')
+    assert not is_article_url('https://www.toutiao.com/a7301234567890123456/comments/')
+    assert not is_article_url('/a7301234567890123456/')
+
+
+def test_records2articles_skips_non_articles():
+    records = parse_search_json(PAYLOAD) + [
+        SearchRecord(url='https://www.toutiao.com/c/user/token/MS4wLjABAAAAabcdefg/', title='用户'),
+    ]
+    articles = _records2articles(records, '科技', '手机')
+    assert [article.id for article in articles] == [
+        'a7301234567890123456',
+        'article/7309876543210987654',
+        'group/7290011122233344455',
+        'w/1785566778899001122',
+    ]
+    assert articles[0].title == '2024年手机选购指南'
+    assert articles[0].comment_count == 356 and articles[0].like_count == 12000
+
+
+def test_links2articles_skips_non_articles():
+    html = (Path(__file__).parent / 'fixtures' / 'search.html').read_text(encoding='utf-8')
+    articles = _links2articles(parse_search_html(html), '科技', '手机')
+    # 视频结果被跳过，不是跳转链接的结果本来就不要
+    assert [article.id for article in articles] == ['a7301234567890123456', 'article/7309876543210987654']
+    assert articles[0].url == 'https://www.toutiao.com/a7301234567890123456/?channel=&source=search_tab'
+
+
+def test_records2videos_skips_non_videos():
+    records = parse_search_json(PAYLOAD) + [
+        SearchRecord(url='/search/jump?url=https%3A%2F%2Fwww.toutiao.com%2Fvideo%2F7312223334445556668%2F&aid=4916', title='跳转'),
+        SearchRecord(url='https://www.toutiao.com/video/7312223334445556669/comments/', title='评论页'),
+        SearchRecord(url='https://www.toutiao.com/c/user/token/MS4wLjABAAAAabcdefg/', title='用户'),
+    ]
+    videos = _records2videos(records, '游戏', '原神')
+    assert [(video.id, video.url) for video in videos] == [
+        ('video/7312223334445556667', 'https://www.toutiao.com/video/7312223334445556667/'),
+        ('video/7312223334445556668', 'https://www.toutiao.com/video/7312223334445556668/'),
+    ]
+    assert videos[0].title == '手机拍照技巧'
+
+
+def test_links2videos_skips_non_videos():
+    html = (Path(__file__).parent / 'fixtures' / 'search.html').read_text(encoding='utf-8')
+    links = parse_search_html(html) + [SearchLink(href='/video/7312223334445556670/', title='相对路径')]
+    videos = _links2videos(links, '游戏', '原神')
+    # 跳转链接里url参数后面的&aid=...不能混进视频链接
+    assert [video.url for video in videos] == [
+        'https://www.toutiao.com/video/7312223334445556667/',
+        'https://www.toutiao.com/video/7312223334445556670/',
+    ]
+    assert all(is_video_url(video.url) for video in videos)
@@ -0,0 +1,87 @@
+import asyncio
+
+from aiosqlite import Connection
+
+from dao.database import Database
+
+
+'''
+写协程：一个写操作出错（包括CancelledError）只回滚它自己，写协程停掉时调用方不会一直等
+'''
+
+
+async def _create(conn: Connection) -> None:
+    await conn.execute('CREATE TABLE IF NOT EXISTS t (`v` INTEGER)')
+    await conn.commit()
+
+
+async def _insert(conn: Connection, v: int) -> None:
+    await conn.execute('INSERT INTO t (`v`) VALUES (?)', (v,))
+    await conn.commit()
+
+
+async def _insert_then_cancelled(conn: Connection, v: int) -> None:
+    await conn.execute('INSERT INTO t (`v`) VALUES (?)', (v,))
+    raise asyncio.CancelledError()
+
+
+async def _insert_then_rollback(conn: Connection, v: int) -> None:
+    await conn.execute('INSERT INTO t (`v`) VALUES (?)', (v,))
+    await conn.rollback()
+
+
+async def _values(conn: Connection) -> list[int]:
+    cur = await conn.execute('SELECT `v` FROM t ORDER BY `v`')
+    return [row[0] for row in await cur.fetchall()]
+
+
+def _results(results: list) -> list:
+    return [type(r).__name__ if isinstance(r, BaseException) else r for r in results]
+
+
+def test_failed_job_rolls_back_only_itself(tmp_path):
+    async def run():
+        async with Database(str(tmp_path / 'data.db')) as db:
+            await db.write(_create)
+            # 一起提交的写操作在同一个事务里
+            results = await asyncio.gather(
+                db.write(_insert, 1),
+                db.write(_insert_then_cancelled, 2),
+                db.write(_insert_then_rollback, 3),
+                db.write(_insert, 4),
+                return_exceptions=True,
+            )
+            assert _results(results) == [None, 'CancelledError', 'RuntimeError', None]
+            # 写协程还活着
+            await asyncio.wait_for(db.write(_insert, 5), 5)
+            assert await db.read(_values) == [1, 4, 5]
+    asyncio.run(run())
+
+
+def test_writer_cancelled_fails_pending_writes(tmp_path):
+    async def run():
+        started = asyncio.Event()
+
+        async def slow_insert(conn: Connection, v: int) -> None:
+            await conn.execute('INSERT INTO t (`v`) VALUES (?)', (v,))
+            started.set()
+            await asyncio.sleep(60)
+
+        async with Database(str(tmp_path / 'data.db')) as db:
+            await db.write(_create)
+            await db.write(_insert, 1)
+            running = asyncio.create_task(db.write(slow_insert, 2))
+            queued = asyncio.create_task(db.write(_insert, 3))
+            await started.wait()
+            db._writer_task.cancel()
+            results = await asyncio.wait_for(asyncio.gather(running, queued, return_exceptions=True), 5)
+            assert all(isinstance(r, BaseException) for r in results), results
+            try:
+                await db.write(_insert, 4)
+            except RuntimeError:
+                pass
+            else:
+                raise AssertionError('write after the writer stopped should fail')
+            # 写协程停掉时开着的事务已经回滚，读连接不会被锁住
+            assert await db.read(_values) == [1]
+    asyncio.run(run())
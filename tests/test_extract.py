@@ -0,0 +1,193 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from scrape.extract import (
+    ArticleDetail, SearchLink, UploaderStats, VideoDetail,
+    parse_search_html, parse_article_html, parse_uploader_html, parse_video_html, parse_login_html,
+    _SEARCH_JS, _ARTICLE_JS, _UPLOADER_JS, _VIDEO_JS, _LOGIN_JS,
+)
+from scrape.markdown import html_to_markdown
+
+
+'''
+页面数据提取：parse_*_html的bs4、lxml两个后端对保存下来的页面的提取结果，
+以及page.evaluate里的js和parse_*_html的结果一致
+
+fixtures里的页面按头条真实页面的结构裁剪，保留了选择器用到的元素和容易出错的地方
+（标题里的script、style和注释，点赞数前面的图标，页头里不在#root里的video等）
+'''
+
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+
+
+def fixture(name: str) -> str:
+    return (FIXTURES / f'{name}.html').read_text(encoding='utf-8')
+
+
+EXPECTED_SEARCH = [
+    SearchLink(
+        href='/search/jump?url=https%3A%2F%2Fwww.toutiao.com%2Fa7301234567890123456%2F%3Fchannel%3D%26source%3Dsearch_tab&aid=4916&jtoken=c47d820a',
+        title='2024年手机选购指南：这几款手机值得买',
+    ),
+    SearchLink(
+        href='/search/jump?url=https%3A%2F%2Fwww.toutiao.com%2Farticle%2F7309876543210987654%2F&aid=4916',
+        title='折叠屏手机一年体验：优点和缺点都很明显',
+    ),
+    SearchLink(href='https://www.toutiao.com/group/7290011122233344455/', title='老人手机怎么选？看完这篇就懂了'),
+    SearchLink(
+        href='/search/jump?url=https%3A%2F%2Fwww.toutiao.com%2Fvideo%2F7312223334445556667%2F&aid=4916',
+        title='手机拍照技巧，一分钟学会',
+    ),
+    SearchLink(href='https://www.toutiao.com/w/1785566778899001122/', title='微头条：新买的手机到了'),
+]
+
+EXPECTED_MARKDOWN = '''今年的**旗舰手机**普遍升级了影像和续航，下面按价位给出建议。
+
+一、三千元以内
+-------
+
+这个价位优先看*处理器*和屏幕，详细参数见[上一篇](https://www.toutiao.com/a7299999999999999999/)。
+
+![](https://p3-sign.toutiaoimg.com/tos-cn-i-6w9my0ksvp/a1b2c3~tplv-tt-origin-web:gif.jpeg)
+
+图片来源：网络
+
+> 续航比跑分更重要。
+
+* 屏幕：OLED优先
+* 充电：65W以上
+
+二、五千元左右
+-------
+
+1. 影像
+2. 系统更新年限
+
+以上就是全部内容，欢迎在评论区交流。'''
+
+EXPECTED_ARTICLE = ArticleDetail(
+    meta='2024-03-08 09:30·科技数码说原创',
+    like='1.2万',
+    comment='356',
+    collect='2,048',
+    has_interaction=True,
+    user_href='/c/user/token/MS4wLjABAAAAabcdefg/?source=tuwen_detail',
+    markdown=EXPECTED_MARKDOWN,
+)
+
+EXPECTED_UPLOADER = UploaderStats(fans='12.3万', fans_unit='万')
+
+EXPECTED_VIDEO = VideoDetail(
+    src='https://v3-web.toutiaovod.com/abcdef0123456789/video/tos/cn/tos-cn-ve-4/oQ1/?a=24&br=1024&mime_type=video_mp4',
+)
+
+
+@pytest.fixture(params=['bs4', 'lxml'])
+def backend(request) -> str:
+    return request.param
+
+
+def without_html(detail: ArticleDetail) -> ArticleDetail:
+    '''
+    正文html的序列化方式和解析器有关，比较时去掉html，只比较转成的markdown
+    '''
+    assert detail.html is None or detail.html.startswith('<article class="syl-article-base')
+    detail.html = None
+    return detail
+
+
+def test_search(backend):
+    assert parse_search_html(fixture('search'), backend) == EXPECTED_SEARCH
+
+
+def test_article(backend):
+    detail = parse_article_html(fixture('article'), True, backend)
+    assert detail.html is not None
+    assert without_html(detail) == EXPECTED_ARTICLE
+
+
+def test_article_without_markdown(backend):
+    detail = parse_article_html(fixture('article'), False, backend)
+    assert detail.markdown is None
+    assert html_to_markdown(detail.html) == EXPECTED_MARKDOWN
+
+
+def test_article_blocked(backend):
+    # 验证码中间页，什么都没有
+    assert parse_article_html(fixture('verify'), True, backend) == ArticleDetail()
+
+
+def test_uploader(backend):
+    assert parse_uploader_html(fixture('uploader'), backend) == EXPECTED_UPLOADER
+    assert parse_uploader_html(fixture('article'), backend) == UploaderStats()
+
+
+def test_video(backend):
+    assert parse_video_html(fixture('video'), backend) == EXPECTED_VIDEO
+    assert parse_video_html(fixture('article'), backend) == VideoDetail()
+
+
+def test_login(backend):
+    assert parse_login_html(fixture('login'), backend) is True
+    assert parse_login_html(fixture('logout'), backend) is False
+
+
+def test_empty(backend):
+    assert parse_search_html('', backend) == []
+    assert parse_article_html('', True, backend) == ArticleDetail()
+    assert parse_uploader_html('', backend) == UploaderStats()
+    assert parse_video_html('', backend) == VideoDetail()
+    assert parse_login_html('', backend) is False
+
+
+@pytest.mark.parametrize('name', ['search', 'article', 'verify', 'uploader', 'video', 'login', 'logout'])
+def test_backends_agree(name):
+    html = fixture(name)
+    for parse in (parse_search_html, parse_uploader_html, parse_video_html, parse_login_html):
+        assert parse(html, 'bs4') == parse(html, 'lxml')
+    bs4_detail = parse_article_html(html, True, 'bs4')
+    lxml_detail = parse_article_html(html, True, 'lxml')
+    assert without_html(bs4_detail) == without_html(lxml_detail)
+
+
+async def _evaluate_all() -> dict[str, object]:
+    from playwright.async_api import async_playwright, Error
+    cases = {
+        'search': ('search', _SEARCH_JS),
+        'article': ('article', _ARTICLE_JS),
+        'verify': ('verify', _ARTICLE_JS),
+        'uploader': ('uploader', _UPLOADER_JS),
+        'video': ('video', _VIDEO_JS),
+        'login': ('login', _LOGIN_JS),
+        'logout': ('logout', _LOGIN_JS),
+    }
+    async with async_playwright() as p:
+        try:
+            browser = await p.chromium.launch()
+        except Error as e:
+            pytest.skip(f'没有可用的Chromium：{e.message.splitlines()[0]}')
+        try:
+            page = await browser.new_page()
+            results = {}
+            for name, (page_name, js) in cases.items():
+                await page.set_content(fixture(page_name))
+                results[name] = await page.evaluate(js)
+            return results
+        finally:
+            await browser.close()
+
+
+def test_evaluate_matches_html_parsers():
+    results = asyncio.run(_evaluate_all())
+    assert [SearchLink(**link) for link in results['search']] == parse_search_html(fixture('search'))
+    for name in ('article', 'verify'):
+        detail = ArticleDetail(**results[name])
+        if detail.html is not None:
+            detail.markdown = html_to_markdown(detail.html)
+        assert without_html(detail) == without_html(parse_article_html(fixture(name)))
+    assert UploaderStats(**results['uploader']) == parse_uploader_html(fixture('uploader'))
+    assert VideoDetail(**results['video']) == parse_video_html(fixture('video'))
+    assert results['login'] is True and results['logout'] is False
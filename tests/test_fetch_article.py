@@ -0,0 +1,65 @@
+import asyncio
+from pathlib import Path
+
+from dao.article import Article
+from scrape import article as scrape_article
+from scrape.article import _detail_complete
+from scrape.extract import parse_article_html
+
+
+'''
+直接请求拿到的文章页只有字段齐全时才用，不然退回到浏览器；重新爬取只统计真正更新了的文章
+'''
+
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+
+
+def article_html() -> str:
+    return (FIXTURES / 'article.html').read_text(encoding='utf-8')
+
+
+def test_complete_page():
+    assert _detail_complete(parse_article_html(article_html(), False))
+
+
+def test_captcha_page():
+    html = (FIXTURES / 'verify.html').read_text(encoding='utf-8')
+    assert not _detail_complete(parse_article_html(html, False))
+
+
+def test_missing_fields():
+    # 服务端渲染的页面里有正文，但作者、互动数据、发布时间是前端渲染的
+    html = article_html()
+    for old, new in (
+        ('class="user-name"', 'class="user-name-placeholder"'),
+        ('class="detail-side-interaction"', 'class="detail-side"'),
+        ('class="detail-interaction-collect"', 'class="detail-interaction"'),
+        ('<span class="dot">·</span>', ''),
+        ('class="article-meta"', 'class="article-meta-placeholder"'),
+        ('class="syl-article-base', 'class="article-base'),
+    ):
+        assert old in html
+        assert not _detail_complete(parse_article_html(html.replace(old, new), False)), old
+
+
+def test_refresh_counts_only_saved_articles(monkeypatch):
+    articles = [
+        Article(id=id_, title=id_, url=f'https://www.toutiao.com/article/{id_}/', category='科技', keyword='手机')
+        for id_ in ('saved', 'blocked', 'error')
+    ]
+
+    class FakeDatabase:
+        async def read(self, func, *args, **kwargs):
+            if func is scrape_article.get_stale_articles:
+                return [(article.id, 1.0) for article in articles]
+            return articles
+
+    async def fake_fetch(page_pool, db, article, *args, **kwargs):
+        if article.id == 'error':
+            raise RuntimeError('page crashed')
+        return article, article.id == 'saved'
+
+    monkeypatch.setattr(scrape_article, 'fetch_article_info', fake_fetch)
+    refreshed = asyncio.run(scrape_article.refresh_stale_articles(None, FakeDatabase(), 3))
+    assert refreshed == 1
@@ -0,0 +1,27 @@
+import asyncio
+
+from scrape.fetcher import HttpFetcher
+
+
+class FakeContext:
+    def __init__(self, cookies: list[dict]) -> None:
+        self._cookies = cookies
+
+    async def cookies(self) -> list[dict]:
+        return self._cookies
+
+
+def test_sync_cookies_skips_illegal_names():
+    async def run():
+        context = FakeContext([
+            {'name': 'ttwid', 'value': '1%7Cabc', 'domain': '.toutiao.com', 'path': '/'},
+            {'name': 'bad name', 'value': 'x', 'domain': '.toutiao.com', 'path': '/'},
+            {'name': 'a,b', 'value': 'y', 'domain': 'www.toutiao.com', 'path': '/'},
+            {'name': 's_v_web_id', 'value': 'verify_xyz', 'domain': 'www.toutiao.com', 'path': '/'},
+            {'name': 'no_domain', 'value': 'z', 'domain': '', 'path': '/'},
+        ])
+        async with HttpFetcher() as http:
+            http.attach(context)  # type: ignore[arg-type]
+            await http._sync_cookies()
+            return sorted(cookie.key for cookie in http._session.cookie_jar)
+    assert asyncio.run(run()) == ['s_v_web_id', 'ttwid']
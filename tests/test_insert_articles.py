@@ -0,0 +1,40 @@
+import asyncio
+
+import aiosqlite
+
+import dao.article
+from dao.article import Article, create_table_article, insert_articles, count_articles
+
+
+def _article(id_: str) -> Article:
+    return Article(
+        id=id_,
+        title=f'标题{id_}',
+        url=f'https://www.toutiao.com/article/{id_}/',
+        category='科技',
+        keyword='手机',
+    )
+
+
+def test_only_new_titles_are_segmented(monkeypatch):
+    segmented: list[str] = []
+    segment = dao.article._segment
+
+    def counting_segment(text: str) -> str:
+        segmented.append(text)
+        return segment(text)
+
+    monkeypatch.setattr(dao.article, '_segment', counting_segment)
+
+    async def run():
+        async with aiosqlite.connect(':memory:') as conn:
+            await create_table_article(conn)
+            assert await insert_articles(conn, [_article('1'), _article('2')]) == (2, 0)
+            assert segmented == ['标题1', '标题2']
+            segmented.clear()
+            # 重新爬到的搜索页：大部分已经存过，还有同一批里重复的
+            result = await insert_articles(conn, [_article('1'), _article('3'), _article('2'), _article('3')])
+            assert result == (1, 3)
+            assert segmented == ['标题3']
+            assert await count_articles(conn) == 3
+    asyncio.run(run())
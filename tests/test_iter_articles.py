@@ -0,0 +1,36 @@
+import asyncio
+
+import aiosqlite
+
+from dao.article import Article, create_table_article, insert_articles, iter_articles
+
+
+def _article(id_: str, category: str) -> Article:
+    return Article(
+        id=id_,
+        title=f'标题{id_}',
+        url=f'https://www.toutiao.com/article/{id_}/',
+        category=category,
+        keyword='关键词',
+    )
+
+
+def test_iter_articles_generator_filters_every_batch():
+    async def run():
+        async with aiosqlite.connect(':memory:') as conn:
+            await create_table_article(conn)
+            categories = ['科技', '游戏', '体育']
+            await insert_articles(conn, [_article(f'{i:03d}', categories[i % 3]) for i in range(30)])
+            # 条件是生成器，要分好几批才能读完
+            got = [
+                article async for article in iter_articles(
+                    conn,
+                    exclude_categories=(c for c in ('游戏', '体育')),
+                    ids=(f'{i:03d}' for i in range(30)),
+                    columns=('id', 'category'),
+                    batch_size=3,
+                )
+            ]
+            assert [article.id for article in got] == [f'{i:03d}' for i in range(0, 30, 3)]
+            assert {article.category for article in got} == {'科技'}
+    asyncio.run(run())
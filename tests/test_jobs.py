@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+import aiosqlite
+
+from dao.job import Job, create_table_jobs, enqueue_jobs, claim_jobs, complete_job, fail_job, count_jobs
+from dao.job import heartbeat_jobs, requeue_jobs, _keep_lease
+
+
+async def _expire(conn: aiosqlite.Connection) -> None:
+    await conn.execute("UPDATE jobs SET `lease_until` = ? WHERE `state` = 'running'", (time.time() - 1,))
+    await conn.commit()
+
+
+def test_expired_lease_fails_after_max_attempts():
+    async def run():
+        async with aiosqlite.connect(':memory:') as conn:
+            await create_table_jobs(conn)
+            await enqueue_jobs(conn, [Job(kind='search_page', key='a')])
+            # 每次领取之后worker都崩溃了，租约过期
+            for attempt in range(1, 4):
+                jobs = await claim_jobs(conn, 'search_page', worker='w', max_attempts=3)
+                assert [job.attempts for job in jobs] == [attempt]
+                await _expire(conn)
+            assert await claim_jobs(conn, 'search_page', worker='w', max_attempts=3) == []
+            counts = await count_jobs(conn, 'search_page')
+            assert counts['failed'] == 1 and counts['pending'] == 0 and counts['running'] == 0
+    asyncio.run(run())
+
+
+def test_stale_worker_cannot_finish_reclaimed_job():
+    async def run():
+        async with aiosqlite.connect(':memory:') as conn:
+            await create_table_jobs(conn)
+            await enqueue_jobs(conn, [Job(kind='search_page', key='a')])
+            job, = await claim_jobs(conn, 'search_page', worker='old')
+            await _expire(conn)
+            reclaimed, = await claim_jobs(conn, 'search_page', worker='new')
+            assert reclaimed.job_id == job.job_id
+            # 原来的worker处理完了，但任务已经不在它手上
+            assert not await complete_job(conn, job.job_id, worker='old')
+            assert not await fail_job(conn, job.job_id, 'timeout', worker='old')
+            assert (await count_jobs(conn, 'search_page'))['running'] == 1
+            assert await complete_job(conn, job.job_id, worker='new')
+            # 已经完成的任务不能再被标记
+            assert not await complete_job(conn, job.job_id, worker='new')
+            assert (await count_jobs(conn, 'search_page'))['done'] == 1
+    asyncio.run(run())
+
+
+def test_stale_worker_cannot_extend_reclaimed_lease():
+    async def run():
+        async with aiosqlite.connect(':memory:') as conn:
+            await create_table_jobs(conn)
+            await enqueue_jobs(conn, [Job(kind='search_page', key='a')])
+            job, = await claim_jobs(conn, 'search_page', worker='old')
+            await _expire(conn)
+            await claim_jobs(conn, 'search_page', worker='new')
+            assert await heartbeat_jobs(conn, [job.job_id], 600, worker='old') == 0
+            assert await heartbeat_jobs(conn, [job.job_id], 600, worker='new') == 1
+    asyncio.run(run())
+
+
+class _FlakyDatabase:
+    '''
+    第一次写入失败，之后续租成功，第四次起租约已经被别人领走
+    '''
+    def __init__(self) -> None:
+        self.calls = 0
+
+    async def write(self, func, *args, **kwargs) -> int:
+        self.calls += 1
+        if self.calls == 1:
+            raise RuntimeError('database is locked')
+        return 1 if self.calls < 4 else 0
+
+
+def test_keep_lease_survives_failed_heartbeat():
+    async def run():
+        db = _FlakyDatabase()
+        job = Job(job_id=1, kind='search_page', key='a')
+        # 续租失败不会让续租协程退出，租约被领走之后才停下
+        await asyncio.wait_for(_keep_lease(db, job, 0.03, 'w'), 5)
+        assert db.calls == 4
+    asyncio.run(run())
+
+
+def test_requeue_only_failed_jobs():
+    async def run():
+        async with aiosqlite.connect(':memory:') as conn:
+            await create_table_jobs(conn)
+            await enqueue_jobs(conn, [Job(kind='article_detail', key=key) for key in ('done', 'failed', 'pending')])
+            done, failed = await claim_jobs(conn, 'article_detail', 2, worker='w')
+            assert await complete_job(conn, done.job_id, worker='w')
+            assert await fail_job(conn, failed.job_id, 'blocked', max_attempts=1, worker='w')
+            # 跳转到视频的文章没有正文，但任务已经done了，不能每次运行都重新做一遍
+            assert await requeue_jobs(conn, 'article_detail', ['done', 'failed', 'pending']) == 1
+            counts = await count_jobs(conn, 'article_detail')
+            assert counts['done'] == 1 and counts['pending'] == 2 and counts['failed'] == 0
+    asyncio.run(run())
@@ -0,0 +1,68 @@
+from pathlib import Path
+
+import pytest
+from markdownify import markdownify
+
+from scrape.extract import parse_article_html
+from scrape.markdown import html_to_markdown
+
+
+'''
+html_to_markdown和markdownify逐字相同
+
+tests/fixtures/markdown里每个样例一对文件：name.html是正文，name.md是markdownify(正文)的输出，
+markdownify升级后输出变了的话，先确认新的输出，再重新生成.md文件
+'''
+
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+MARKDOWN_FIXTURES = FIXTURES / 'markdown'
+NAMES = sorted(path.stem for path in MARKDOWN_FIXTURES.glob('*.html'))
+
+
+def golden(name: str) -> tuple[str, str]:
+    '''
+    :return: 正文html和期望的markdown
+    '''
+    html = (MARKDOWN_FIXTURES / f'{name}.html').read_text(encoding='utf-8')
+    expected = (MARKDOWN_FIXTURES / f'{name}.md').read_text(encoding='utf-8')
+    return html, expected
+
+
+def test_fixtures_found():
+    assert 'paragraphs' in NAMES and 'fallback' in NAMES
+
+
+@pytest.mark.parametrize('name', NAMES)
+def test_golden(name):
+    html, expected = golden(name)
+    assert html_to_markdown(html) == expected
+
+
+@pytest.mark.parametrize('name', NAMES)
+def test_golden_matches_markdownify(name):
+    # .md文件要和当前安装的markdownify一致，不然上面的比较没有意义
+    html, expected = golden(name)
+    assert markdownify(html) == expected
+
+
+def test_long_article():
+    # 所有支持的样例拼成一篇长文章，块之间的空行也要和markdownify一样
+    bodies = [
+        golden(name)[0].strip().removeprefix('<article class="syl-article-base">').removesuffix('</article>')
+        for name in NAMES if name != 'fallback'
+    ]
+    html = '<article class="syl-article-base">' + ''.join(bodies) * 3 + '</article>'
+    assert html_to_markdown(html) == markdownify(html)
+
+
+def test_article_page():
+    html = (FIXTURES / 'article.html').read_text(encoding='utf-8')
+    body = parse_article_html(html, with_markdown=False).html
+    assert body is not None
+    assert html_to_markdown(body) == markdownify(body)
+
+
+def test_empty():
+    assert html_to_markdown('') == markdownify('')
+    assert html_to_markdown('  \n') == markdownify('  \n')
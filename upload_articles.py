@@ -6,18 +6,22 @@ from itertools import batched
 from random import shuffle
 
 from playwright.async_api import async_playwright
-from aiosqlite import connect
 import yaml
 
+from dao.database import Database
+from dao.dao_utils import set_slow_query_threshold, dump_sql_stats
 from dao.user import User
 from dao.article import Article
 from dao.user import all_users
-from dao.article import all_articles
+from dao.article import get_upload_candidates, load_contents
+from dao.publication import create_table_publications, count_publications
 from scrape.user import upload_微头条
 
 
 
 HEADLESS = False
+# 一次运行最多发布多少篇文章
+MAX_ARTICLES = 300
 
 LOGGER = getLogger(__name__)
 LOGGER.setLevel('INFO')
@@ -39,23 +43,32 @@ async def main():
         return
     config = yaml.safe_load(config_file.read_text(encoding='utf-8'))
     playwright_config = config.get('playwright', {})
-    async with connect('data.db') as conn:
-        users: list[User] = await all_users(conn)
-        articles: list[Article] = await all_articles(conn)
-    articles = [
-        article for article in articles
-        if len(article.content) > 200
-        and article.uploader_fans_count < 100000
-        and article.category != '游戏'
-    ]
-    batched_articles = batched(
-        articles,
-        n = len(articles) // len(users) + 1
-    )
-    # print(len(list(batched_articles)), len(users))
+    sqlite_config = config.get('sqlite', {})
+    set_slow_query_threshold(sqlite_config.pop('slow_query_threshold', None))
     async with (
+        Database('data.db', **sqlite_config) as db,
         async_playwright() as p,
     ):
+        await db.write(create_table_publications)
+        users: list[User] = await db.read(all_users, validate=False)
+        users = users[3:5]
+        LOGGER.info(f'微头条发布情况：{await db.read(count_publications, "weitoutiao")}')
+        # 筛选条件都在sql里，已经发布成功过的文章也在sql里排除掉了，
+        # 重新运行不会再洗稿、发布一遍。这里只读元数据，选中的文章再读正文
+        articles: list[Article] = await db.read(
+            get_upload_candidates,
+            'weitoutiao',
+            min_content_length=200,
+            max_fans=100000,
+            exclude_categories=('游戏',),
+            limit=MAX_ARTICLES,
+        )
+        await db.read(load_contents, articles)
+        LOGGER.info(f'本次发布 {len(articles)} 篇文章')
+        batched_articles = batched(
+            articles,
+            n = len(articles) // len(users) + 1
+        )
         browser = await p.chromium.launch(
             headless=HEADLESS,
             args=[
@@ -65,9 +78,6 @@ async def main():
                 '--start-maximized',
             ]
         )
-        users = users[3:5]
-        # articles = [random.choice(articles)]
-        articles = articles[:300]
         tasks = []
         semaphore = Semaphore(playwright_config['max_pages_count'])
         for user, user_articles in zip(users, batched_articles):
@@ -78,10 +88,12 @@ async def main():
                 article,
                 semaphore,
                 extra_headers=HEADERS,
+                db=db,
             )
             for article in user_articles])
         shuffle(tasks)
         await asyncio.gather(*tasks, return_exceptions=True)
+    LOGGER.info(f'数据库调用统计：\n{dump_sql_stats()}')
 
 
 if __name__ == '__main__':
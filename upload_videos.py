@@ -2,6 +2,7 @@ import asyncio
 from asyncio import Queue
 from pathlib import Path
 from typing import cast
+from logging import getLogger, basicConfig, INFO
 
 from playwright.async_api import async_playwright
 from playwright.async_api import Page, Browser, BrowserContext
@@ -9,12 +10,21 @@ from playwright._impl._api_structures import Cookie, SetCookieParam
 
 import aiosqlite
 
-from scrape.user import validate_cookies, upload_video
+from scrape.user import validate_cookies, upload_video, video_id
+from dao.database import Database
 from dao.user import create_table_users, all_users, insert_user, create_table_users
 from dao.user import User
+from dao.publication import create_table_publications, count_publications, get_published_ids
 
 
+LOGGER = getLogger(__name__)
+LOGGER.setLevel('INFO')
+basicConfig(level=INFO)
+
 MAX_PAGES = 1
+# 一次运行最多上传多少个视频
+MAX_VIDEOS = 1
+VIDEO_DIR = Path() / 'videos'
 DOMAIN = 'https://www.toutiao.com'
 WAIT_TIME = 1000000
 
@@ -29,6 +39,7 @@ HEADERS = {
 async def main():
     async with (
         aiosqlite.connect('data.db') as conn,
+        Database('data.db') as db,
         async_playwright() as p
     ):
         # await create_table(conn)
@@ -55,9 +66,18 @@ async def main():
             for page, user in user_pages
         ]
         await asyncio.gather(*validate_cookies_tasks)
-        await upload_video(*user_pages[0], Path() / 'videos' / '20260127_021412.mp4')
-        
-        
+        await db.write(create_table_publications)
+        LOGGER.info(f'视频发布情况：{await db.read(count_publications, "video")}')
+        # 已经上传成功过的视频不再上传，中途退出后重新运行也不会重复上传
+        published = set(await db.read(get_published_ids, ('video',)))
+        videos = [
+            video for video in sorted(VIDEO_DIR.glob('*.mp4'))
+            if video_id(video) not in published
+        ][:MAX_VIDEOS]
+        LOGGER.info(f'本次上传 {len(videos)} 个视频')
+        for video in videos:
+            await upload_video(*user_pages[0], video, db=db)
+
 
 if __name__ == '__main__':
     asyncio.run(main())
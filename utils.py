@@ -1,6 +1,3 @@
-from typing import AsyncIterator
-from contextlib import asynccontextmanager
-from asyncio import Queue
 from http.cookies import SimpleCookie
 import asyncio
 
@@ -8,17 +5,7 @@ from playwright._impl._api_structures import SetCookieParam
 from playwright.async_api import Page
 from bs4 import BeautifulSoup
 
-
-@asynccontextmanager
-async def queue_elem[T](queue: Queue[T]) -> AsyncIterator[T]:
-    '''
-    异步上下文管理器，用于从队列中获取元素，并在完成后放回队列中
-
-    :param queue: 队列
-    '''
-    elem: T = await queue.get()
-    yield elem
-    await queue.put(elem)
+from scrape.extract import extract_login
 
 
 def cookies2plawrightfmt(
@@ -47,8 +34,7 @@ async def is_login(今日头条: BeautifulSoup | Page) -> bool:
     :param soup_今日头条: 今日头条的 BeautifulSoup | Page 对象
     '''
     if isinstance(今日头条, Page):
-        html_content = await 今日头条.content()
-        今日头条 = BeautifulSoup(html_content, 'lxml')
+        return await extract_login(今日头条)
     return 今日头条.select_one('div.user-icon') is not None
 
 